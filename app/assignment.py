@@ -0,0 +1,563 @@
+"""
+Motor de asignacion de recursos a cupos para /api/auto-schedule.
+
+Antes el cupo i tomaba el vehiculo i, el conductor i y el auxiliar i en el
+orden del listado: no miraba rotacion, dias consecutivos, permisos ni ciudad, y
+si un recurso no servia el cupo quedaba vacio aunque sobraran otros.
+
+Ahora cada par (cupo, recurso) tiene un costo ponderado y se resuelve un
+emparejamiento bipartito de costo minimo por tipo de recurso (vehiculos,
+conductores, auxiliares). El costo es separable (cupo, vehiculo) +
+(cupo, conductor) + (cupo, auxiliar), asi que las tres asignaciones
+independientes dan el optimo del problema conjunto. La ruta define el cupo
+(su ciudad y los permisos que exige); no es un recurso exclusivo.
+
+- Pares infactibles (permisos faltantes, MAX_DIAS_CONSECUTIVOS alcanzado) no se
+  asignan nunca.
+- Cada cupo tiene ademas una columna "vacio" con costo COSTO_VACIO, por eso un
+  cupo solo queda sin recurso si no hay ninguno factible libre.
+
+Motores (MOTORES), todos con la misma firma (matriz cupos x recursos):
+- "flujo" (por defecto): flujo de costo minimo (caminos mas cortos sucesivos con
+  potenciales). El costo de un cupo solo depende de su ciudad y permisos, asi
+  que los cupos iguales se agrupan en clases con demanda y el grafo queda de
+  clases x recursos: un dia de 200 cupos se resuelve en decimas de segundo.
+- "hungarian": Hungaro fila por fila; usa scipy si esta instalado, si no la
+  version en Python puro (O(n^2 m), referencia para verificar el optimo).
+- "greedy": cada cupo toma el recurso libre mas barato, en orden.
+Ver app/bench_assignment.py.
+
+Para lotes (varias sedes el mismo dia) asignar_lote() resuelve problemas
+independientes en un pool de procesos (BATCH_WORKERS): el motor es CPU puro y
+en hilos quedaria serializado por el GIL.
+"""
+import heapq
+import logging
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import date
+from itertools import accumulate
+from typing import Any, Callable, Iterable, Optional
+
+try:
+    from scipy.optimize import linear_sum_assignment
+except ImportError:  # scipy es opcional
+    linear_sum_assignment = None
+
+logger = logging.getLogger(__name__)
+
+MAX_DIAS_CONSECUTIVOS = int(os.getenv("MAX_DIAS_CONSECUTIVOS", "6"))
+# Procesos para resolver lotes en paralelo (<= 1 resuelve en el mismo proceso)
+BATCH_WORKERS = int(os.getenv("BATCH_WORKERS", str(min(4, os.cpu_count() or 1))))
+
+# Pesos del costo (un cupo vacio debe costar mas que cualquier par factible)
+PESO_CIUDAD = float(os.getenv("ASIGNACION_PESO_CIUDAD", "50"))
+PESO_CONSECUTIVOS = float(os.getenv("ASIGNACION_PESO_CONSECUTIVOS", "10"))
+PESO_ROTACION = float(os.getenv("ASIGNACION_PESO_ROTACION", "20"))
+PESO_INACTIVO = float(os.getenv("ASIGNACION_PESO_INACTIVO", "100"))
+PESO_CARGA_SEMANA = float(os.getenv("ASIGNACION_PESO_CARGA_SEMANA", "5"))
+COSTO_VACIO = float(os.getenv("ASIGNACION_COSTO_VACIO", "1000"))
+# Dias sin asignacion a partir de los cuales ya no hay castigo por rotacion
+DIAS_ROTACION = 7
+
+_INFACTIBLE = float("inf")
+
+VEHICULOS = "vehiculos"
+CONDUCTORES = "conductores"
+AUXILIARES = "auxiliares"
+TIPOS = (VEHICULOS, CONDUCTORES, AUXILIARES)
+
+
+class Recurso:
+    """Vehiculo o persona candidata. `dato` es el modelo original (Vehiculo/Persona)."""
+
+    __slots__ = (
+        "id", "ciudad", "activo", "permisos", "dias_consecutivos", "ultima_asignacion", "viajes_semana", "dato",
+    )
+
+    def __init__(
+        self,
+        id: str,
+        dato: Any = None,
+        ciudad: Optional[str] = None,
+        activo: bool = True,
+        permisos: Optional[Iterable[str]] = (),
+        dias_consecutivos: Optional[int] = None,
+        ultima_asignacion: Optional[date] = None,
+        viajes_semana: int = 0,
+    ):
+        self.id = id
+        self.dato = dato
+        self.ciudad = ciudad or None
+        self.activo = activo
+        # None: el recurso no lleva permisos (vehiculos); los del cupo son del personal
+        self.permisos = frozenset(permisos) if permisos is not None else None
+        # None: no aplica el limite de dias consecutivos (vehiculos)
+        self.dias_consecutivos = dias_consecutivos
+        self.ultima_asignacion = ultima_asignacion
+        # Viajes ya hechos en la semana del cupo: reparte la carga de forma pareja
+        self.viajes_semana = viajes_semana
+
+
+class Cupo:
+    """Viaje a cubrir: ciudad de salida y permisos exigidos al personal."""
+
+    __slots__ = ("indice", "ruta", "ciudad", "permisos")
+
+    def __init__(self, indice: int, ruta: Any = None, ciudad: Optional[str] = None, permisos: Iterable[str] = ()):
+        self.indice = indice
+        self.ruta = ruta
+        self.ciudad = ciudad or None
+        self.permisos = frozenset(permisos)
+
+
+def costo(cupo: Cupo, recurso: Recurso, fecha: Optional[date] = None) -> float:
+    """Costo de asignar el recurso al cupo; _INFACTIBLE si no puede tomarlo."""
+    if cupo.permisos and recurso.permisos is not None and not cupo.permisos <= recurso.permisos:
+        return _INFACTIBLE
+    total = 0.0
+    if recurso.dias_consecutivos is not None:
+        if recurso.dias_consecutivos >= MAX_DIAS_CONSECUTIVOS:
+            return _INFACTIBLE
+        total += PESO_CONSECUTIVOS * recurso.dias_consecutivos
+    if cupo.ciudad and recurso.ciudad and cupo.ciudad != recurso.ciudad:
+        total += PESO_CIUDAD
+    if not recurso.activo:
+        total += PESO_INACTIVO
+    if recurso.viajes_semana:
+        total += PESO_CARGA_SEMANA * recurso.viajes_semana
+    if fecha and recurso.ultima_asignacion:
+        dias = (fecha - recurso.ultima_asignacion).days
+        if 0 <= dias < DIAS_ROTACION:
+            total += PESO_ROTACION * (DIAS_ROTACION - dias) / DIAS_ROTACION
+    return total
+
+
+def _candidatas(costos: list[list[float]], n: int) -> list[int]:
+    """
+    Columnas que vale la pena considerar: las n mas baratas de cada fila.
+    Si una fila tomara una columna fuera de sus n mejores, alguna de esas n
+    queda libre (solo hay n - 1 filas mas) y cambiarla no empeora el costo.
+    """
+    m = len(costos[0]) if costos else 0
+    if m <= n:
+        return [j for j in range(m) if any(fila[j] < _INFACTIBLE for fila in costos)]
+    elegidas: set[int] = set()
+    distintas: set[tuple] = set()
+    for fila in costos:
+        clave = tuple(fila)
+        if clave in distintas:
+            continue
+        distintas.add(clave)
+        orden = sorted((c, j) for j, c in enumerate(fila) if c < _INFACTIBLE)
+        elegidas.update(j for _, j in orden[:n])
+    return sorted(elegidas)
+
+
+def _hungaro(a: list[list[float]]) -> list[int]:
+    """
+    Hungaro con potenciales (caminos aumentantes mas cortos), O(n^2 m) para
+    n <= m. Retorna la columna de cada fila. Costos finitos.
+    """
+    n = len(a)
+    m = len(a[0])
+    u = [0.0] * (n + 1)
+    v = [0.0] * (m + 1)
+    p = [0] * (m + 1)     # p[j]: fila asignada a la columna j (1-indexado, 0 libre)
+    way = [0] * (m + 1)
+    inf = float("inf")
+    for i in range(1, n + 1):
+        p[0] = i
+        j0 = 0
+        minv = [inf] * (m + 1)
+        usada = [False] * (m + 1)
+        while True:
+            usada[j0] = True
+            i0 = p[j0]
+            fila = a[i0 - 1]
+            ui0 = u[i0]
+            delta = inf
+            j1 = 0
+            for j in range(1, m + 1):
+                if usada[j]:
+                    continue
+                cur = fila[j - 1] - ui0 - v[j]
+                if cur < minv[j]:
+                    minv[j] = cur
+                    way[j] = j0
+                if minv[j] < delta:
+                    delta = minv[j]
+                    j1 = j
+            for j in range(m + 1):
+                if usada[j]:
+                    u[p[j]] += delta
+                    v[j] -= delta
+                else:
+                    minv[j] -= delta
+            j0 = j1
+            if p[j0] == 0:
+                break
+        while j0:
+            j1 = way[j0]
+            p[j0] = p[j1]
+            j0 = j1
+    columna = [0] * n
+    for j in range(1, m + 1):
+        if p[j]:
+            columna[p[j] - 1] = j - 1
+    return columna
+
+
+def _con_vacios(costos: list[list[float]], columnas: list[int]) -> list[list[float]]:
+    """Submatriz de columnas candidatas + n columnas "vacio"; lo infactible queda caro pero finito."""
+    n = len(costos)
+    tope = COSTO_VACIO * (n + 1)
+    matriz = []
+    for fila in costos:
+        reales = [fila[j] if fila[j] < _INFACTIBLE else tope for j in columnas]
+        matriz.append(reales + [COSTO_VACIO] * n)
+    return matriz
+
+
+def _motor_hungaro(costos: list[list[float]]) -> tuple[list[Optional[int]], str]:
+    n = len(costos)
+    columnas = _candidatas(costos, n)
+    matriz = _con_vacios(costos, columnas)
+    if linear_sum_assignment is not None:
+        filas, cols = linear_sum_assignment(matriz)
+        elegidas = [0] * n
+        for fila, col in zip(filas, cols):
+            elegidas[int(fila)] = int(col)
+        solver = "scipy"
+    else:
+        elegidas = _hungaro(matriz)
+        solver = "python"
+    resultado: list[Optional[int]] = []
+    for i, col in enumerate(elegidas):
+        real = col < len(columnas) and costos[i][columnas[col]] < _INFACTIBLE
+        resultado.append(columnas[col] if real else None)
+    return resultado, solver
+
+
+def _motor_flujo(costos: list[list[float]]) -> tuple[list[Optional[int]], str]:
+    """
+    Flujo de costo minimo S -> clase (demanda) -> recurso (cap. 1) -> T, con un
+    nodo "vacio" (costo COSTO_VACIO, capacidad ilimitada) entre clase y T.
+    Cada iteracion es un Dijkstra con potenciales que se corta al llegar a T y
+    aumenta una unidad; las clases escanean sus m recursos, asi que cada
+    iteracion es O(k m) con k clases.
+    """
+    n = len(costos)
+    clases: dict[tuple, int] = {}
+    clase_de: list[int] = []
+    filas: list[list[float]] = []
+    for fila in costos:
+        clave = tuple(fila)
+        if clave not in clases:
+            clases[clave] = len(filas)
+            filas.append(fila)
+        clase_de.append(clases[clave])
+    k = len(filas)
+    m = len(costos[0])
+    vacio = k + m
+    t = k + m + 1
+    inf = float("inf")
+    pot = [0.0] * (k + m + 2)
+    demanda = [0] * k
+    for c in clase_de:
+        demanda[c] += 1
+    asignado = [-1] * m        # clase que tomo cada recurso
+    vacios = [0] * k           # cupos de cada clase mandados a "vacio"
+    # Adyacencia clase -> recursos factibles
+    factibles = [[(r, fila[r]) for r in range(m) if fila[r] < inf] for fila in filas]
+
+    for _ in range(n):
+        dist = [inf] * (k + m + 2)
+        previo = [-1] * (k + m + 2)
+        cerrado = [False] * (k + m + 2)
+        heap: list[tuple[float, int]] = []
+        for c in range(k):
+            if demanda[c] > 0:
+                dist[c] = -pot[c]
+                heapq.heappush(heap, (dist[c], c))
+
+        def relajar(u: int, w: int, costo_arista: float, d: float) -> None:
+            if cerrado[w]:
+                return
+            nd = d + costo_arista + pot[u] - pot[w]
+            if nd < dist[w]:
+                dist[w] = nd
+                previo[w] = u
+                heapq.heappush(heap, (nd, w))
+
+        while heap:
+            d, u = heapq.heappop(heap)
+            if cerrado[u] or d > dist[u]:
+                continue
+            cerrado[u] = True
+            if u == t:
+                break
+            if u < k:
+                pu = pot[u]
+                for r, c_ur in factibles[u]:
+                    w = k + r
+                    if asignado[r] == u or cerrado[w]:
+                        continue
+                    nd = d + c_ur + pu - pot[w]
+                    if nd < dist[w]:
+                        dist[w] = nd
+                        previo[w] = u
+                        heapq.heappush(heap, (nd, w))
+                relajar(u, vacio, COSTO_VACIO, d)
+            elif u < vacio:
+                r = u - k
+                duenio = asignado[r]
+                if duenio < 0:
+                    relajar(u, t, 0.0, d)
+                else:
+                    relajar(u, duenio, -filas[duenio][r], d)
+            else:
+                relajar(u, t, 0.0, d)
+                for c in range(k):
+                    if vacios[c] > 0:
+                        relajar(u, c, -COSTO_VACIO, d)
+        if dist[t] == inf:
+            break
+        tope = dist[t]
+        for x in range(k + m + 2):
+            pot[x] += min(dist[x], tope)
+        # Aumentar una unidad por el camino T <- ... <- clase origen
+        w = t
+        u = previo[w]
+        while u >= 0:
+            if u < k and k <= w < vacio:
+                asignado[w - k] = u
+            elif u < k and w == vacio:
+                vacios[u] += 1
+            elif u == vacio and w < k:
+                vacios[w] -= 1
+            origen = u
+            w, u = u, previo[u]
+        demanda[origen] -= 1
+
+    # Repartir los recursos de cada clase entre sus cupos, en orden
+    por_clase: list[list[int]] = [[] for _ in range(k)]
+    for r in range(m):
+        if asignado[r] >= 0:
+            por_clase[asignado[r]].append(r)
+    resultado: list[Optional[int]] = []
+    for c in clase_de:
+        resultado.append(por_clase[c].pop(0) if por_clase[c] else None)
+    return resultado, "python"
+
+
+def _motor_greedy(costos: list[list[float]]) -> tuple[list[Optional[int]], str]:
+    usadas: set[int] = set()
+    resultado: list[Optional[int]] = []
+    for fila in costos:
+        mejor = None
+        mejor_costo = _INFACTIBLE
+        for j, c in enumerate(fila):
+            if c < mejor_costo and j not in usadas:
+                mejor, mejor_costo = j, c
+        if mejor is not None:
+            usadas.add(mejor)
+        resultado.append(mejor)
+    return resultado, "python"
+
+
+MOTORES: dict[str, Callable[[list[list[float]]], tuple[list[Optional[int]], str]]] = {
+    "flujo": _motor_flujo,
+    "hungarian": _motor_hungaro,
+    "greedy": _motor_greedy,
+}
+
+
+def asignar(
+    cupos: list[Cupo],
+    recursos: dict[str, list[Recurso]],
+    fecha: Optional[date] = None,
+    motor: str = "flujo",
+) -> dict[str, Any]:
+    """
+    Asigna a cada cupo a lo sumo un recurso de cada tipo.
+
+    Retorna {"asignaciones": [{tipo: Recurso | None} por cupo],
+    "libres": {tipo: [Recurso]}, "objetivo", "vacios", "motor", "solver",
+    "tiempos_ms"}. `objetivo` suma los costos de los pares elegidos mas
+    COSTO_VACIO por cada recurso faltante.
+    """
+    if motor not in MOTORES:
+        raise ValueError(f"Motor de asignacion desconocido: {motor} (opciones: {', '.join(MOTORES)})")
+    resolver = MOTORES[motor]
+    asignaciones: list[dict[str, Optional[Recurso]]] = [{} for _ in cupos]
+    libres: dict[str, list[Recurso]] = {}
+    tiempos: dict[str, float] = {}
+    objetivo = 0.0
+    vacios = {}
+    solvers = set()
+    inicio_total = time.perf_counter()
+    for tipo, candidatos in recursos.items():
+        inicio = time.perf_counter()
+        # Cupos con la misma ciudad y permisos comparten la fila de costos
+        por_clase: dict[tuple, list[float]] = {}
+        costos = []
+        for cupo in cupos:
+            clave = (cupo.ciudad, cupo.permisos)
+            if clave not in por_clase:
+                por_clase[clave] = [costo(cupo, r, fecha) for r in candidatos]
+            costos.append(por_clase[clave])
+        elegidas: list[Optional[int]] = [None] * len(cupos)
+        if cupos and candidatos:
+            elegidas, solver = resolver(costos)
+            solvers.add(solver)
+        usados = set()
+        faltan = 0
+        for i, j in enumerate(elegidas):
+            if j is None:
+                asignaciones[i][tipo] = None
+                objetivo += COSTO_VACIO
+                faltan += 1
+            else:
+                asignaciones[i][tipo] = candidatos[j]
+                objetivo += costos[i][j]
+                usados.add(j)
+        libres[tipo] = [r for j, r in enumerate(candidatos) if j not in usados]
+        vacios[tipo] = faltan
+        tiempos[tipo] = round((time.perf_counter() - inicio) * 1000, 2)
+    tiempos["total"] = round((time.perf_counter() - inicio_total) * 1000, 2)
+    return {
+        "asignaciones": asignaciones,
+        "libres": libres,
+        "objetivo": round(objetivo, 4),
+        "vacios": vacios,
+        "motor": motor,
+        "solver": "+".join(sorted(solvers)) or None,
+        "tiempos_ms": tiempos,
+    }
+
+
+def evaluar_escenarios(
+    escenarios: list[list[Cupo]],
+    recursos: dict[str, list[Recurso]],
+    fecha: Optional[date] = None,
+) -> list[dict[str, Any]]:
+    """
+    Cobertura de varios escenarios de cupos contra los mismos recursos, sin
+    resolver un emparejamiento por escenario cuando no hace falta.
+
+    Si todos los cupos de un escenario son iguales (misma ciudad y permisos)
+    el optimo toma, de cada tipo, los q recursos factibles mas baratos: los
+    costos de la clase se ordenan una vez y cada escenario sale de la suma de
+    prefijos (mismo objetivo que "flujo"/"hungarian"). Escenarios con cupos de
+    varias clases se resuelven con "flujo".
+
+    Por escenario: {"cupos", "cubiertos", "faltantes", "standby" (por tipo),
+    "completos" (cupos con los tres recursos), "objetivo", "metodo"}.
+    """
+    prefijos: dict[tuple[str, tuple], list[float]] = {}
+    filas = []
+    for cupos in escenarios:
+        q = len(cupos)
+        clases = {(c.ciudad, c.permisos) for c in cupos}
+        if len(clases) > 1:
+            res = asignar(cupos, recursos, fecha, motor="flujo")
+            cubiertos = {tipo: q - res["vacios"].get(tipo, q) for tipo in recursos}
+            completos = sum(1 for elegidos in res["asignaciones"] if all(elegidos.values()))
+            objetivo = res["objetivo"]
+            metodo = "flujo"
+        else:
+            cubiertos = {}
+            objetivo = 0.0
+            for tipo, candidatos in recursos.items():
+                n = 0
+                if cupos:
+                    clave = (tipo, next(iter(clases)))
+                    if clave not in prefijos:
+                        # Un recurso mas caro que el vacio tampoco lo elegiria el motor
+                        factibles = sorted(
+                            c for c in (costo(cupos[0], r, fecha) for r in candidatos) if c < COSTO_VACIO
+                        )
+                        prefijos[clave] = list(accumulate(factibles, initial=0.0))
+                    n = min(q, len(prefijos[clave]) - 1)
+                    objetivo += prefijos[clave][n]
+                cubiertos[tipo] = n
+                objetivo += (q - n) * COSTO_VACIO
+            completos = min(cubiertos.values(), default=0)
+            objetivo = round(objetivo, 4)
+            metodo = "prefijos"
+        filas.append({
+            "cupos": q,
+            "cubiertos": cubiertos,
+            "faltantes": {tipo: q - n for tipo, n in cubiertos.items()},
+            "standby": {tipo: len(recursos[tipo]) - n for tipo, n in cubiertos.items()},
+            "completos": completos,
+            "objetivo": objetivo,
+            "metodo": metodo,
+        })
+    return filas
+
+
+def asignar_ids(
+    cupos: list[Cupo],
+    recursos: dict[str, list[Recurso]],
+    fecha: Optional[date] = None,
+    motor: str = "flujo",
+) -> dict[str, Any]:
+    """
+    Igual que asignar() pero con ids en lugar de Recurso, para devolver el
+    resultado desde otro proceso sin serializar los modelos.
+    """
+    resultado = asignar(cupos, recursos, fecha, motor)
+    resultado["asignaciones"] = [
+        {tipo: (r.id if r else None) for tipo, r in elegidos.items()}
+        for elegidos in resultado["asignaciones"]
+    ]
+    resultado["libres"] = {tipo: [r.id for r in lista] for tipo, lista in resultado["libres"].items()}
+    return resultado
+
+
+_POOL: Optional[ProcessPoolExecutor] = None
+_POOL_LOCK = threading.Lock()
+
+
+def _pool() -> ProcessPoolExecutor:
+    global _POOL
+    with _POOL_LOCK:
+        if _POOL is None:
+            # spawn: el proceso del API tiene hilos (warmup, refresh) y fork no es seguro
+            _POOL = ProcessPoolExecutor(
+                max_workers=BATCH_WORKERS, mp_context=multiprocessing.get_context("spawn")
+            )
+        return _POOL
+
+
+def cerrar_pool() -> None:
+    global _POOL
+    with _POOL_LOCK:
+        if _POOL is not None:
+            _POOL.shutdown(wait=False, cancel_futures=True)
+            _POOL = None
+
+
+def asignar_lote(problemas: list[tuple]) -> tuple[list[dict[str, Any]], int]:
+    """
+    Resuelve varios problemas independientes (args de asignar_ids) y retorna
+    (resultados en el mismo orden, procesos usados). Los Recurso no deben
+    llevar `dato` para que el envio entre procesos sea barato.
+    """
+    if len(problemas) <= 1 or BATCH_WORKERS <= 1:
+        return [asignar_ids(*p) for p in problemas], 1
+    try:
+        pool = _pool()
+        futuros = [pool.submit(asignar_ids, *p) for p in problemas]
+        return [f.result() for f in futuros], min(BATCH_WORKERS, len(problemas))
+    except (BrokenProcessPool, OSError, RuntimeError) as e:
+        # Si el pool se cae (worker muerto, sin permisos para procesos) se resuelve aca
+        logger.warning(f"Pool de asignacion no disponible, resolviendo en proceso: {e}")
+        cerrar_pool()
+        return [asignar_ids(*p) for p in problemas], 1
@@ -0,0 +1,128 @@
+"""
+Mide el motor de asignacion de /api/auto-schedule con un dia sintetico:
+cupos en varias ciudades, personal con dias consecutivos, rotacion y permisos.
+Compara objetivo y tiempo de los motores ("greedy", "flujo", "hungarian") y
+verifica los motores optimos contra fuerza bruta en instancias chicas, y la
+evaluacion de escenarios de /simulate contra el motor.
+No llama a CloudFleet.
+
+Uso: python -m app.bench_assignment [cupos]
+"""
+import random
+import sys
+import time
+from datetime import date, timedelta
+from itertools import permutations
+
+from app import assignment
+from app.assignment import Cupo, Recurso, asignar, costo
+
+CIUDADES = ["bogota", "tocancipa", "medellin", "cali"]
+FECHA = date(2025, 3, 10)
+
+
+def _recursos(rnd: random.Random, n: int, personas: bool) -> list[Recurso]:
+    recursos = []
+    for i in range(n):
+        recursos.append(Recurso(
+            id=str(i),
+            ciudad=rnd.choice(CIUDADES),
+            activo=rnd.random() > 0.1,
+            permisos=({"alturas"} if rnd.random() < 0.4 else ()) if personas else None,
+            dias_consecutivos=rnd.randrange(assignment.MAX_DIAS_CONSECUTIVOS + 2) if personas else None,
+            ultima_asignacion=FECHA - timedelta(days=rnd.randrange(1, 15)) if personas else None,
+        ))
+    return recursos
+
+
+def _dia(cupos: int, semilla: int = 7) -> tuple[list[Cupo], dict[str, list[Recurso]]]:
+    rnd = random.Random(semilla)
+    lista = [
+        Cupo(i, ciudad=rnd.choice(CIUDADES), permisos={"alturas"} if rnd.random() < 0.2 else ())
+        for i in range(cupos)
+    ]
+    recursos = {
+        assignment.VEHICULOS: _recursos(rnd, int(cupos * 1.1), personas=False),
+        assignment.CONDUCTORES: _recursos(rnd, int(cupos * 1.5), personas=True),
+        assignment.AUXILIARES: _recursos(rnd, int(cupos * 1.2), personas=True),
+    }
+    return lista, recursos
+
+
+def _fuerza_bruta(cupos: list[Cupo], recursos: list[Recurso]) -> float:
+    """Objetivo optimo de un tipo probando todas las asignaciones (con vacios)."""
+    opciones = list(range(len(recursos))) + [None] * len(cupos)
+    mejor = float("inf")
+    for perm in set(permutations(opciones, len(cupos))):
+        total = 0.0
+        for cupo, j in zip(cupos, perm):
+            c = assignment.COSTO_VACIO if j is None else costo(cupo, recursos[j], FECHA)
+            total += c
+        mejor = min(mejor, total)
+    return mejor
+
+
+def _verificar(casos: int = 30) -> None:
+    for semilla in range(casos):
+        rnd = random.Random(semilla)
+        cupos = [Cupo(i, ciudad=rnd.choice(CIUDADES), permisos={"alturas"} if rnd.random() < 0.3 else ())
+                 for i in range(rnd.randrange(1, 5))]
+        recursos = _recursos(rnd, rnd.randrange(0, 6), personas=True)
+        esperado = _fuerza_bruta(cupos, recursos)
+        for motor in ("flujo", "hungarian"):
+            obtenido = asignar(cupos, {"personas": recursos}, FECHA, motor=motor)["objetivo"]
+            assert abs(esperado - obtenido) < 1e-3, (motor, semilla, esperado, obtenido)
+    print(f"flujo == hungarian == fuerza bruta en {casos} instancias chicas")
+
+
+def _verificar_vehiculos(casos: int = 30) -> None:
+    """Los permisos del cupo son del personal: un cupo con permisos igual recibe vehiculo."""
+    for semilla in range(casos):
+        rnd = random.Random(semilla)
+        cupos = [Cupo(i, ciudad=rnd.choice(CIUDADES), permisos={"alturas"} if rnd.random() < 0.5 else ())
+                 for i in range(rnd.randrange(1, 5))]
+        cupos[0].permisos = frozenset({"alturas"})
+        vehiculos = _recursos(rnd, rnd.randrange(1, 6), personas=False)
+        esperado = _fuerza_bruta(cupos, vehiculos)
+        vacios_esperados = max(0, len(cupos) - len(vehiculos))
+        assert esperado < assignment.COSTO_VACIO * (vacios_esperados + 1), (semilla, esperado)
+        for motor in ("flujo", "hungarian", "greedy"):
+            res = asignar(cupos, {assignment.VEHICULOS: vehiculos}, FECHA, motor=motor)
+            assert res["vacios"][assignment.VEHICULOS] == vacios_esperados, (motor, semilla, res["vacios"])
+            if motor != "greedy":
+                assert abs(esperado - res["objetivo"]) < 1e-3, (motor, semilla, esperado, res["objetivo"])
+    print(f"cupos con permisos reciben vehiculo en {casos} instancias chicas")
+
+
+def _verificar_escenarios(casos: int = 30) -> None:
+    """evaluar_escenarios (suma de prefijos) contra asignar() escenario por escenario."""
+    for semilla in range(casos):
+        rnd = random.Random(semilla)
+        _, recursos = _dia(40, semilla)
+        ciudad = rnd.choice(CIUDADES)
+        permisos = {"alturas"} if rnd.random() < 0.3 else ()
+        escenarios = [[Cupo(i, ciudad=ciudad, permisos=permisos) for i in range(q)] for q in (0, 3, 10, 40, 80)]
+        # Uno con cupos de dos ciudades (se resuelve con flujo)
+        escenarios.append([Cupo(i, ciudad=CIUDADES[i % 2]) for i in range(12)])
+        for cupos, fila in zip(escenarios, assignment.evaluar_escenarios(escenarios, recursos, FECHA)):
+            esperado = asignar(cupos, recursos, FECHA, motor="flujo")
+            assert abs(esperado["objetivo"] - fila["objetivo"]) < 1e-3, (semilla, len(cupos), esperado["objetivo"], fila)
+            assert esperado["vacios"] == fila["faltantes"], (semilla, len(cupos))
+    print(f"evaluar_escenarios == flujo en {casos} dias sinteticos")
+
+
+if __name__ == "__main__":
+    _verificar()
+    _verificar_vehiculos()
+    _verificar_escenarios()
+    total = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    cupos, recursos = _dia(total)
+    print(f"cupos={total} " + " ".join(f"{t}={len(r)}" for t, r in recursos.items()))
+    for motor in ("greedy", "flujo", "hungarian"):
+        inicio = time.perf_counter()
+        res = asignar(cupos, recursos, FECHA, motor=motor)
+        duracion = time.perf_counter() - inicio
+        print(
+            f"{motor:<10} objetivo={res['objetivo']:>10.1f} vacios={res['vacios']} "
+            f"solver={res['solver']} tiempo={duracion:6.3f}s"
+        )
@@ -0,0 +1,79 @@
+"""
+Mide el tamano del payload y el tiempo de serializacion de /personal y
+/vehiculos en vista full vs slim usando los snapshots locales (.cache).
+
+Uso: python -m app.bench_payload
+"""
+import json
+import os
+import sys
+import time
+
+from fastapi.encoders import jsonable_encoder
+
+from app.main import Persona, Vehiculo, _datos_vista
+
+CACHE_DIR = os.path.join(os.path.dirname(__file__), "..", ".cache")
+REPETICIONES = 5
+
+
+def _cargar(nombre: str) -> list[dict]:
+    with open(os.path.join(CACHE_DIR, f"{nombre}.json"), encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _persona(item: dict, view: str) -> Persona:
+    city = item.get("city")
+    return Persona(
+        id=str(item.get("id", "")),
+        nombre=f"{item.get('firstName', '')} {item.get('lastName', '')}".strip() or "Sin nombre",
+        rol=item.get("position") or "other",
+        documento=item.get("personalId", ""),
+        telefono=item.get("mobilePhone") or "",
+        ubicacion_ciudad=city.get("name", "") if isinstance(city, dict) else (city or ""),
+        activo=item.get("isActive", True),
+        datos_adicionales=_datos_vista(item, "persona", view),
+    )
+
+
+def _vehiculo(item: dict, view: str) -> Vehiculo:
+    city = item.get("city")
+    return Vehiculo(
+        id=str(item.get("id", "")),
+        placa=item.get("code", "SIN-PLACA"),
+        tipo=item.get("typeName"),
+        ubicacion_ciudad=city.get("name", "") if isinstance(city, dict) else (city or ""),
+        datos_adicionales=_datos_vista(item, "vehiculo", view),
+    )
+
+
+def _medir(nombre: str, registros: list[dict], builder) -> None:
+    for view in ("full", "slim"):
+        mejor_build = mejor_dump = float("inf")
+        tamano = 0
+        for _ in range(REPETICIONES):
+            t0 = time.perf_counter()
+            modelos = [builder(r, view) for r in registros]
+            t1 = time.perf_counter()
+            # Igual que FastAPI: jsonable_encoder + json.dumps
+            cuerpo = json.dumps(jsonable_encoder(modelos), ensure_ascii=False).encode("utf-8")
+            t2 = time.perf_counter()
+            mejor_build = min(mejor_build, t1 - t0)
+            mejor_dump = min(mejor_dump, t2 - t1)
+            tamano = len(cuerpo)
+        print(
+            f"{nombre:<10} view={view:<4} registros={len(registros):>5} "
+            f"bytes={tamano:>9} construir={mejor_build * 1000:7.1f}ms serializar={mejor_dump * 1000:7.1f}ms"
+        )
+
+
+if __name__ == "__main__":
+    try:
+        personas = _cargar("people_all")
+        vehiculos = _cargar("vehicles_all")
+    except FileNotFoundError as e:
+        print(f"No hay snapshot local: {e}")
+        sys.exit(1)
+
+    _medir("personal", personas, _persona)
+    _medir("vehiculos", vehiculos, _vehiculo)
@@ -0,0 +1,81 @@
+"""
+Mide la persistencia de un plan de un mes (sedes x dias x viajes) en una base
+SQLite temporal: la version anterior (add + flush por viaje) contra
+_persistir_plan (INSERT por lote con RETURNING). Verifica tambien que volver a
+guardar el mismo mes reemplaza el plan en lugar de duplicarlo. No llama a
+CloudFleet ni toca la base configurada.
+
+Uso: python -m app.bench_persistencia [dias] [sedes] [viajes_por_sede]
+"""
+import os
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+_DIRECTORIO = tempfile.mkdtemp(prefix="bench_persistencia_")
+os.environ["USE_SQLITE"] = "true"
+os.environ["DB_SQLITE_FILE"] = os.path.join(_DIRECTORIO, "bench.db")
+os.environ.pop("DATABASE_URL", None)
+
+from app.database import Base, SessionLocal, engine  # noqa: E402
+from app.main import _persistir_plan  # noqa: E402
+from app.models import Viaje, ViajeDetalle  # noqa: E402
+
+CLIENTE = "bench"
+
+
+def _plan(dias: int, sedes: int, por_sede: int, inicio: date):
+    plan = []
+    for d in range(dias):
+        fecha = inicio + timedelta(days=d)
+        for s in range(sedes):
+            for k in range(por_sede):
+                plan.append((f"S{s}", fecha, {"id": k}, f"V{s}-{k}", f"C{s}-{k}", f"A{s}-{k}"))
+    return plan
+
+
+def _anterior(plan) -> float:
+    inicio = time.perf_counter()
+    with SessionLocal() as db:
+        for sede_id, fecha, ruta, v_id, c_id, a_id in plan:
+            viaje = Viaje(cliente_id=CLIENTE, sede_id=sede_id, fecha=fecha, estado="borrador")
+            db.add(viaje)
+            db.flush()
+            db.add(ViajeDetalle(
+                viaje_id=viaje.id, ruta_id=str(ruta["id"]), vehiculo_id=v_id, conductor_id=c_id,
+                auxiliar_id=a_id, notas="Generado automaticamente",
+            ))
+        db.commit()
+    return time.perf_counter() - inicio
+
+
+def _por_lote(plan) -> float:
+    inicio = time.perf_counter()
+    with SessionLocal() as db:
+        _persistir_plan(db, CLIENTE, plan)
+        db.commit()
+    return time.perf_counter() - inicio
+
+
+def _contar() -> tuple[int, int]:
+    with SessionLocal() as db:
+        return db.query(Viaje).count(), db.query(ViajeDetalle).count()
+
+
+if __name__ == "__main__":
+    dias, sedes, por_sede = (int(x) for x in (sys.argv[1:] + ["30", "10", "7"][len(sys.argv[1:]):]))
+    Base.metadata.create_all(bind=engine)
+    plan_anterior = _plan(dias, sedes, por_sede, date(2024, 1, 1))
+    plan = _plan(dias, sedes, por_sede, date(2025, 1, 1))
+    print(f"viajes={len(plan)} ({dias} dias x {sedes} sedes x {por_sede})")
+
+    t_ant = _anterior(plan_anterior)
+    print(f"anterior (add + flush)  {t_ant:7.3f}s")
+    t_lote = _por_lote(plan)
+    print(f"por lote                {t_lote:7.3f}s")
+    antes = _contar()
+    t_repetir = _por_lote(plan)
+    despues = _contar()
+    assert antes == despues, (antes, despues)
+    print(f"repetir el mes          {t_repetir:7.3f}s (viajes/detalles sin duplicar: {despues})")
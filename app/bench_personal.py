@@ -0,0 +1,65 @@
+"""
+Compara el throughput de /personal con la serializacion anterior
+(response_model + jsonable_encoder + json.dumps) y la ruta rapida actual
+(TypeAdapter precompilado, sin revalidar). Usa el snapshot local de personas.
+
+Uso: python -m app.bench_personal
+"""
+import json
+import os
+import sys
+import time
+from typing import List
+
+from fastapi.encoders import jsonable_encoder
+from pydantic import TypeAdapter
+
+import app.main as main
+from app.main import Persona
+
+CACHE_DIR = os.path.join(os.path.dirname(__file__), "..", ".cache")
+DURACION_SEG = 3.0
+
+_ADAPTADOR = TypeAdapter(List[Persona])
+
+
+def _antes() -> bytes:
+    # Lo que hacia FastAPI con response_model=List[Persona]
+    personal = main.listar_personal(view="full")
+    validados = _ADAPTADOR.validate_python(personal)
+    return json.dumps(jsonable_encoder(validados)).encode("utf-8")
+
+
+def _despues() -> bytes:
+    return main._responder_personal(view="slim").body
+
+
+def _despues_full() -> bytes:
+    return main._responder_personal(view="full").body
+
+
+def _throughput(nombre: str, fn) -> None:
+    n = 0
+    tamano = len(fn())
+    inicio = time.perf_counter()
+    while time.perf_counter() - inicio < DURACION_SEG:
+        fn()
+        n += 1
+    total = time.perf_counter() - inicio
+    print(f"{nombre:<22} {n / total:8.1f} req/s  {total / n * 1000:7.1f} ms/req  {tamano:>9} bytes")
+
+
+if __name__ == "__main__":
+    try:
+        with open(os.path.join(CACHE_DIR, "people_all.json"), encoding="utf-8") as f:
+            personas = json.load(f)
+    except FileNotFoundError as e:
+        print(f"No hay snapshot local: {e}")
+        sys.exit(1)
+
+    # Servir el snapshot local sin tocar la API de CloudFleet
+    main.get_personas = lambda max_pages=None: personas
+
+    _throughput("antes (full)", _antes)
+    _throughput("despues (full)", _despues_full)
+    _throughput("despues (slim)", _despues)
@@ -0,0 +1,98 @@
+"""
+Mide la fusion de vias al agregar rutas desde viajes sinteticos: la version
+anterior (lista + any() sobre vias_detalle, cuadratica por ruta) contra
+AgregadorRutas (dict/sets, lineal). No llama a CloudFleet.
+
+Pocas rutas muy usadas y vias que crecen con el historial, como en rutas con
+meses de viajes. La version anterior se corre solo hasta LIMITE_ANTERIOR
+viajes (arriba de eso tarda minutos).
+
+Uso: python -m app.bench_rutas [viajes]
+"""
+import random
+import sys
+import time
+
+from app.vias import AgregadorRutas
+
+RUTAS = 20
+LIMITE_ANTERIOR = 12_500
+
+
+class _Ruta:
+    __slots__ = ("via_codigo", "vias", "vias_detalle")
+
+    def __init__(self, via_codigo, vias, vias_detalle):
+        self.via_codigo = via_codigo
+        self.vias = vias
+        self.vias_detalle = vias_detalle
+
+
+def _viajes(n: int) -> list[tuple[tuple[str, str, str], str, list[str], list[dict]]]:
+    rnd = random.Random(42)
+    vias_distintas = max(n // 25, 10)
+    viajes = []
+    for _ in range(n):
+        ruta = rnd.randrange(RUTAS)
+        via = f"V{rnd.randrange(vias_distintas):05d}"
+        extra = f"V{rnd.randrange(vias_distintas):05d}"
+        detalle = [{"code": via, "name": f"Via {via}"}, {"code": extra, "name": f"Via {extra}"}]
+        viajes.append(((f"R{ruta:02d}", "BOGOTA", "CHIA"), via, [via, extra], detalle))
+    return viajes
+
+
+def _anterior(viajes) -> list[_Ruta]:
+    rutas_map: dict = {}
+    for key, via_codigo, vias_codigos, vias_detalle in viajes:
+        existente = rutas_map.get(key)
+        if existente:
+            if via_codigo and via_codigo not in existente.vias:
+                existente.vias.append(via_codigo)
+            for vc in vias_codigos:
+                if vc and vc not in existente.vias:
+                    existente.vias.append(vc)
+            for vd in vias_detalle:
+                code = vd.get("code")
+                name = vd.get("name")
+                dup = any(
+                    (code and code == d.get("code")) or (name and name == d.get("name"))
+                    for d in existente.vias_detalle
+                )
+                if not dup:
+                    existente.vias_detalle.append(vd)
+            continue
+        rutas_map[key] = _Ruta(via_codigo, list(vias_codigos), list(vias_detalle))
+    return list(rutas_map.values())
+
+
+def _agregador(viajes) -> list[_Ruta]:
+    rutas_map = AgregadorRutas()
+    for key, via_codigo, vias_codigos, vias_detalle in viajes:
+        if key in rutas_map:
+            rutas_map.fusionar(key, via_codigo, [via_codigo, *vias_codigos], vias_detalle)
+            continue
+        rutas_map.poner(key, _Ruta(via_codigo, list(vias_codigos), list(vias_detalle)))
+    return rutas_map.rutas()
+
+
+def _medir(fn, viajes) -> tuple[float, list[_Ruta]]:
+    inicio = time.perf_counter()
+    resultado = fn(viajes)
+    return time.perf_counter() - inicio, resultado
+
+
+if __name__ == "__main__":
+    total = int(sys.argv[1]) if len(sys.argv) > 1 else 50_000
+    tamanos = [total // 8, total // 4, total // 2, total]
+    print(f"{'viajes':>8} {'anterior':>10} {'agregador':>10} {'us/viaje':>9}")
+    for n in tamanos:
+        viajes = _viajes(n)
+        t_nuevo, nuevo = _medir(_agregador, viajes)
+        anterior_txt = "-"
+        if n <= LIMITE_ANTERIOR:
+            t_ant, ant = _medir(_anterior, viajes)
+            # Mismo resultado y mismo orden de primera aparicion
+            assert [r.vias for r in ant] == [r.vias for r in nuevo]
+            assert [r.vias_detalle for r in ant] == [r.vias_detalle for r in nuevo]
+            anterior_txt = f"{t_ant:9.3f}s"
+        print(f"{n:>8} {anterior_txt:>10} {t_nuevo:9.3f}s {t_nuevo / n * 1e6:8.2f}")
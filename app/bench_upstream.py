@@ -0,0 +1,46 @@
+"""
+Simula un refresh (crawl en background) compitiendo con clicks interactivos por
+la misma cuota y mide cuanto espera cada click en el planificador de upstream,
+con y sin clases de prioridad. No llama a CloudFleet: solo pide tokens.
+
+El ritmo va escalado (CLOUDFLEET_RPM x ESCALA) para que corra en segundos;
+las esperas se reportan en la escala real de 30 req/min.
+
+Uso: python -m app.bench_upstream
+"""
+import threading
+import time
+
+from app.upstream import BACKGROUND, INTERACTIVA, Planificador
+
+ESCALA = 60        # 30 req/min -> 30 req/s
+PAGINAS_CRAWL = 40
+CLICKS = 8
+
+
+def _correr(con_prioridad: bool) -> list[float]:
+    plan = Planificador(rpm=30 * ESCALA, rafaga=5, reserva=2)
+    esperas: list[float] = []
+
+    def crawl():
+        for _ in range(PAGINAS_CRAWL):
+            plan.adquirir(BACKGROUND if con_prioridad else INTERACTIVA)
+
+    hilo = threading.Thread(target=crawl)
+    hilo.start()
+    time.sleep(0.05)  # el crawl ya encolo sus paginas
+    for _ in range(CLICKS):
+        esperas.append(plan.adquirir(INTERACTIVA) * ESCALA)
+        time.sleep(2 / ESCALA)  # un click cada ~2 s reales
+    hilo.join()
+    return esperas
+
+
+if __name__ == "__main__":
+    for con_prioridad in (False, True):
+        esperas = _correr(con_prioridad)
+        etiqueta = "con prioridad" if con_prioridad else "sin prioridad"
+        print(
+            f"{etiqueta:<14} clicks={len(esperas)} espera_promedio={sum(esperas) / len(esperas):5.2f}s "
+            f"espera_max={max(esperas):5.2f}s (escala real)"
+        )
@@ -0,0 +1,222 @@
+"""
+Carga de trabajo por recurso (vehiculo o persona) para el despacho automatico.
+
+_filtrar_consecutivos y _rotar_personas leian `dias_consecutivos` y
+`ultima_asignacion` de los registros de CloudFleet, que nunca traen esos
+campos: las dos reglas no hacian nada. Ahora los contadores viven en la tabla
+carga_recurso y se actualizan de forma incremental al confirmar viajes
+(registrar_confirmados), sin recorrer el historial en cada programacion:
+
+- ultima_fecha y racha: dias consecutivos trabajados hasta ultima_fecha.
+- semana y viajes_semana: viajes en la semana (desde el lunes) de ultima_fecha,
+  para repartir la carga de forma pareja.
+
+Carga es el mismo estado en memoria: el planificador de varios dias copia las
+cargas de la base y las va avanzando dia a dia sin escribir nada.
+
+Confirmar un dia anterior a ultima_fecha no se puede aplicar incrementalmente;
+en ese caso se recalcula solo ese recurso desde los viajes confirmados.
+reconstruir() rehace toda la tabla (arranque con tabla vacia o correccion manual).
+"""
+import logging
+from datetime import date, timedelta
+from typing import Iterable, Optional
+
+from sqlalchemy import or_, tuple_
+from sqlalchemy.orm import Session
+
+from app.models import CargaRecurso, Viaje, ViajeDetalle
+
+logger = logging.getLogger(__name__)
+
+VEHICULO = "vehiculo"
+PERSONA = "persona"
+
+
+def lunes(fecha: date) -> date:
+    return fecha - timedelta(days=fecha.weekday())
+
+
+class Carga:
+    """Contadores de un recurso. Sin ultima_fecha: nunca tuvo viajes confirmados."""
+
+    __slots__ = ("ultima_fecha", "racha", "semana", "viajes_semana", "viajes_total")
+
+    def __init__(
+        self,
+        ultima_fecha: Optional[date] = None,
+        racha: int = 0,
+        semana: Optional[date] = None,
+        viajes_semana: int = 0,
+        viajes_total: int = 0,
+    ):
+        self.ultima_fecha = ultima_fecha
+        self.racha = racha
+        self.semana = semana
+        self.viajes_semana = viajes_semana
+        self.viajes_total = viajes_total
+
+    def copia(self) -> "Carga":
+        return Carga(self.ultima_fecha, self.racha, self.semana, self.viajes_semana, self.viajes_total)
+
+    def consecutivos_antes(self, fecha: date) -> Optional[int]:
+        """
+        Dias consecutivos trabajados justo antes de `fecha`. None si `fecha` no
+        es posterior a ultima_fecha (el contador no sabe que paso antes).
+        """
+        if self.ultima_fecha is None:
+            return 0
+        hueco = (fecha - self.ultima_fecha).days
+        if hueco <= 0:
+            return None
+        return self.racha if hueco == 1 else 0
+
+    def viajes_en_semana(self, fecha: date) -> int:
+        return self.viajes_semana if self.semana == lunes(fecha) else 0
+
+    def registrar(self, fecha: date) -> bool:
+        """Suma un viaje en `fecha`. False si es anterior a ultima_fecha (requiere recalcular)."""
+        if self.ultima_fecha is not None and fecha < self.ultima_fecha:
+            return False
+        if self.ultima_fecha is None or (fecha - self.ultima_fecha).days > 1:
+            self.racha = 1
+        elif fecha != self.ultima_fecha:
+            self.racha += 1
+        self.ultima_fecha = fecha
+        semana = lunes(fecha)
+        if self.semana != semana:
+            self.semana = semana
+            self.viajes_semana = 0
+        self.viajes_semana += 1
+        self.viajes_total += 1
+        return True
+
+
+def _desde_fila(fila: CargaRecurso) -> Carga:
+    return Carga(fila.ultima_fecha, fila.racha or 0, fila.semana, fila.viajes_semana or 0, fila.viajes_total or 0)
+
+
+def _a_fila(fila: CargaRecurso, carga: Carga) -> None:
+    fila.ultima_fecha = carga.ultima_fecha
+    fila.racha = carga.racha
+    fila.semana = carga.semana
+    fila.viajes_semana = carga.viajes_semana
+    fila.viajes_total = carga.viajes_total
+
+
+def leer(db: Session, claves: Optional[Iterable[tuple[str, str]]] = None) -> dict[tuple[str, str], Carga]:
+    """Cargas por (clase, recurso_id); sin claves trae toda la tabla."""
+    consulta = db.query(CargaRecurso)
+    if claves is not None:
+        claves = list(set(claves))
+        if not claves:
+            return {}
+        consulta = consulta.filter(tuple_(CargaRecurso.clase, CargaRecurso.recurso_id).in_(claves))
+    return {(f.clase, f.recurso_id): _desde_fila(f) for f in consulta.all()}
+
+
+def _confirmados(db: Session, filtro=None) -> list[tuple[date, Optional[str], Optional[str], Optional[str]]]:
+    consulta = (
+        db.query(Viaje.fecha, ViajeDetalle.vehiculo_id, ViajeDetalle.conductor_id, ViajeDetalle.auxiliar_id)
+        .join(ViajeDetalle, ViajeDetalle.viaje_id == Viaje.id)
+        .filter(Viaje.estado == "confirmado")
+    )
+    if filtro is not None:
+        consulta = consulta.filter(filtro)
+    return consulta.all()
+
+
+def _filtro_recursos(claves: set[tuple[str, str]]):
+    ids_vehiculos = [rid for clase, rid in claves if clase == VEHICULO]
+    ids_personas = [rid for clase, rid in claves if clase == PERSONA]
+    return or_(
+        ViajeDetalle.vehiculo_id.in_(ids_vehiculos),
+        ViajeDetalle.conductor_id.in_(ids_personas),
+        ViajeDetalle.auxiliar_id.in_(ids_personas),
+    )
+
+
+def _calcular(filas, claves: Optional[set[tuple[str, str]]] = None) -> dict[tuple[str, str], Carga]:
+    eventos = []
+    for fecha, vehiculo_id, conductor_id, auxiliar_id in filas:
+        for clase, rid in ((VEHICULO, vehiculo_id), (PERSONA, conductor_id), (PERSONA, auxiliar_id)):
+            if rid and (claves is None or (clase, str(rid)) in claves):
+                eventos.append((fecha, clase, str(rid)))
+    cargas: dict[tuple[str, str], Carga] = {}
+    for fecha, clase, rid in sorted(eventos):
+        cargas.setdefault((clase, rid), Carga()).registrar(fecha)
+    return cargas
+
+
+def registrar_confirmados(db: Session, asignaciones: Iterable[tuple[str, str, date]]) -> int:
+    """
+    Aplica a carga_recurso los viajes recien confirmados: (clase, recurso_id, fecha).
+    No hace commit (va en la misma transaccion que la confirmacion).
+    Retorna cuantos recursos se actualizaron.
+    """
+    por_recurso: dict[tuple[str, str], list[date]] = {}
+    for clase, rid, fecha in asignaciones:
+        if rid:
+            por_recurso.setdefault((clase, str(rid)), []).append(fecha)
+    if not por_recurso:
+        return 0
+    filas = {
+        (f.clase, f.recurso_id): f
+        for f in db.query(CargaRecurso)
+        .filter(tuple_(CargaRecurso.clase, CargaRecurso.recurso_id).in_(list(por_recurso)))
+        .all()
+    }
+    recalcular = set()
+    for clave, fechas in por_recurso.items():
+        fila = filas.get(clave)
+        if fila is None:
+            fila = CargaRecurso(clase=clave[0], recurso_id=clave[1])
+            db.add(fila)
+            filas[clave] = fila
+        carga = _desde_fila(fila)
+        if all(carga.registrar(f) for f in sorted(fechas)):
+            _a_fila(fila, carga)
+        else:
+            recalcular.add(clave)
+    if recalcular:
+        # Confirmaciones fuera de orden: solo esos recursos, desde su historial
+        db.flush()
+        calculadas = _calcular(_confirmados(db, _filtro_recursos(recalcular)), recalcular)
+        for clave in recalcular:
+            _a_fila(filas[clave], calculadas.get(clave, Carga()))
+    return len(por_recurso)
+
+
+def calcular_hasta(db: Session, claves: Iterable[tuple[str, str]], fecha: date) -> dict[tuple[str, str], Carga]:
+    """
+    Cargas de esos recursos con los viajes confirmados antes de `fecha`. Para
+    reprogramar un dia que ya no es posterior al ultimo confirmado, donde los
+    contadores no alcanzan.
+    """
+    claves = set(claves)
+    if not claves:
+        return {}
+    filtro = (Viaje.fecha < fecha) & _filtro_recursos(claves)
+    return _calcular(_confirmados(db, filtro), claves)
+
+
+def reconstruir(db: Session) -> int:
+    """Rehace carga_recurso completa desde los viajes confirmados. Hace commit."""
+    cargas = _calcular(_confirmados(db))
+    db.query(CargaRecurso).delete()
+    for (clase, rid), carga in cargas.items():
+        fila = CargaRecurso(clase=clase, recurso_id=rid)
+        _a_fila(fila, carga)
+        db.add(fila)
+    db.commit()
+    logger.info(f"Carga de recursos reconstruida: {len(cargas)} recursos")
+    return len(cargas)
+
+
+def reconstruir_si_vacia(db: Session) -> None:
+    """Siembra la tabla la primera vez (si hay viajes confirmados y la tabla esta vacia)."""
+    if db.query(CargaRecurso.recurso_id).first() is not None:
+        return
+    if db.query(Viaje.id).filter(Viaje.estado == "confirmado").first() is None:
+        return
+    reconstruir(db)
@@ -4,10 +4,12 @@ Completa CLOUDFLEET_API_URL y CLOUDFLEET_API_TOKEN antes de usar.
 Incluye manejo basico de 404 y 429 para no romper la UI.
 """
 import os
+import re
 import time
 import json
 import logging
-from typing import Any
+import threading
+from typing import Any, Callable
 from datetime import datetime, timedelta
 
 # Configure logging
@@ -19,16 +21,39 @@ from requests import HTTPError
 from functools import lru_cache, wraps
 from urllib.parse import quote
 
+from app.upstream import (
+    PlazoVencido, marca_parcial, marcar_parcial, planificador, plazo_vencido, timeout_request,
+)
+
+class DescargaIncompleta(RuntimeError):
+    """Un recorrido que debia ser completo (refresh de snapshots) se corto antes del final."""
+
+
+class _ResultadoParcial(Exception):
+    """Lleva un resultado cortado por el plazo de la request fuera de lru_cache (no se cachea)."""
+
+    def __init__(self, valor: Any):
+        self.valor = valor
+
+
 def ttl_lru_cache(seconds: int, maxsize: int = 128):
     def wrapper(func):
         @lru_cache(maxsize=maxsize)
         def inner(__ttl, *args, **kwargs):
             # __ttl es solo para invalidar el cache cambiando el tiempo
-            return func(*args, **kwargs)
+            marca = marca_parcial()
+            valor = func(*args, **kwargs)
+            if marca_parcial() != marca:
+                # lru_cache no guarda resultados de llamadas que lanzan
+                raise _ResultadoParcial(valor)
+            return valor
         
         @wraps(func)
         def wrapped(*args, **kwargs):
-            return inner(time.time() // seconds, *args, **kwargs)
+            try:
+                return inner(time.time() // seconds, *args, **kwargs)
+            except _ResultadoParcial as parcial:
+                return parcial.valor
         
         wrapped.cache_clear = inner.cache_clear
         return wrapped
@@ -40,8 +65,7 @@ BASE_URL = os.getenv("CLOUDFLEET_API_URL", "https://fleet.cloudfleet.com/api/v1"
 TOKEN = os.getenv("CLOUDFLEET_API_TOKEN", "")
 TIMEOUT = 6
 PAGE_SIZE = 50  # CloudFleet API limit
-# 30 req/min -> ~2s; 0.8s es un buen compromiso
-RATE_LIMIT_DELAY = float(os.getenv("CLOUDFLEET_RATE_LIMIT_DELAY", "0.8"))
+# El ritmo de requests (30 req/min) lo controla app.upstream.planificador
 # 0 = sin limite, >0 limita paginas por seguridad
 MAX_PAGES = int(os.getenv("CLOUDFLEET_MAX_PAGES", "0"))
 # 0 = sin limite, >0 corta por ventana de tiempo
@@ -52,6 +76,20 @@ MAX_RETRIES_429 = int(os.getenv("CLOUDFLEET_MAX_RETRIES_429", "10"))
 # === LOCAL CACHE CONFIG ===
 CACHE_DIR = ".cache"
 CACHE_TTL = 86400  # 24 Hours
+# Un lock por snapshot para que hilos concurrentes no descarguen lo mismo dos veces
+_SNAPSHOT_LOCKS = {
+    "vehicles_all": threading.Lock(),
+    "people_all": threading.Lock(),
+}
+
+# Se incrementa en cada refresh_all_cache (ver cache_version)
+_REFRESH_COUNTER = 0
+
+# Requests hechas a CloudFleet por este proceso (para medir el costo de las tareas de warmup)
+_REQUESTS_REALIZADAS = 0
+
+# name -> (mtime, datos parseados)
+_MEM_CACHE: dict[str, tuple[float, Any]] = {}
 
 def _get_cache_path(name: str) -> str:
     if not os.path.exists(CACHE_DIR):
@@ -70,23 +108,120 @@ def _load_cache(name: str) -> Any | None:
             logger.info(f"Cache expired for {name}")
             return None
             
+        # Mientras el archivo no cambie devolvemos la misma lista ya parseada:
+        # evita releer el JSON en cada request y mantiene estable la identidad
+        # del snapshot (los indices de app.snapshots se apoyan en ella)
+        memo = _MEM_CACHE.get(name)
+        if memo and memo[0] == mtime:
+            return memo[1]
+
         with open(path, 'r', encoding='utf-8') as f:
             logger.info(f"Loading {name} from cache...")
-            return json.load(f)
+            data = json.load(f)
+        _MEM_CACHE[name] = (mtime, data)
+        return data
     except Exception as e:
         logger.warning(f"Error loading cache {name}: {e}")
         return None
 
+
+def snapshot_version(name: str) -> int:
+    """Version del snapshot en disco (mtime en ns); 0 si no existe."""
+    try:
+        return os.stat(_get_cache_path(name)).st_mtime_ns
+    except OSError:
+        return 0
+
+
+def snapshot_en_memoria(name: str) -> int | None:
+    """Registros del snapshot si esta cargado en memoria y vigente; si no None."""
+    memo = _MEM_CACHE.get(name)
+    try:
+        path = _get_cache_path(name)
+        if not memo or memo[0] != os.path.getmtime(path):
+            return None
+        if (time.time() - memo[0]) > CACHE_TTL:
+            return None
+    except OSError:
+        return None
+    return len(memo[1])
+
+
+def requests_realizadas() -> int:
+    """Total de requests a CloudFleet hechas por este proceso."""
+    return _REQUESTS_REALIZADAS
+
+
+def cache_version(*names: str) -> str:
+    """
+    Version de las caches: contador de refresh_all_cache + mtime de cada
+    snapshot indicado (el mtime cubre refrescos hechos por otro worker).
+    """
+    return "-".join([str(_REFRESH_COUNTER)] + [str(snapshot_version(n)) for n in names])
+
 def _save_cache(name: str, data: Any):
     try:
         path = _get_cache_path(name)
-        with open(path, 'w', encoding='utf-8') as f:
+        # Escribimos a un temporal y lo reemplazamos de una vez: los lectores
+        # ven el snapshot anterior o el nuevo completo, nunca uno a medias
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
             json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+        _MEM_CACHE[name] = (os.path.getmtime(path), data)
         logger.info(f"Saved cache for {name}")
     except Exception as e:
         logger.warning(f"Error saving cache {name}: {e}")
 
 
+# === NEGATIVE CACHE ===
+# Consultas (endpoint + filtros) que no devolvieron nada o dieron 404. Evita
+# repetir todo el dia los mismos sondeos vacios (variantes de routeCode,
+# /locations sin superusuario, etc). TTL propio, independiente de las caches TTL.
+NEGATIVE_CACHE_TTL = int(os.getenv("CLOUDFLEET_NEGATIVE_CACHE_TTL", "1800"))
+_NEGATIVOS: dict[str, float] = {}
+_NEGATIVOS_LOCK = threading.Lock()
+_NEGATIVOS_STATS = {"aciertos": 0, "registrados": 0}
+# Las ventanas de fechas se arman con la hora actual (cambian cada segundo):
+# para la clave basta el dia
+_FECHA_HORA = re.compile(r"(\d{4}-\d{2}-\d{2})T[0-9:.]+Z?")
+
+
+def _clave_negativa(path: str) -> str:
+    return _FECHA_HORA.sub(r"\1", path.lstrip("/"))
+
+
+def _es_negativo(path: str) -> bool:
+    if not NEGATIVE_CACHE_TTL:
+        return False
+    clave = _clave_negativa(path)
+    with _NEGATIVOS_LOCK:
+        vence = _NEGATIVOS.get(clave)
+        if vence is None:
+            return False
+        if vence < time.time():
+            del _NEGATIVOS[clave]
+            return False
+        _NEGATIVOS_STATS["aciertos"] += 1
+        return True
+
+
+def _registrar_negativo(path: str) -> None:
+    # Un resultado vacio por plazo vencido no dice nada de la consulta
+    if not NEGATIVE_CACHE_TTL or plazo_vencido():
+        return
+    with _NEGATIVOS_LOCK:
+        _NEGATIVOS[_clave_negativa(path)] = time.time() + NEGATIVE_CACHE_TTL
+        _NEGATIVOS_STATS["registrados"] += 1
+
+
+def estado_cache_negativa() -> dict[str, Any]:
+    ahora = time.time()
+    with _NEGATIVOS_LOCK:
+        vigentes = sum(1 for v in _NEGATIVOS.values() if v >= ahora)
+        return {"ttl_seg": NEGATIVE_CACHE_TTL, "vigentes": vigentes, **_NEGATIVOS_STATS}
+
+
 def _check_config():
     if not BASE_URL or not TOKEN:
         raise RuntimeError("Faltan CLOUDFLEET_API_URL o CLOUDFLEET_API_TOKEN")
@@ -103,27 +238,59 @@ def _headers() -> dict[str, str]:
 def _get(path: str, default_on_404: Any = None) -> Any:
     """
     GET simple con manejo opcional de 404 devolviendo default_on_404.
+    Con default_on_404 los 404 quedan en la cache negativa.
     """
+    global _REQUESTS_REALIZADAS
     _check_config()
+    if default_on_404 is not None and _es_negativo(path):
+        return default_on_404
     url = f"{BASE_URL}/{path.lstrip('/')}"
-    resp = requests.get(url, headers=_headers(), timeout=TIMEOUT)
+    try:
+        planificador.adquirir()
+    except PlazoVencido:
+        marcar_parcial()
+        raise
+    _REQUESTS_REALIZADAS += 1
+    resp = requests.get(url, headers=_headers(), timeout=timeout_request(TIMEOUT))
     try:
         resp.raise_for_status()
     except HTTPError as exc:
         if resp.status_code == 404 and default_on_404 is not None:
+            _registrar_negativo(path)
             return default_on_404
         raise exc
-    time.sleep(RATE_LIMIT_DELAY)  # Rate limiting
     return resp.json()
 
 
-def _get_paginated(path: str, max_pages: int | None = None) -> list[dict[str, Any]]:
+def _get_paginated(
+    path: str,
+    max_pages: int | None = None,
+    on_page: Callable[[int, int, str | None], None] | None = None,
+    cache_negativa: bool = True,
+    completo: bool = False,
+) -> list[dict[str, Any]]:
     """
     Obtiene todos los registros paginados de CloudFleet API.
     Maneja 404 devolviendo lo recopilado hasta el momento y 429 con reintentos.
     Soporta respuestas tipo lista o envueltas en un objeto con campo items/data/results.
+    on_page(pagina, registros_acumulados, error) se llama tras cada pagina y en cada 429.
+    Si vence el plazo de la request (app.upstream) devuelve lo recopilado y lo
+    marca como parcial.
+    Con cache_negativa, una consulta que no devolvio nada (o 404) no se repite
+    hasta que venza NEGATIVE_CACHE_TTL.
+    Con completo (refresh de snapshots) cualquier corte antes de la ultima
+    pagina (404, respuesta sin items, plazo, MAX_PAGES o MAX_TOTAL_SECONDS)
+    lanza DescargaIncompleta en lugar de devolver lo recopilado.
     """
+    def _cortar(motivo: str) -> list[dict[str, Any]]:
+        if completo:
+            raise DescargaIncompleta(f"{path}: {motivo} en la pagina {page} ({len(all_items)} registros)")
+        return all_items
+
+    global _REQUESTS_REALIZADAS
     _check_config()
+    if cache_negativa and _es_negativo(path):
+        return []
     all_items: list[dict[str, Any]] = []
     page = 1
     retries_429 = 0
@@ -135,14 +302,28 @@ def _get_paginated(path: str, max_pages: int | None = None) -> list[dict[str, An
         paginated_path = f"{path}{separator}page={page}&pageSize={PAGE_SIZE}"
         url = f"{BASE_URL}/{paginated_path.lstrip('/')}"
 
-        resp = requests.get(url, headers=_headers(), timeout=TIMEOUT)
+        try:
+            planificador.adquirir()
+            _REQUESTS_REALIZADAS += 1
+            resp = requests.get(url, headers=_headers(), timeout=timeout_request(TIMEOUT))
+        except (PlazoVencido, requests.RequestException) as exc:
+            # Un timeout de red solo es "parcial" si lo provoco el plazo recortado
+            if not isinstance(exc, PlazoVencido) and not plazo_vencido():
+                raise
+            if completo:
+                _cortar("plazo vencido")
+            marcar_parcial()
+            logger.info(f"Plazo vencido en {path} pagina {page}: devolviendo {len(all_items)} registros")
+            return all_items
         try:
             resp.raise_for_status()
             retries_429 = 0  # reset al tener respuesta ok
         except HTTPError as exc:
             status = resp.status_code
             if status == 404:
-                return all_items
+                if cache_negativa and not all_items:
+                    _registrar_negativo(path)
+                return _cortar("404")
             if status == 429:
                 retries_429 += 1
                 if retries_429 > MAX_RETRIES_429:
@@ -150,7 +331,10 @@ def _get_paginated(path: str, max_pages: int | None = None) -> list[dict[str, An
                 # Backoff exponencial suave para salir del penalty box (1s, 2s, 4s, 8s...)
                 wait_time = (1.5 ** retries_429) + 1
                 logger.warning(f"Rate limit 429 hit. Waiting {wait_time:.2f}s (Retry {retries_429}/{MAX_RETRIES_429})")
-                time.sleep(wait_time)
+                if on_page:
+                    on_page(page - 1, len(all_items), f"429 en pagina {page}, reintento {retries_429}")
+                # Pausa a todos los que comparten el token, no solo a este hilo
+                planificador.penalizar(wait_time)
                 continue
             raise exc
 
@@ -158,32 +342,43 @@ def _get_paginated(path: str, max_pages: int | None = None) -> list[dict[str, An
 
         # Si viene envuelto en un objeto de paginacion
         if isinstance(data, dict):
-            items = data.get("items") or data.get("data") or data.get("results")
+            # {"items": []} es una pagina vacia (fin del recorrido), no una respuesta sin items
+            campo = next((k for k in ("items", "data", "results") if data.get(k) is not None), None)
+            items = data[campo] if campo else None
             if items is None:
                 # Si parece un solo objeto con ID, lo devolvemos como lista de 1
                 if "id" in data:
                     data = [data]
                 else:
+                    if cache_negativa and not all_items:
+                        _registrar_negativo(path)
+                    _cortar("respuesta sin items")
                     return [] # Si no hay items y no parece objeto, devolvemos lista vacia
             elif not isinstance(items, list):
-               return []
+                _cortar("items no es una lista")
+                return []
             else:
                 data = items
 
         if not data:
+            if cache_negativa and not all_items:
+                _registrar_negativo(path)
             break
 
         all_items.extend(data)
+        if on_page:
+            on_page(page, len(all_items), None)
 
         if len(data) < PAGE_SIZE:
             break
         if max_pages_effective and page >= max_pages_effective:
+            _cortar("limite de paginas")
             break
 
         page += 1
-        time.sleep(RATE_LIMIT_DELAY)  # Rate limiting between pages
 
         if MAX_TOTAL_SECONDS and start_time and (time.time() - start_time) > MAX_TOTAL_SECONDS:
+            _cortar("limite de tiempo")
             break
 
     return all_items
@@ -213,10 +408,17 @@ def get_camiones(code: str | None = None, customer_id: str | None = None, max_pa
     # Fetching list
     all_vehicles = _load_cache("vehicles_all")
     if all_vehicles is None:
-        logger.info("Fetching ALL vehicles from CloudFleet for cache (this may take a while)...")
-        # Fetch EVERYTHING (no max_pages strictly, or very high)
-        all_vehicles = _get_paginated("vehicles/", max_pages=None)
-        _save_cache("vehicles_all", all_vehicles)
+        with _SNAPSHOT_LOCKS["vehicles_all"]:
+            # Otro hilo pudo haberlo descargado mientras esperabamos el lock
+            all_vehicles = _load_cache("vehicles_all")
+            if all_vehicles is None:
+                logger.info("Fetching ALL vehicles from CloudFleet for cache (this may take a while)...")
+                # Fetch EVERYTHING (no max_pages strictly, or very high)
+                marca = marca_parcial()
+                all_vehicles = _get_paginated("vehicles/", max_pages=None, cache_negativa=False)
+                # Un snapshot cortado por el plazo se usa para esta request pero no se guarda
+                if marca_parcial() == marca:
+                    _save_cache("vehicles_all", all_vehicles)
     
     # In-memory Filter
     filtered = all_vehicles
@@ -244,6 +446,7 @@ def get_conductores() -> list[dict[str, Any]]:
     return get_personas()
 
 
+@ttl_lru_cache(seconds=300)
 def get_clientes() -> list[dict[str, Any]]:
     """
     Obtiene listado de clientes.
@@ -405,9 +608,14 @@ def get_personas(max_pages: int | None = None) -> list[dict[str, Any]]:
     
     all_people = _load_cache("people_all")
     if all_people is None:
-        logger.info("Fetching ALL people from CloudFleet for cache (this may take a while)...")
-        all_people = _get_paginated("people/", max_pages=None)
-        _save_cache("people_all", all_people)
+        with _SNAPSHOT_LOCKS["people_all"]:
+            all_people = _load_cache("people_all")
+            if all_people is None:
+                logger.info("Fetching ALL people from CloudFleet for cache (this may take a while)...")
+                marca = marca_parcial()
+                all_people = _get_paginated("people/", max_pages=None, cache_negativa=False)
+                if marca_parcial() == marca:
+                    _save_cache("people_all", all_people)
         
     return all_people
 
@@ -420,14 +628,46 @@ def get_persona(person_id: str) -> dict[str, Any]:
     return _get(f"people/{person_id}")
 
 
-def refresh_all_cache():
+# Snapshots completos que se guardan en disco -> endpoint de CloudFleet
+SNAPSHOTS = {
+    "vehicles_all": "vehicles/",
+    "people_all": "people/",
+}
+
+
+def refresh_all_cache(on_page: Callable[[str, int, int, str | None], None] | None = None):
     """
     Fuerza la recarga de todas las caches (memoria y disco).
+    Los snapshots nuevos se descargan completos antes de reemplazar los
+    actuales, asi mientras tanto las requests siguen leyendo los anteriores.
+    Si alguna descarga falla o queda incompleta (DescargaIncompleta) se
+    conservan los snapshots vigentes. Tampoco se reemplaza un snapshot con
+    registros por una descarga vacia.
+    on_page(snapshot, pagina, registros, error) reporta el progreso.
     """
+    global _REFRESH_COUNTER
     logger.info("Starting Full Cache Refresh...")
-    
-    # 1. Clear In-Memory Caches
+
+    # 1. Descargar los snapshots nuevos junto a los vigentes
+    nuevos: dict[str, list[dict[str, Any]]] = {}
+    for name, path in SNAPSHOTS.items():
+        logger.info(f"Fetching {name} from CloudFleet...")
+        progreso = (lambda p, r, e, _n=name: on_page(_n, p, r, e)) if on_page else None
+        nuevos[name] = _get_paginated(path, max_pages=None, on_page=progreso, cache_negativa=False, completo=True)
+        if not nuevos[name] and _load_cache(name):
+            raise DescargaIncompleta(f"{path}: la descarga vino vacia y el snapshot vigente tiene registros")
+
+    # 2. Reemplazo atomico en disco (os.replace en _save_cache)
+    for name, data in nuevos.items():
+        with _SNAPSHOT_LOCKS[name]:
+            _save_cache(name, data)
+    _REFRESH_COUNTER += 1
+
+    # 3. Clear In-Memory Caches
+    with _NEGATIVOS_LOCK:
+        _NEGATIVOS.clear()
     try:
+        get_clientes.cache_clear()
         get_cliente.cache_clear()
         get_sedes.cache_clear()
         get_sede.cache_clear()
@@ -437,25 +677,5 @@ def refresh_all_cache():
     except Exception as e:
         logger.warning(f"Error clearing memory cache: {e}")
 
-    # 2. Clear File Cache
-    files = ["vehicles_all.json", "people_all.json"]
-    for fname in files:
-        try:
-            p = _get_cache_path(fname.replace(".json", "")) # _get_cache_path appends .json
-            if os.path.exists(p):
-                os.remove(p)
-                logger.info(f"Deleted cache file: {p}")
-        except Exception as e:
-            logger.warning(f"Error deleting file cache {fname}: {e}")
-
-    # 3. Warm up heavy caches
-    try:
-        logger.info("Warming up Vehicles cache...")
-        get_camiones() # This will fetch and save
-        logger.info("Warming up People cache...")
-        get_personas() # This will fetch and save
-    except Exception as e:
-        logger.error(f"Error warming up cache: {e}")
-        # Non-fatal, next request will try again
-    
     logger.info("Cache Refresh Completed.")
+    return {name: len(data) for name, data in nuevos.items()}
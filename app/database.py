@@ -7,7 +7,7 @@ try:
 except Exception:
     # Si no está instalado python-dotenv, seguimos con variables de entorno del SO
     pass
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, inspect, text
 from sqlalchemy.orm import sessionmaker, declarative_base
 
 # Database configuration from environment variables
@@ -50,3 +50,26 @@ def get_db():
         yield db
     finally:
         db.close()
+
+
+def agregar_columnas_faltantes(tabla) -> list[str]:
+    """
+    create_all no altera tablas existentes: agrega con ALTER TABLE las columnas
+    del modelo que la tabla todavia no tiene. Las columnas NOT NULL nuevas deben
+    tener server_default para que las filas viejas queden con un valor.
+    """
+    existentes = {c["name"] for c in inspect(engine).get_columns(tabla.name)}
+    agregadas = []
+    with engine.begin() as conn:
+        for columna in tabla.columns:
+            if columna.name in existentes:
+                continue
+            tipo = columna.type.compile(dialect=engine.dialect)
+            ddl = f"ALTER TABLE {tabla.name} ADD COLUMN {columna.name} {tipo}"
+            if columna.server_default is not None:
+                ddl += f" DEFAULT {columna.server_default.arg}"
+            if not columna.nullable:
+                ddl += " NOT NULL"
+            conn.execute(text(ddl))
+            agregadas.append(columna.name)
+    return agregadas
@@ -0,0 +1,166 @@
+"""
+Eventos de cambio para los tableros (SSE en GET /api/events).
+
+Antes daily_dispatch.html e index.html volvian a pedir listados completos para
+enterarse de un guardado, un refresh o la edicion de otro planificador. Ahora
+el proceso publica eventos chicos y cada tablero abierto los recibe:
+
+- "snapshot": termino un refresh de vehiculos/personal (registros por snapshot).
+- "borrador": se guardo el borrador de (cliente, sede, fecha).
+- "viajes": se persistieron o confirmaron viajes (cliente y dias afectados).
+- "resync": el tablero perdio eventos (cola llena o Last-Event-ID fuera del
+  historial) y debe recargar lo que muestra.
+
+Un solo Publicador por proceso. publicar() se llama desde cualquier hilo
+(endpoints sync, jobs, warmup): el evento se serializa una vez como trama SSE
+y se entrega con un call_soon_threadsafe por event loop, que reparte la misma
+trama en las colas de todas las suscripciones de ese loop. Las colas son
+acotadas (EVENTOS_COLA_MAX): un tablero lento recibe "resync" en lugar de
+frenar a los demas. Los ultimos EVENTOS_HISTORIAL eventos se guardan para
+reanudar con Last-Event-ID al reconectar.
+
+Con varios workers de uvicorn cada proceso publica solo sus propios eventos.
+"""
+import asyncio
+import itertools
+import json
+import logging
+import os
+import threading
+from collections import deque
+from typing import Any, Iterable, Optional
+
+logger = logging.getLogger(__name__)
+
+EVENTOS_COLA_MAX = int(os.getenv("EVENTOS_COLA_MAX", "100"))
+EVENTOS_HISTORIAL = int(os.getenv("EVENTOS_HISTORIAL", "200"))
+EVENTOS_PING_SEG = float(os.getenv("EVENTOS_PING_SEG", "15"))
+
+SNAPSHOT = "snapshot"
+BORRADOR = "borrador"
+VIAJES = "viajes"
+RESYNC = "resync"
+TIPOS = (SNAPSHOT, BORRADOR, VIAJES)
+
+PING = b": ping\n\n"
+
+
+def _trama(tipo: str, datos: dict[str, Any], id: Optional[int] = None) -> bytes:
+    cabecera = f"id: {id}\n" if id is not None else ""
+    return f"{cabecera}event: {tipo}\ndata: {json.dumps(datos, ensure_ascii=False, default=str)}\n\n".encode("utf-8")
+
+
+class Evento:
+    __slots__ = ("id", "tipo", "cliente_id", "trama")
+
+    def __init__(self, id: int, tipo: str, cliente_id: Optional[str], trama: bytes):
+        self.id = id
+        self.tipo = tipo
+        self.cliente_id = cliente_id
+        self.trama = trama
+
+
+class Suscripcion:
+    """Un tablero conectado: su cola (en su event loop) y sus filtros."""
+
+    __slots__ = ("cola", "loop", "tipos", "cliente_id")
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, tipos: Optional[set[str]], cliente_id: Optional[str]):
+        self.cola: asyncio.Queue = asyncio.Queue(maxsize=EVENTOS_COLA_MAX)
+        self.loop = loop
+        self.tipos = tipos
+        self.cliente_id = cliente_id
+
+    def acepta(self, evento: Evento) -> bool:
+        if self.tipos and evento.tipo not in self.tipos:
+            return False
+        # Los eventos sin cliente (snapshots) van a todos
+        return not (self.cliente_id and evento.cliente_id and evento.cliente_id != self.cliente_id)
+
+    def poner(self, trama: bytes) -> None:
+        """Solo desde el loop de la suscripcion."""
+        if self.cola.full():
+            # Tablero lento: descarta lo pendiente y le pide recargar
+            while not self.cola.empty():
+                self.cola.get_nowait()
+            trama = _trama(RESYNC, {"motivo": "cola_llena"})
+        self.cola.put_nowait(trama)
+
+
+class Publicador:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._por_loop: dict[asyncio.AbstractEventLoop, set[Suscripcion]] = {}
+        self._historial: deque[Evento] = deque(maxlen=EVENTOS_HISTORIAL)
+        self._ids = itertools.count(1)
+        self.publicados = 0
+
+    def suscribir(
+        self,
+        tipos: Optional[Iterable[str]] = None,
+        cliente_id: Optional[str] = None,
+        ultimo_id: Optional[int] = None,
+    ) -> Suscripcion:
+        """Registra una suscripcion en el loop actual; con ultimo_id reenvia lo que se perdio."""
+        s = Suscripcion(asyncio.get_running_loop(), set(tipos) if tipos else None, cliente_id)
+        with self._lock:
+            self._por_loop.setdefault(s.loop, set()).add(s)
+            if ultimo_id is not None and self._historial:
+                if self._historial[0].id > ultimo_id + 1:
+                    s.poner(_trama(RESYNC, {"motivo": "historial"}))
+                else:
+                    for evento in self._historial:
+                        if evento.id > ultimo_id and s.acepta(evento):
+                            s.poner(evento.trama)
+        return s
+
+    def cancelar(self, s: Suscripcion) -> None:
+        with self._lock:
+            suscripciones = self._por_loop.get(s.loop)
+            if suscripciones is not None:
+                suscripciones.discard(s)
+                if not suscripciones:
+                    del self._por_loop[s.loop]
+
+    def publicar(self, tipo: str, datos: dict[str, Any], cliente_id: Optional[str] = None) -> Evento:
+        """Publica desde cualquier hilo; no bloquea ni falla si no hay nadie escuchando."""
+        cliente_id = str(cliente_id) if cliente_id is not None else None
+        with self._lock:
+            id = next(self._ids)
+            evento = Evento(id, tipo, cliente_id, _trama(tipo, {**datos, "cliente_id": cliente_id}, id))
+            self._historial.append(evento)
+            self.publicados += 1
+            destinos = [(loop, tuple(subs)) for loop, subs in self._por_loop.items()]
+        for loop, subs in destinos:
+            try:
+                loop.call_soon_threadsafe(_entregar, evento, subs)
+            except RuntimeError:
+                # Loop cerrado (worker que se apago): sus suscripciones ya no existen
+                with self._lock:
+                    self._por_loop.pop(loop, None)
+        return evento
+
+    def estado(self) -> dict[str, Any]:
+        with self._lock:
+            return {
+                "suscripciones": sum(len(s) for s in self._por_loop.values()),
+                "publicados": self.publicados,
+                "ultimo_id": self._historial[-1].id if self._historial else None,
+            }
+
+
+def _entregar(evento: Evento, suscripciones: tuple[Suscripcion, ...]) -> None:
+    for s in suscripciones:
+        if s.acepta(evento):
+            s.poner(evento.trama)
+
+
+publicador = Publicador()
+
+
+def publicar(tipo: str, datos: dict[str, Any], cliente_id: Optional[str] = None) -> None:
+    """Atajo para los productores: un error al publicar nunca debe romper el guardado."""
+    try:
+        publicador.publicar(tipo, datos, cliente_id)
+    except Exception as e:
+        logger.warning(f"No se pudo publicar el evento {tipo}: {e}")
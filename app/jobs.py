@@ -0,0 +1,320 @@
+"""
+Cola local de jobs para scheduling y persistencia largos (lotes, horizonte),
+guardada en la base de la app y sin broker externo.
+
+- enviar(): guarda el job como 'pendiente' en la tabla trabajos, despierta un
+  worker del proceso y retorna de inmediato con el job_id.
+- Workers: JOBS_WORKERS hilos por proceso. Cada uno toma el pendiente mas
+  viejo con un UPDATE condicional (WHERE estado='pendiente'), asi dos workers,
+  aun de procesos distintos, nunca ejecutan el mismo job. Sin aviso local
+  revisan la tabla cada JOBS_POLL_SEG.
+- Tipos: registrar_tipo(nombre, funcion, validar). La funcion recibe los
+  parametros (dict) y retorna el resultado (dict, modelo o Response de
+  FastAPI), que se guarda como JSON. Si lanza HTTPException se guardan su
+  status y detalle, y el resultado responde igual que el endpoint sincronico.
+- Latido: mientras un job corre, su worker renueva latido_en cada
+  JOBS_LATIDO_SEG. Un job largo sigue vivo mientras el latido avance.
+- Retencion: los jobs terminados se borran pasadas JOBS_RETENCION_HORAS. Los
+  'en_curso' sin latido durante JOBS_VENCIMIENTO_SEG (su worker murio)
+  vuelven a 'pendiente' hasta JOBS_MAX_INTENTOS veces. Si el worker original
+  termina despues de eso, su resultado se descarta: solo el worker que tiene
+  el job en curso puede cerrarlo.
+"""
+import json
+import logging
+import os
+import socket
+import threading
+import time
+import traceback
+import uuid
+from datetime import datetime, timedelta
+from typing import Any, Callable, Optional
+
+from fastapi import HTTPException
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import Response
+from sqlalchemy import delete, func, update
+from sqlalchemy.exc import SQLAlchemyError
+
+from app.database import SessionLocal
+from app.models import Trabajo
+
+logger = logging.getLogger(__name__)
+
+JOBS_WORKERS = int(os.getenv("JOBS_WORKERS", "2"))
+JOBS_POLL_SEG = float(os.getenv("JOBS_POLL_SEG", "2"))
+JOBS_RETENCION_HORAS = float(os.getenv("JOBS_RETENCION_HORAS", "24"))
+JOBS_LATIDO_SEG = float(os.getenv("JOBS_LATIDO_SEG", "15"))
+JOBS_VENCIMIENTO_SEG = int(os.getenv("JOBS_VENCIMIENTO_SEG", "120"))
+JOBS_MAX_INTENTOS = int(os.getenv("JOBS_MAX_INTENTOS", "2"))
+# Cada cuanto un worker aplica la retencion y recupera jobs vencidos
+_LIMPIEZA_SEG = 300
+
+PENDIENTE = "pendiente"
+EN_CURSO = "en_curso"
+COMPLETADO = "completado"
+ERROR = "error"
+TERMINADOS = (COMPLETADO, ERROR)
+
+
+class _Tipo:
+    __slots__ = ("funcion", "validar")
+
+    def __init__(self, funcion: Callable[[dict[str, Any]], Any], validar: Optional[Callable[[dict[str, Any]], Any]]):
+        self.funcion = funcion
+        self.validar = validar
+
+
+_TIPOS: dict[str, _Tipo] = {}
+
+
+def registrar_tipo(
+    nombre: str,
+    funcion: Callable[[dict[str, Any]], Any],
+    validar: Optional[Callable[[dict[str, Any]], Any]] = None,
+) -> None:
+    """`validar` corre al enviar (debe lanzar ValueError o ValidationError si los parametros no sirven)."""
+    _TIPOS[nombre] = _Tipo(funcion, validar)
+
+
+def tipos() -> list[str]:
+    return sorted(_TIPOS)
+
+
+def _estado(job: Trabajo) -> dict[str, Any]:
+    duracion = None
+    if job.iniciado_en and job.terminado_en:
+        duracion = round((job.terminado_en - job.iniciado_en).total_seconds(), 3)
+    return {
+        "job_id": job.id,
+        "tipo": job.tipo,
+        "estado": job.estado,
+        "codigo_http": job.codigo_http,
+        "error": job.error,
+        "intentos": job.intentos or 0,
+        "creado_en": job.creado_en.isoformat() if job.creado_en else None,
+        "iniciado_en": job.iniciado_en.isoformat() if job.iniciado_en else None,
+        "latido_en": job.latido_en.isoformat() if job.latido_en else None,
+        "terminado_en": job.terminado_en.isoformat() if job.terminado_en else None,
+        "duracion_seg": duracion,
+    }
+
+
+def enviar(tipo: str, parametros: dict[str, Any]) -> dict[str, Any]:
+    """Encola el job. Lanza ValueError si el tipo no existe o los parametros no validan."""
+    registro = _TIPOS.get(tipo)
+    if registro is None:
+        raise ValueError(f"Tipo de job desconocido: {tipo} (opciones: {', '.join(tipos())})")
+    if registro.validar:
+        registro.validar(parametros)
+    with SessionLocal() as db:
+        job = Trabajo(
+            id=uuid.uuid4().hex, tipo=tipo, estado=PENDIENTE, creado_en=datetime.utcnow(),
+            parametros=json.dumps(jsonable_encoder(parametros), ensure_ascii=False),
+        )
+        db.add(job)
+        db.commit()
+        estado = _estado(job)
+    workers.avisar()
+    return estado
+
+
+def obtener(job_id: str) -> Optional[dict[str, Any]]:
+    """Estado del job (sin el resultado); los pendientes traen su posicion en la cola."""
+    with SessionLocal() as db:
+        job = db.get(Trabajo, job_id)
+        if job is None:
+            return None
+        estado = _estado(job)
+        if job.estado == PENDIENTE:
+            estado["posicion"] = db.query(func.count(Trabajo.id)).filter(
+                Trabajo.estado == PENDIENTE, Trabajo.creado_en < job.creado_en,
+            ).scalar() + 1
+        return estado
+
+
+def resultado(job_id: str) -> Optional[tuple[dict[str, Any], Optional[str]]]:
+    """(estado, resultado JSON tal cual se guardo) o None si el job no existe."""
+    with SessionLocal() as db:
+        job = db.get(Trabajo, job_id)
+        if job is None:
+            return None
+        return _estado(job), job.resultado
+
+
+def listar(estado: Optional[str] = None, tipo: Optional[str] = None, limite: int = 50) -> list[dict[str, Any]]:
+    with SessionLocal() as db:
+        q = db.query(Trabajo)
+        if estado:
+            q = q.filter(Trabajo.estado == estado)
+        if tipo:
+            q = q.filter(Trabajo.tipo == tipo)
+        return [_estado(j) for j in q.order_by(Trabajo.creado_en.desc()).limit(limite)]
+
+
+def _serializar(valor: Any) -> str:
+    if isinstance(valor, Response):
+        # Respuestas ya serializadas por el endpoint (ORJSONResponse del lote)
+        return bytes(valor.body).decode("utf-8")
+    return json.dumps(jsonable_encoder(valor), ensure_ascii=False)
+
+
+def _tomar(worker: str) -> Optional[Trabajo]:
+    """Reclama el pendiente mas viejo; si otro worker lo gano, prueba con el siguiente."""
+    with SessionLocal() as db:
+        candidatos = [
+            job_id for (job_id,) in db.query(Trabajo.id)
+            .filter(Trabajo.estado == PENDIENTE)
+            .order_by(Trabajo.creado_en)
+            .limit(JOBS_WORKERS + 1)
+        ]
+        for job_id in candidatos:
+            tomado = db.execute(
+                update(Trabajo)
+                .where(Trabajo.id == job_id, Trabajo.estado == PENDIENTE)
+                .values(estado=EN_CURSO, worker=worker, iniciado_en=datetime.utcnow(),
+                        latido_en=datetime.utcnow(), intentos=Trabajo.intentos + 1)
+            ).rowcount
+            db.commit()
+            if tomado:
+                job = db.get(Trabajo, job_id)
+                db.expunge(job)
+                return job
+    return None
+
+
+def _terminar(
+    job_id: str, worker: str, estado: str, resultado_json: Optional[str], codigo: int, error: Optional[str]
+) -> None:
+    with SessionLocal() as db:
+        cerrado = db.execute(
+            update(Trabajo)
+            .where(Trabajo.id == job_id, Trabajo.worker == worker, Trabajo.estado == EN_CURSO)
+            .values(estado=estado, resultado=resultado_json, codigo_http=codigo, error=error,
+                    terminado_en=datetime.utcnow())
+        ).rowcount
+        db.commit()
+    if not cerrado:
+        logger.warning(f"Job {job_id}: ya no esta en curso en {worker}, se descarta su resultado ({estado})")
+
+
+def _latir(job_id: str, worker: str, fin: threading.Event) -> None:
+    """Renueva latido_en del job hasta que termine (o deje de ser de este worker)."""
+    while not fin.wait(JOBS_LATIDO_SEG):
+        try:
+            with SessionLocal() as db:
+                vigente = db.execute(
+                    update(Trabajo)
+                    .where(Trabajo.id == job_id, Trabajo.worker == worker, Trabajo.estado == EN_CURSO)
+                    .values(latido_en=datetime.utcnow())
+                ).rowcount
+                db.commit()
+            if not vigente:
+                return
+        except SQLAlchemyError as e:
+            logger.warning(f"Job {job_id}: no se pudo renovar el latido: {e}")
+
+
+def _ejecutar(job: Trabajo) -> None:
+    registro = _TIPOS.get(job.tipo)
+    if registro is None:
+        _terminar(job.id, job.worker, ERROR, None, 400, f"Tipo de job desconocido: {job.tipo}")
+        return
+    fin = threading.Event()
+    threading.Thread(
+        target=_latir, args=(job.id, job.worker, fin), name=f"jobs-latido-{job.id[:8]}", daemon=True,
+    ).start()
+    try:
+        salida = _serializar(registro.funcion(json.loads(job.parametros)))
+    except HTTPException as e:
+        detalle = e.detail if isinstance(e.detail, str) else json.dumps(jsonable_encoder(e.detail))
+        _terminar(job.id, job.worker, ERROR, None, e.status_code, detalle)
+    except Exception as e:
+        logger.error(f"Job {job.id} ({job.tipo}) fallo: {traceback.format_exc()}")
+        _terminar(job.id, job.worker, ERROR, None, 500, str(e))
+    else:
+        _terminar(job.id, job.worker, COMPLETADO, salida, 200, None)
+    finally:
+        fin.set()
+
+
+def limpiar() -> dict[str, int]:
+    """Borra los jobs terminados fuera de la retencion y recupera los en_curso sin latido."""
+    ahora = datetime.utcnow()
+    vencido = ahora - timedelta(seconds=JOBS_VENCIMIENTO_SEG)
+    # Jobs tomados antes de que existiera latido_en: cuenta desde que empezaron
+    sin_latido = func.coalesce(Trabajo.latido_en, Trabajo.iniciado_en) < vencido
+    with SessionLocal() as db:
+        borrados = db.execute(
+            delete(Trabajo).where(
+                Trabajo.estado.in_(TERMINADOS),
+                Trabajo.terminado_en < ahora - timedelta(hours=JOBS_RETENCION_HORAS),
+            )
+        ).rowcount
+        reencolados = db.execute(
+            update(Trabajo)
+            .where(Trabajo.estado == EN_CURSO, sin_latido, Trabajo.intentos < JOBS_MAX_INTENTOS)
+            .values(estado=PENDIENTE, worker=None)
+        ).rowcount
+        abandonados = db.execute(
+            update(Trabajo)
+            .where(Trabajo.estado == EN_CURSO, sin_latido)
+            .values(estado=ERROR, codigo_http=500, terminado_en=ahora,
+                    error="El worker que ejecutaba el job no termino (reintentos agotados)")
+        ).rowcount
+        db.commit()
+    if reencolados:
+        workers.avisar()
+    return {"borrados": borrados, "reencolados": reencolados, "abandonados": abandonados}
+
+
+class Workers:
+    """Hilos que ejecutan los jobs de la tabla; un aviso por job enviado en este proceso."""
+
+    def __init__(self):
+        self._stop = threading.Event()
+        self._avisos = threading.Semaphore(0)
+        self._hilos: list[threading.Thread] = []
+        self._prefijo = f"{socket.gethostname()}:{os.getpid()}"
+
+    def iniciar(self, cantidad: int = JOBS_WORKERS) -> None:
+        if self._hilos or cantidad <= 0:
+            return
+        self._stop.clear()
+        for i in range(cantidad):
+            hilo = threading.Thread(target=self._loop, args=(i,), name=f"jobs-worker-{i}", daemon=True)
+            hilo.start()
+            self._hilos.append(hilo)
+
+    def detener(self) -> None:
+        self._stop.set()
+        for _ in self._hilos:
+            self._avisos.release()
+        self._hilos = []
+
+    def avisar(self) -> None:
+        self._avisos.release()
+
+    def activos(self) -> int:
+        return len(self._hilos)
+
+    def _loop(self, indice: int) -> None:
+        worker = f"{self._prefijo}:{indice}"
+        proxima_limpieza = 0.0
+        while not self._stop.is_set():
+            try:
+                # Un solo hilo por proceso aplica la retencion
+                if indice == 0 and time.monotonic() >= proxima_limpieza:
+                    limpiar()
+                    proxima_limpieza = time.monotonic() + _LIMPIEZA_SEG
+                job = _tomar(worker)
+                if job is not None:
+                    _ejecutar(job)
+                    continue
+            except SQLAlchemyError as e:
+                logger.warning(f"Cola de jobs sin base de datos: {e}")
+            self._avisos.acquire(timeout=JOBS_POLL_SEG)
+
+
+workers = Workers()
@@ -0,0 +1,162 @@
+"""
+JSON Patch (RFC 6902) y JSON Pointer (RFC 6901) para los borradores de despacho.
+
+aplicar() recibe el documento ya decodificado (json.loads) y lo modifica en el
+lugar: el llamador siempre parte de una copia recien leida de la base, asi un
+patch que falla a la mitad no deja nada a medias. Retorna el documento porque
+una operacion sobre la raiz ("") lo reemplaza completo.
+
+Operaciones: add, remove, replace, move, copy y test. Cualquier error (op
+desconocida, ruta inexistente, test que no coincide) lanza JsonPatchError.
+"""
+import copy
+from typing import Any
+
+OPERACIONES = ("add", "remove", "replace", "move", "copy", "test")
+
+
+class JsonPatchError(ValueError):
+    pass
+
+
+def _puntero(ruta: Any) -> list[str]:
+    if not isinstance(ruta, str):
+        raise JsonPatchError(f"Ruta invalida: {ruta!r}")
+    if ruta == "":
+        return []
+    if not ruta.startswith("/"):
+        raise JsonPatchError(f"La ruta debe empezar con '/': {ruta}")
+    return [t.replace("~1", "/").replace("~0", "~") for t in ruta[1:].split("/")]
+
+
+def _indice(lista: list, token: str, ruta: str, para_agregar: bool = False) -> int:
+    if para_agregar and token == "-":
+        return len(lista)
+    if not token.isdigit() or (len(token) > 1 and token[0] == "0"):
+        raise JsonPatchError(f"Indice de lista invalido en {ruta}")
+    i = int(token)
+    if i > len(lista) or (i == len(lista) and not para_agregar):
+        raise JsonPatchError(f"Indice fuera de rango en {ruta}")
+    return i
+
+
+def _padre(documento: Any, tokens: list[str], ruta: str) -> Any:
+    """Contenedor del ultimo token de la ruta."""
+    actual = documento
+    for token in tokens[:-1]:
+        if isinstance(actual, dict):
+            if token not in actual:
+                raise JsonPatchError(f"Ruta inexistente: {ruta}")
+            actual = actual[token]
+        elif isinstance(actual, list):
+            actual = actual[_indice(actual, token, ruta)]
+        else:
+            raise JsonPatchError(f"Ruta inexistente: {ruta}")
+    return actual
+
+
+def _leer(documento: Any, ruta: str) -> Any:
+    tokens = _puntero(ruta)
+    if not tokens:
+        return documento
+    padre = _padre(documento, tokens, ruta)
+    if isinstance(padre, dict):
+        if tokens[-1] not in padre:
+            raise JsonPatchError(f"Ruta inexistente: {ruta}")
+        return padre[tokens[-1]]
+    if isinstance(padre, list):
+        return padre[_indice(padre, tokens[-1], ruta)]
+    raise JsonPatchError(f"Ruta inexistente: {ruta}")
+
+
+def _agregar(documento: Any, ruta: str, valor: Any) -> Any:
+    tokens = _puntero(ruta)
+    if not tokens:
+        return valor
+    padre = _padre(documento, tokens, ruta)
+    if isinstance(padre, dict):
+        padre[tokens[-1]] = valor
+    elif isinstance(padre, list):
+        padre.insert(_indice(padre, tokens[-1], ruta, para_agregar=True), valor)
+    else:
+        raise JsonPatchError(f"Ruta inexistente: {ruta}")
+    return documento
+
+
+def _quitar(documento: Any, ruta: str) -> Any:
+    """Quita y retorna el valor de la ruta (la raiz no se puede quitar)."""
+    tokens = _puntero(ruta)
+    if not tokens:
+        raise JsonPatchError("No se puede quitar la raiz del documento")
+    padre = _padre(documento, tokens, ruta)
+    if isinstance(padre, dict):
+        if tokens[-1] not in padre:
+            raise JsonPatchError(f"Ruta inexistente: {ruta}")
+        return padre.pop(tokens[-1])
+    if isinstance(padre, list):
+        return padre.pop(_indice(padre, tokens[-1], ruta))
+    raise JsonPatchError(f"Ruta inexistente: {ruta}")
+
+
+def _iguales(a: Any, b: Any) -> bool:
+    # En JSON true no es igual a 1, aunque en Python si
+    if isinstance(a, bool) or isinstance(b, bool):
+        return type(a) is type(b) and a == b
+    if isinstance(a, dict) and isinstance(b, dict):
+        return a.keys() == b.keys() and all(_iguales(a[k], b[k]) for k in a)
+    if isinstance(a, list) and isinstance(b, list):
+        return len(a) == len(b) and all(_iguales(x, y) for x, y in zip(a, b))
+    if isinstance(a, (int, float)) and isinstance(b, (int, float)):
+        return a == b
+    return type(a) is type(b) and a == b
+
+
+def _campo(operacion: dict, nombre: str) -> Any:
+    if nombre not in operacion:
+        raise JsonPatchError(f"Falta '{nombre}' en la operacion {operacion.get('op')}")
+    return operacion[nombre]
+
+
+def validar(operaciones: Any) -> None:
+    """Revisa la forma del patch sin aplicarlo."""
+    if not isinstance(operaciones, list):
+        raise JsonPatchError("El patch debe ser una lista de operaciones")
+    for operacion in operaciones:
+        if not isinstance(operacion, dict) or operacion.get("op") not in OPERACIONES:
+            raise JsonPatchError(f"Operacion invalida: {operacion!r}")
+        _puntero(_campo(operacion, "path"))
+        if operacion["op"] in ("add", "replace", "test"):
+            _campo(operacion, "value")
+        elif operacion["op"] in ("move", "copy"):
+            _puntero(_campo(operacion, "from"))
+
+
+def aplicar(documento: Any, operaciones: list[dict]) -> Any:
+    """Aplica el patch sobre `documento` (lo modifica) y retorna el resultado."""
+    validar(operaciones)
+    for operacion in operaciones:
+        op, ruta = operacion["op"], operacion["path"]
+        if op == "add":
+            documento = _agregar(documento, ruta, copy.deepcopy(operacion["value"]))
+        elif op == "remove":
+            _quitar(documento, ruta)
+        elif op == "replace":
+            _leer(documento, ruta)
+            if ruta == "":
+                documento = copy.deepcopy(operacion["value"])
+            else:
+                _quitar(documento, ruta)
+                documento = _agregar(documento, ruta, copy.deepcopy(operacion["value"]))
+        elif op == "move":
+            origen = operacion["from"]
+            if origen == ruta:
+                _leer(documento, ruta)
+                continue
+            if ruta.startswith(origen + "/"):
+                raise JsonPatchError(f"No se puede mover {origen} dentro de si mismo")
+            documento = _agregar(documento, ruta, _quitar(documento, origen))
+        elif op == "copy":
+            documento = _agregar(documento, ruta, copy.deepcopy(_leer(documento, operacion["from"])))
+        elif not _iguales(_leer(documento, ruta), operacion["value"]):
+            raise JsonPatchError(f"test fallo en {ruta}")
+    return documento
@@ -1,19 +1,41 @@
 # Microservicio FastAPI para gestiÃ³n completa de CloudFleet
 import os
 import time
+import json
+import asyncio
+import base64
+import hashlib
 import logging
+import threading
 import traceback
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, date, timedelta
-from typing import List, Optional, Dict, Any
-from fastapi import FastAPI, HTTPException, Query, Depends
+from itertools import islice
+from typing import List, Optional, Dict, Any, Callable, Iterable
+from fastapi import FastAPI, HTTPException, Query, Depends, Request
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import FileResponse, JSONResponse, Response, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel, Field
-from sqlalchemy.orm import Session
-from app.database import engine, get_db, Base
-from app.models import Viaje, ViajeDetalle, DispatchDraft
+from fastapi.middleware.gzip import GZipMiddleware
+from pydantic import BaseModel, Field, TypeAdapter, ValidationError
+from sqlalchemy import delete, insert, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session, defer
+from app import assignment, carga, eventos, jobs, json_patch, route_catalog
+from app.database import SessionLocal, engine, get_db, Base, agregar_columnas_faltantes
+from app.models import Viaje, ViajeDetalle, DispatchDraft, DispatchDraftDelta, RutaCatalogo, Trabajo
 from app.quota_rules import get_quota_for_date, get_expected_sedes
+from app.snapshots import agregados, ciudad_de, indice_ciudad, normalizar
+from app.vias import AgregadorRutas, Vias, ViasRuta, estado_memo, vias_de_registro
+from app.upstream import Plazo, en_segundo_plano, enviar, planificador, plazo_actual, plazo_vencido
+
+try:
+    import orjson
+except ImportError:
+    # Sin orjson se serializa con el encoder estandar
+    orjson = None
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -24,8 +46,10 @@ try:
     from app.cloudfleet import (
         get_clientes, get_cliente, get_sedes, get_sede,
         get_rutas, get_ruta, get_camiones, get_personas,
-        get_persona, get_travels, get_travel, refresh_all_cache
+        get_persona, get_travels, get_travel, refresh_all_cache,
+        ttl_lru_cache, snapshot_version, cache_version, estado_cache_negativa
     )
+    from app import refresh_jobs, warmup
 except Exception:
     # Permite ejecutar aunque no exista cloudfleet.py configurado
     get_clientes = None
@@ -41,6 +65,17 @@ except Exception:
     get_travel = None
     refresh_all_cache = None
 
+    def ttl_lru_cache(seconds: int, maxsize: int = 128):
+        return lambda func: func
+
+    def snapshot_version(name: str) -> int:
+        return 0
+
+    cache_version = None
+    estado_cache_negativa = None
+    refresh_jobs = None
+    warmup = None
+
 # ParÃ¡metros de negocio
 MAX_DIAS_CONSECUTIVOS = int(os.getenv("MAX_DIAS_CONSECUTIVOS", "6"))
 FORCE_CLOUDFLEET = os.getenv("FORCE_CLOUDFLEET", "false").lower() == "true"
@@ -63,6 +98,139 @@ app = FastAPI(
     description="API para gestión completa de clientes, sedes, rutas, vehículos y personal"
 )
 
+# Comprime respuestas JSON grandes (listados de personal/vehiculos)
+app.add_middleware(GZipMiddleware, minimum_size=int(os.getenv("GZIP_MIN_SIZE", "1024")))
+
+app.mount("/public", StaticFiles(directory="public"), name="public")
+
+
+# ============= GET CONDICIONAL (ETag / 304) =============
+
+# Endpoints cuyo contenido solo cambia al refrescar su snapshot -> snapshots de los que dependen.
+# Clientes y sedes salen de caches TTL en memoria, por eso su version incluye la ventana TTL.
+ETAG_SNAPSHOTS: dict[str, tuple[str, ...]] = {
+    "/clientes": (),
+    "/sedes": (),
+    "/vehiculos": ("vehicles_all",),
+    "/personal": ("people_all",),
+}
+ETAG_TTL_CLIENTES = 300  # igual al ttl_lru_cache de get_clientes/get_sedes
+
+
+def _etag_para(request: Request) -> Optional[str]:
+    snapshots = ETAG_SNAPSHOTS.get(request.url.path)
+    if snapshots is None or cache_version is None:
+        return None
+    version = cache_version(*snapshots)
+    # El filtro por cliente (y clientes/sedes) depende de la cache TTL de clientes
+    if not snapshots or "cliente_id" in request.query_params:
+        version += f"-{int(time.time() // ETAG_TTL_CLIENTES)}"
+    query = "&".join(f"{k}={v}" for k, v in sorted(request.query_params.multi_items()))
+    digest = hashlib.sha1(f"{version}|{request.url.path}|{query}".encode("utf-8")).hexdigest()
+    return f'W/"{digest[:20]}"'
+
+
+@app.middleware("http")
+async def etag_condicional(request: Request, call_next):
+    """
+    Responde 304 si el If-None-Match coincide con la version actual, sin
+    ejecutar los filtros del endpoint.
+    """
+    if request.method != "GET":
+        return await call_next(request)
+    etag = _etag_para(request)
+    if etag is None:
+        return await call_next(request)
+
+    recibidos = {e.strip() for e in request.headers.get("if-none-match", "").split(",")}
+    if etag in recibidos or "*" in recibidos:
+        return Response(status_code=304, headers={"ETag": etag, "Cache-Control": "no-cache"})
+
+    response = await call_next(request)
+    plazo = plazo_actual.get()
+    # Un resultado parcial (plazo vencido) no debe quedar validado por el ETag
+    if response.status_code == 200 and not (plazo and plazo.parcial):
+        response.headers["ETag"] = etag
+        response.headers["Cache-Control"] = "no-cache"
+    return response
+
+
+# ============= PLAZO POR REQUEST =============
+
+# Plazo maximo aceptado (segundos) y plazo por defecto (0 = sin plazo)
+PLAZO_MAX_SEG = float(os.getenv("REQUEST_DEADLINE_MAX_SECONDS", "120"))
+PLAZO_DEFECTO_SEG = float(os.getenv("REQUEST_DEADLINE_DEFAULT_SECONDS", "0"))
+
+
+def _segundos_plazo(scope) -> Optional[float]:
+    """Plazo pedido en el header X-Request-Deadline o el query param deadline (segundos)."""
+    valor = None
+    for nombre, contenido in scope.get("headers", []):
+        if nombre == b"x-request-deadline":
+            valor = contenido.decode("latin-1")
+            break
+    if valor is None:
+        from urllib.parse import parse_qs
+        valor = (parse_qs(scope.get("query_string", b"").decode("latin-1")).get("deadline") or [None])[0]
+    try:
+        segundos = float(valor) if valor is not None else PLAZO_DEFECTO_SEG
+    except ValueError:
+        segundos = PLAZO_DEFECTO_SEG
+    if segundos <= 0:
+        return None
+    return min(segundos, PLAZO_MAX_SEG)
+
+
+class PlazoRequestMiddleware:
+    """
+    Fija el plazo de la request en app.upstream.plazo_actual: el planificador,
+    _get y el paginador lo respetan y devuelven resultados parciales.
+    - Si algo se corto por el plazo, la respuesta lleva X-Partial-Result: true.
+    - Si el cliente se desconecta se cancela el plazo, asi el trabajo pendiente
+      contra CloudFleet termina en la siguiente pagina en vez de seguir. Esto
+      aplica a toda request HTTP: sin plazo pedido se instala un Plazo que
+      no vence por tiempo y solo se corta por la desconexion.
+    Es un middleware ASGI puro para poder escuchar http.disconnect mientras el
+    endpoint corre.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        plazo = Plazo(_segundos_plazo(scope))
+        token = plazo_actual.set(plazo)
+        mensajes: asyncio.Queue = asyncio.Queue()
+
+        async def escuchar():
+            while True:
+                mensaje = await receive()
+                await mensajes.put(mensaje)
+                if mensaje["type"] == "http.disconnect":
+                    plazo.cancelar("client-disconnected")
+                    return
+
+        async def enviar_con_marca(mensaje):
+            if mensaje["type"] == "http.response.start" and plazo.parcial:
+                headers = list(mensaje.get("headers", []))
+                headers.append((b"x-partial-result", b"true"))
+                headers.append((b"x-partial-reason", (plazo.motivo or "deadline").encode("latin-1")))
+                mensaje = {**mensaje, "headers": headers}
+            await send(mensaje)
+
+        oyente = asyncio.create_task(escuchar())
+        try:
+            await self.app(scope, mensajes.get, enviar_con_marca)
+        finally:
+            oyente.cancel()
+            plazo_actual.reset(token)
+
+
+app.add_middleware(PlazoRequestMiddleware)
+
+# CORS va al final (capa externa) para que tambien cubra los 304 del ETag
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -71,15 +239,88 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-app.mount("/public", StaticFiles(directory="public"), name="public")
 
 # Startup event to create tables
 @app.on_event("startup")
 def startup():
     try:
         Base.metadata.create_all(bind=engine)
+        # create_all no agrega columnas ni indices nuevos a tablas existentes
+        agregar_columnas_faltantes(DispatchDraft.__table__)
+        for indice in DispatchDraft.__table__.indexes:
+            indice.create(bind=engine, checkfirst=True)
+        agregar_columnas_faltantes(RutaCatalogo.__table__)
+        for indice in RutaCatalogo.__table__.indexes:
+            indice.create(bind=engine, checkfirst=True)
+        route_catalog.migrar()
+        for indice in Viaje.__table__.indexes:
+            indice.create(bind=engine, checkfirst=True)
+        agregar_columnas_faltantes(Trabajo.__table__)
+        for indice in Trabajo.__table__.indexes:
+            indice.create(bind=engine, checkfirst=True)
+        with SessionLocal() as db:
+            carga.reconstruir_si_vacia(db)
     except Exception as e:
         logger.warning(f"DB Connection failed on startup: {e}")
+    # Los workers reintentan solos si la base todavia no responde
+    jobs.workers.iniciar()
+
+    # Precarga de snapshots y refresco programado (no bloquean el arranque)
+    if warmup and warmup.WARMUP_HABILITADO:
+        warmup.precargar()
+        _registrar_tareas_warmup()
+        warmup.programador.iniciar()
+
+
+@app.on_event("shutdown")
+def shutdown():
+    if warmup:
+        warmup.programador.detener()
+    jobs.workers.detener()
+    assignment.cerrar_pool()
+
+
+def _registrar_tareas_warmup():
+    """
+    Tareas periodicas de warmup. Repiten las mismas llamadas (mismos argumentos)
+    que hacen los endpoints, para que caigan en las mismas entradas de las
+    caches TTL de cloudfleet.
+    """
+    if warmup.programador.tareas:
+        return
+    clientes = [c.strip() for c in os.getenv("WARMUP_CLIENTES", "").split(",") if c.strip()]
+
+    def _catalogos():
+        get_clientes()
+        get_sedes(None)
+        for cid in clientes:
+            _resolver_cliente(cid)
+            get_sedes(cid)
+            # Deja calculado el resumen del cliente para la ventana actual
+            _resumen_cliente(cid)
+
+    def _rutas():
+        _registrar_rutas_catalogo(get_rutas(None, max_pages=10) or [], None)
+        for cid in clientes:
+            _registrar_rutas_catalogo(get_rutas(cid, max_pages=None) or [], cid)
+
+    warmup.programador.registrar(warmup.Tarea(
+        "snapshots", warmup.refrescar_snapshots,
+        cada_seg=int(os.getenv("WARMUP_SNAPSHOTS_CADA_SEG", "43200")),
+        requests_estimadas=warmup.paginas_snapshots,
+    ))
+    warmup.programador.registrar(warmup.Tarea(
+        "clientes_sedes", _catalogos,
+        cada_seg=int(os.getenv("WARMUP_CATALOGOS_CADA_SEG", "300")),
+        requests_estimadas=2 + 2 * len(clientes),
+        alinear_a=300,  # ventana de ttl_lru_cache(seconds=300)
+    ))
+    warmup.programador.registrar(warmup.Tarea(
+        "rutas", _rutas,
+        cada_seg=int(os.getenv("WARMUP_RUTAS_CADA_SEG", "900")),
+        requests_estimadas=10 + 2 * len(clientes),
+        alinear_a=300,
+    ))
 
 
 
@@ -120,6 +361,9 @@ class Ruta(BaseModel):
     vias: List[str] = Field(default_factory=list)
     vias_detalle: List[Dict[str, Any]] = Field(default_factory=list)
     datos_adicionales: Optional[Dict[str, Any]] = None
+    # Uso segun el catalogo de rutas (None si la ruta salio directo de la API)
+    trip_count: Optional[int] = None
+    last_seen: Optional[str] = None
 
 
 class Vehiculo(BaseModel):
@@ -185,6 +429,8 @@ class ResumenOperacional(BaseModel):
     total_rutas: int
     vehiculos_activos: int
     personal_activo: int
+    # Conteos por ciudad normalizada (vehiculos, personal, conductores, auxiliares, sedes, rutas)
+    por_ciudad: Dict[str, Dict[str, Any]] = Field(default_factory=dict)
 
 
 # ============= FUNCIONES AUXILIARES =============
@@ -193,6 +439,185 @@ def _parse_fecha(fecha_str: str) -> date:
     return datetime.strptime(fecha_str, "%Y-%m-%d").date()
 
 
+# Campos del registro crudo de CloudFleet que conserva la vista "slim" en
+# datos_adicionales (los que usan index.html y daily_dispatch.html).
+# La vista "full" devuelve el registro completo como antes.
+CAMPOS_SLIM: dict[str, tuple[str, ...]] = {
+    "cliente": (),
+    "sede": ("city", "customerId"),
+    "ruta": ("routeCode", "number", "viaCode", "via", "customerId"),
+    "vehiculo": ("city", "costCenter", "typeName", "customerId"),
+    "persona": ("city", "personalId", "positionType", "customerId"),
+}
+
+
+def _vista(view: Any) -> str:
+    """Normaliza el selector de vista ('full' o 'slim' por defecto)."""
+    return "full" if view == "full" else "slim"
+
+
+def _datos_vista(item: Optional[dict[str, Any]], entidad: str, view: Any) -> Optional[dict[str, Any]]:
+    """
+    Retorna datos_adicionales segun la vista: el registro crudo en "full" o
+    solo las claves de CAMPOS_SLIM (sin copiar el resto del diccionario) en "slim".
+    """
+    if not item:
+        return None
+    if _vista(view) == "full":
+        return item
+    recortado = {k: item[k] for k in CAMPOS_SLIM[entidad] if item.get(k) is not None}
+    return recortado or None
+
+
+def _vias_detalle_vista(detalle: list[dict[str, Any]], view: Any) -> list[dict[str, Any]]:
+    """En vista slim las vias no arrastran el objeto 'raw' de la API."""
+    if _vista(view) == "full":
+        return detalle
+    return [{"code": d.get("code"), "name": d.get("name")} for d in detalle]
+
+
+def _campos_solicitados(fields: Any) -> Optional[set[str]]:
+    if not isinstance(fields, str) or not fields.strip():
+        return None
+    return {f.strip() for f in fields.split(",") if f.strip()}
+
+
+def _orjson_default(obj: Any) -> Any:
+    if isinstance(obj, BaseModel):
+        return obj.model_dump(mode="json")
+    if isinstance(obj, (set, frozenset)):
+        return list(obj)
+    raise TypeError(f"Tipo no serializable: {type(obj).__name__}")
+
+
+class ORJSONResponse(JSONResponse):
+    """
+    JSONResponse serializado con orjson (modelos Pydantic incluidos).
+    Si orjson no esta instalado usa el encoder estandar de FastAPI.
+    """
+
+    def render(self, content: Any) -> bytes:
+        if orjson is None:
+            return super().render(jsonable_encoder(content))
+        return orjson.dumps(content, default=_orjson_default, option=orjson.OPT_NON_STR_KEYS)
+
+
+# TypeAdapters precompilados para serializar listados sin pasar por
+# response_model + jsonable_encoder (que revalidan y recorren cada item en Python)
+_ADAPTADORES_LISTA: dict[type, TypeAdapter] = {
+    modelo: TypeAdapter(List[modelo]) for modelo in (Cliente, Sede, Ruta, Vehiculo, Persona)
+}
+
+
+def _responder_lista(modelos: list[BaseModel], fields: Any, modelo: type) -> Response:
+    """
+    Serializa un listado de modelos directamente a bytes JSON. Al retornar un
+    Response, FastAPI no vuelve a validar contra response_model.
+    Con fields=a,b,c proyecta cada modelo a esos campos.
+    """
+    campos = _campos_solicitados(fields)
+    if campos:
+        return ORJSONResponse(content=[m.model_dump(mode="json", include=campos) for m in modelos])
+    return Response(content=_ADAPTADORES_LISTA[modelo].dump_json(modelos), media_type="application/json")
+
+
+# Paginacion por cursor y salida NDJSON para listados grandes
+LIMITE_PAGINA_MAX = 5000
+FORMATO_LISTA_PATTERN = "^(json|ndjson)$"
+
+
+def _codificar_cursor(posicion: int, version: Any) -> str:
+    """Cursor opaco: siguiente posicion + version del snapshot que la produjo."""
+    crudo = json.dumps({"p": posicion, "v": version}, separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(crudo).decode("ascii").rstrip("=")
+
+
+def _decodificar_cursor(cursor: Optional[str], version: Any) -> int:
+    """
+    Posicion desde la que seguir. Un cursor de otra version del snapshot
+    (refrescado entre paginas) no es valido: el cliente debe reiniciar.
+    """
+    if not cursor:
+        return 0
+    try:
+        relleno = "=" * (-len(cursor) % 4)
+        datos = json.loads(base64.urlsafe_b64decode(cursor + relleno))
+        posicion = int(datos["p"])
+        vigente = datos.get("v") == version and posicion >= 0
+    except Exception:
+        vigente = False
+    if not vigente:
+        raise HTTPException(status_code=400, detail="Cursor invalido o expirado, reinicie la paginacion")
+    return posicion
+
+
+def _responder_pagina(
+    pares: Iterable[tuple[int, BaseModel]],
+    modelo: type,
+    fields: Any,
+    formato: str,
+    limit: Optional[int],
+    version: Callable[[], Any],
+    entidad: str,
+) -> Response:
+    """
+    Responde un listado a partir de un iterador de (posicion, modelo).
+    - Con limit corta la pagina y deja el siguiente cursor en X-Next-Cursor.
+    - Con formato ndjson emite un modelo por linea; sin limit lo hace en
+      streaming, sin materializar el listado completo.
+    """
+    campos = _campos_solicitados(fields)
+
+    def _lineas(modelos: Iterable[BaseModel]):
+        for m in modelos:
+            yield m.model_dump_json(include=campos) + "\n"
+
+    if formato == "ndjson" and not limit:
+        return StreamingResponse(_lineas(m for _, m in pares), media_type="application/x-ndjson")
+
+    try:
+        # Se lee un elemento de mas para saber si hay otra pagina
+        pagina = list(islice(pares, limit + 1)) if limit else list(pares)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error al obtener {entidad}: {str(e)}")
+
+    headers = {}
+    if limit and len(pagina) > limit:
+        headers["X-Next-Cursor"] = _codificar_cursor(pagina[limit][0], version())
+        pagina = pagina[:limit]
+    modelos = [m for _, m in pagina]
+
+    if formato == "ndjson":
+        return Response(content="".join(_lineas(modelos)), media_type="application/x-ndjson", headers=headers)
+    respuesta = _responder_lista(modelos, fields, modelo)
+    respuesta.headers.update(headers)
+    return respuesta
+
+
+def _con_carga(personas: list[dict], fecha: date) -> list[dict]:
+    """
+    Copia de las personas con `dias_consecutivos` y `ultima_asignacion` tomados
+    de la carga confirmada (app/carga.py): CloudFleet no trae esos campos.
+    """
+    try:
+        with SessionLocal() as db:
+            cargas = carga.leer(db, [(carga.PERSONA, str(p.get("id"))) for p in personas])
+    except Exception as e:
+        logger.warning(f"No se pudo leer la carga de personas: {e}")
+        cargas = {}
+    resultado = []
+    for p in personas:
+        c = cargas.get((carga.PERSONA, str(p.get("id")))) or carga.Carga()
+        resultado.append({
+            **p,
+            "dias_consecutivos": c.consecutivos_antes(fecha) or 0,
+            "ultima_asignacion": c.ultima_fecha.isoformat() if c.ultima_fecha else "",
+        })
+    return resultado
+
+
 def _filtrar_consecutivos(personas: list[dict]) -> list[dict]:
     filtradas = []
     for p in personas:
@@ -224,6 +649,52 @@ def _rotar_personas(personas: list[dict]) -> list[dict]:
     )
 
 
+@ttl_lru_cache(seconds=300)
+def _resolver_cliente(cliente_id: str) -> tuple[str, frozenset[str]]:
+    """
+    Resuelve el nombre del cliente (en mayusculas) y los IDs de su grupo
+    (LINDE <-> PRAXAIR) con una sola consulta a /clientes.
+    Se cachea para que vehiculos, personal y rutas compartan la resolucion.
+    """
+    c_name = ""
+    all_c: list[Cliente] = []
+    try:
+        # 1. Usar listar_clientes (que tiene logica fallback y funciona)
+        all_c = listar_clientes(view="slim") or []
+        for c in all_c:
+            if str(c.id) == str(cliente_id):
+                c_name = (c.nombre or "").upper()
+                break
+
+        # 2. Si falla, API directa
+        if not c_name and get_cliente:
+            c_data = get_cliente(cliente_id)
+            c_name = (c_data.get("name") or "").upper()
+    except Exception as e:
+        logger.warning(f"Error resolviendo nombre de cliente {cliente_id}: {e}")
+
+    return c_name, _grupo_cliente(str(cliente_id), c_name, all_c)
+
+
+def _grupo_cliente(cliente_id: str, c_name: str, all_c: list[Cliente]) -> frozenset[str]:
+    """IDs del cliente y de su grupo (LINDE <-> PRAXAIR) dentro del listado de clientes."""
+    target_ids = {cliente_id}
+    if "LINDE" in c_name or "PRAXAIR" in c_name:
+        # Es del grupo. Buscar el ID del otro.
+        for c in all_c:
+            cn = (c.nombre or "").upper()
+            cid = str(c.id)
+            if cid == cliente_id:
+                continue
+            if "LINDE" in c_name:
+                if "PRAXAIR" in cn:
+                    target_ids.add(cid)
+            elif "PRAXAIR" in c_name:
+                if "LINDE" in cn:
+                    target_ids.add(cid)
+    return frozenset(target_ids)
+
+
 def _ciudades_por_cliente(cliente_id: Optional[str]) -> set[str]:
     """
     Retorna las ciudades asociadas a las sedes del cliente para poder filtrar
@@ -249,20 +720,8 @@ def _ciudades_por_cliente(cliente_id: Optional[str]) -> set[str]:
                 ciudades.add(str(ciudad).lower())
     
     # Adicion: Buscar en Quota Rules (Excel) usando resolucion robusta de nombre
-    c_name = ""
     try:
-        # 1. Usar listar_clientes (logic robusta)
-        all_c = listar_clientes() or []
-        for c in all_c:
-            if str(c.id) == str(cliente_id):
-                c_name = (c.nombre or "").upper()
-                break
-        
-        # 2. Direct fetch
-        if not c_name and get_cliente:
-             c_d = get_cliente(cliente_id)
-             c_name = (c_d.get("name") or "").upper()
-
+        c_name, _ = _resolver_cliente(str(cliente_id))
         if c_name:
             expected = get_expected_sedes(c_name)
             for city in expected:
@@ -480,73 +939,225 @@ def _route_codes_candidates(
             continue
         dedup.append(code)
         seen.add(code)
+
+    # Si ya sabemos cual variante tiene viajes para este cliente/ciudad, va primero
+    aprendido = _CODIGOS_RUTA_APRENDIDOS.get(_clave_codigo_ruta(cliente_id, ciudad))
+    if aprendido in seen:
+        dedup.remove(aprendido)
+        dedup.insert(0, aprendido)
     return dedup
 
 
-def _agregar_via(
-    codigos: set[str],
-    detalle: list[dict[str, Any]],
-    code: Optional[str],
-    name: Optional[str],
-    raw: Optional[dict[str, Any]] = None,
-) -> None:
-    if not code and not name:
-        return
-    code_clean = str(code).strip() if code else ""
-    name_clean = str(name).strip() if name else ""
-    if code_clean:
-        codigos.add(code_clean)
-    detalle.append(
-        {
-            "code": code_clean or None,
-            "name": name_clean or None,
-            "raw": raw or {},
-        }
-    )
+# (cliente_id, ciudad normalizada) -> codigo de ruta candidato que devolvio viajes
+_CODIGOS_RUTA_APRENDIDOS: dict[tuple[str, str], str] = {}
+
+
+def _clave_codigo_ruta(cliente_id: Optional[str], ciudad: Optional[str]) -> tuple[str, str]:
+    return (str(cliente_id or ""), normalizar(ciudad))
 
 
-def _vias_desde_item(item: dict[str, Any]) -> tuple[list[str], list[dict[str, Any]], Optional[str]]:
+def _aprender_codigo_ruta(cliente_id: Optional[str], ciudad: Optional[str], codigo: str) -> None:
+    clave = _clave_codigo_ruta(cliente_id, ciudad)
+    if _CODIGOS_RUTA_APRENDIDOS.get(clave) != codigo:
+        logger.info(f"Codigo de ruta aprendido para {clave}: {codigo}")
+        _CODIGOS_RUTA_APRENDIDOS[clave] = codigo
+
+
+def _vias_desde_item(item: dict[str, Any], tipo: str = "route") -> Vias:
     """
     Extrae cÃ³digos y detalle de vÃ­as desde un item (route o travel).
-    Retorna (codigos_unicos, detalle, via_codigo_principal)
+    Retorna (codigos_unicos, detalle, via_codigo_principal) como tuplas
+    compartidas: se calcula una vez por numero de viaje / id de ruta.
     """
-    codigos: set[str] = set()
-    detalle: list[dict[str, Any]] = []
-    principal: Optional[str] = None
+    return vias_de_registro(item, tipo)
+
+
+def _codigo_ruta_item(item: dict[str, Any]) -> str:
+    return item.get("code") or item.get("routeCode") or item.get("codigo") or "SIN-COD"
+
+
+def _codigo_ruta_travel(t: dict[str, Any]) -> str:
+    return t.get("routeCode") or t.get("code") or t.get("route", {}).get("code") or "SIN-COD"
+
+
+def _registrar_rutas_catalogo(rutas_data: list[dict[str, Any]], cliente_id: Optional[str]) -> None:
+    """Alimenta el catalogo con los items crudos de /routes (sin filtrar)."""
+    entradas = []
+    for item in rutas_data:
+        vias_codigos, vias_detalle, via_codigo = _vias_desde_item(item)
+        entradas.append({
+            "fuente": "routes",
+            "ref_id": item.get("id"),
+            "cliente_id": str(item.get("customerId") or item.get("cliente_id") or cliente_id or ""),
+            "sede_id": item.get("locationId", item.get("sede_id")),
+            "codigo": _codigo_ruta_item(item),
+            "nombre": item.get("name", item.get("nombre")),
+            "origen": _parse_location(item.get("origin", item.get("origen"))),
+            "destino": _parse_location(item.get("destination", item.get("destino"))),
+            "distancia_km": item.get("distance", item.get("distancia_km")),
+            "activa": item.get("active", item.get("activa", True)),
+            "via_codigo": via_codigo,
+            "vias": vias_detalle,
+            "datos": item,
+        })
+    route_catalog.registrar(entradas)
+
+
+def _registrar_travels_catalogo(travels: list[dict[str, Any]], cliente_id: Optional[str]) -> None:
+    """Alimenta el catalogo con los viajes crudos; cada numero de viaje suma una vez."""
+    entradas = []
+    for t in travels:
+        city_obj = t.get("city")
+        vias_codigos, vias_detalle, via_codigo = _vias_desde_item(t, "travel")
+        codigo = _codigo_ruta_travel(t)
+        entradas.append({
+            "fuente": "travels",
+            "ref_id": t.get("number"),
+            "numero_viaje": t.get("number"),
+            "visto": t.get("createdDate") or t.get("departureDate"),
+            "cliente_id": str(cliente_id or t.get("customerId") or ""),
+            "codigo": codigo,
+            "nombre": t.get("route", {}).get("name") or codigo,
+            "origen": _parse_location(t.get("origin")),
+            "destino": _parse_location(t.get("destination")),
+            "ciudad": city_obj.get("name") if isinstance(city_obj, dict) else city_obj,
+            "activa": not t.get("isFinished", False),
+            "via_codigo": via_codigo,
+            "vias": vias_detalle,
+            "datos": t,
+        })
+    route_catalog.registrar(entradas)
+
+
+def _via_en_catalogo(fila: dict[str, Any], via_code: Optional[str]) -> bool:
+    if not via_code:
+        return True
+    codigos = [c.upper() for c in [fila["via_codigo"], *(v["code"] for v in fila["vias"])] if c]
+    return not codigos or via_code.upper() in codigos
 
-    # Campos directos de vÃ­a
-    via_code = item.get("viaCode") or item.get("via_codigo") or item.get("via_code")
-    via_name = item.get("viaName") or item.get("via_nombre") or item.get("via_name")
-    via_obj = item.get("via") or item.get("way") or item.get("viaObj")
-    
-    # Si via es un objeto, extraer sus datos
-    if isinstance(via_obj, dict):
-        via_code = via_code or via_obj.get("code")
-        via_name = via_name or via_obj.get("name")
-        if via_obj.get("code") or via_obj.get("name"):
-            _agregar_via(codigos, detalle, via_obj.get("code"), via_obj.get("name"), raw=via_obj)
-
-    # Listado de ways/vÃ­as (puede venir como 'ways', 'vias', 'routesWays')
-    ways = item.get("ways") or item.get("vias") or item.get("routesWays") or []
-    if isinstance(ways, list):
-        for w in ways:
-            if isinstance(w, dict):
-                _agregar_via(codigos, detalle, w.get("code"), w.get("name"), raw=w)
-            elif isinstance(w, str):
-                # Algunos casos retornan lista de cÃ³digos directamente
-                _agregar_via(codigos, detalle, w, None, raw={"code": w})
-
-    # Campos sueltos de vÃ­a principal
-    if via_code or via_name:
-        _agregar_via(codigos, detalle, via_code, via_name, raw=via_obj if isinstance(via_obj, dict) else None)
-
-    # Determinar vÃ­a principal
-    if via_code:
-        principal = str(via_code)
-    elif codigos:
-        principal = next(iter(codigos))
-
-    return list(codigos), detalle, principal
+
+def _ruta_desde_catalogo(fila: dict[str, Any], view: str) -> Ruta:
+    vias = ViasRuta(
+        (v.get("code") for v in fila["vias"]),
+        ({"code": v.get("code"), "name": v.get("name"), "raw": v.get("raw") or {}} for v in fila["vias"]),
+    )
+    return Ruta(
+        id=str(fila["ref_id"] or f"cat-{fila['id']}"),
+        cliente_id=fila["cliente_id"],
+        sede_id=fila["sede_id"],
+        codigo=fila["codigo"],
+        nombre=fila["nombre"] or fila["codigo"],
+        origen=fila["origen"],
+        destino=fila["destino"],
+        distancia_km=fila["distancia_km"],
+        activa=fila["activa"] if fila["activa"] is not None else True,
+        via_codigo=fila["via_codigo"],
+        vias=vias.lista_codigos(),
+        vias_detalle=_vias_detalle_vista(vias.detalle, view),
+        datos_adicionales=_datos_vista(fila["datos"], "ruta", view),
+        trip_count=fila["trip_count"],
+        last_seen=fila["last_seen"],
+    )
+
+
+def _sincronizar_alcance(
+    consulta_api: Callable[..., list[Ruta]],
+    clave: str,
+    cliente_id: Optional[str],
+    ciudad: Optional[str],
+    route_code: Optional[str],
+    via_code: Optional[str],
+    view: str,
+) -> list[Ruta]:
+    """Consulta en vivo (alimenta el catalogo) y marca el alcance como sincronizado."""
+    rutas = consulta_api(cliente_id=cliente_id, ciudad=ciudad, route_code=route_code, via_code=via_code, view=view)
+    plazo = plazo_actual.get()
+    # Un resultado vacio puede ser un error de la API (se tragan): no se marca
+    if rutas and not (plazo and plazo.parcial):
+        route_catalog.marcar_sincronizado(clave, len(rutas))
+    return rutas
+
+
+def _paginar_rutas(
+    consulta_api: Callable[..., list[Ruta]],
+    cliente_id: Optional[str],
+    ciudad: Optional[str],
+    route_code: Optional[str],
+    via_code: Optional[str],
+    view: str,
+    filtrar_ciudad: bool,
+    fields: Any,
+    formato: str,
+    limit: Optional[int],
+    cursor: Optional[str],
+) -> Response:
+    """
+    Paginas y ndjson de rutas leidas del catalogo por lotes, a medida que se
+    serializan. La posicion del cursor es el id en el catalogo (keyset) y su
+    version sale de las filas que cumplen los filtros (total, ultimo id y
+    ultima actualizacion): un re-sync que cambia rutas invalida el cursor
+    aunque el total no cambie.
+    """
+    def _version() -> Optional[str]:
+        estado = route_catalog.version_consulta(cliente_id, ciudad, route_code, filtrar_ciudad)
+        return estado and estado[1]
+
+    estado = route_catalog.version_consulta(cliente_id, ciudad, route_code, filtrar_ciudad)
+    if estado is None:
+        raise HTTPException(status_code=503, detail="La paginacion de rutas requiere el catalogo de rutas")
+    if not cursor:
+        # Primera pagina: el alcance se sincroniza igual que en el listado completo
+        clave = route_catalog.alcance(cliente_id, ciudad, route_code, via_code)
+        if not route_catalog.vigente(route_catalog.ultima_sincronizacion(clave)):
+            if not estado[0]:
+                _sincronizar_alcance(consulta_api, clave, cliente_id, ciudad, route_code, via_code, "slim")
+            else:
+                route_catalog.sincronizar_en_segundo_plano(
+                    clave,
+                    lambda: _sincronizar_alcance(consulta_api, clave, cliente_id, ciudad, route_code, via_code, "slim"),
+                )
+    desde = _decodificar_cursor(cursor, _version())
+    pares = (
+        (f["id"], _ruta_desde_catalogo(f, view))
+        for f in route_catalog.iterar(cliente_id, ciudad, route_code, filtrar_ciudad, desde_id=desde)
+        if _via_en_catalogo(f, via_code)
+    )
+    return _responder_pagina(pares, Ruta, fields, formato, limit, _version, "rutas")
+
+
+def _rutas_con_catalogo(
+    consulta_api: Callable[..., list[Ruta]],
+    cliente_id: Optional[str],
+    ciudad: Optional[str],
+    route_code: Optional[str],
+    via_code: Optional[str],
+    view: str,
+    filtrar_ciudad: bool = True,
+) -> list[Ruta]:
+    """
+    Responde desde el catalogo de rutas y usa la API en vivo solo para llenar huecos:
+    - alcance con rutas en el catalogo: se responde desde la base; si su ultima
+      sincronizacion vencio se re-sincroniza en segundo plano.
+    - alcance sin rutas: consulta en vivo (que alimenta el catalogo), salvo que
+      se haya sincronizado hace poco y de verdad no tenga rutas.
+    """
+    clave = route_catalog.alcance(cliente_id, ciudad, route_code, via_code)
+
+    def _sincronizar(vista: str) -> list[Ruta]:
+        return _sincronizar_alcance(consulta_api, clave, cliente_id, ciudad, route_code, via_code, vista)
+
+    filas = route_catalog.consultar(cliente_id, ciudad, route_code, filtrar_ciudad=filtrar_ciudad)
+    if filas is None:
+        return consulta_api(cliente_id=cliente_id, ciudad=ciudad, route_code=route_code, via_code=via_code, view=view)
+    filas = [f for f in filas if _via_en_catalogo(f, via_code)]
+    sincronizado = route_catalog.ultima_sincronizacion(clave)
+    if not filas:
+        if route_catalog.vigente(sincronizado):
+            return []
+        return _sincronizar(view)
+    if not route_catalog.vigente(sincronizado):
+        route_catalog.sincronizar_en_segundo_plano(clave, lambda: _sincronizar("slim"))
+    return [_ruta_desde_catalogo(f, view) for f in filas]
 
 
 def _vehicle_codes_para_rutas(ciudad: Optional[str], cliente_id: Optional[str]) -> list[str]:
@@ -645,7 +1256,8 @@ def _travels_para_rutas(
     if not candidate_route_codes and not via_code and not ciudad and not cliente_id:
         try:
              # Traer mas paginas (10) para encontrar mas rutas unicas, a peticion del usuario
-             return get_travels(created_from=date_from, created_to=date_to, max_pages=10) or []
+             with en_segundo_plano():
+                 return get_travels(created_from=date_from, created_to=date_to, max_pages=10) or []
         except Exception:
              return []
 
@@ -660,7 +1272,8 @@ def _travels_para_rutas(
     # Lo usaremos solo para filtrar en memoria
     api_customer_id = cliente_id if is_valid_customer_guid else None
     
-    # Intento directo por routeCode (probando variantes)
+    # Intento directo por routeCode (probando variantes). Las variantes vacias
+    # quedan en la cache negativa de cloudfleet y la que responde se aprende
     for rc in candidate_route_codes:
         try:
             travels = get_travels(
@@ -672,6 +1285,9 @@ def _travels_para_rutas(
                 max_pages=TRAVELS_MAX_PAGES,
             ) or []
             if travels:
+                # Con route_code explicito hay un solo candidato: solo se aprenden variantes
+                if len(candidate_route_codes) > 1:
+                    _aprender_codigo_ruta(cliente_id, ciudad, rc)
                 break
         except Exception:
             travels = []
@@ -682,24 +1298,29 @@ def _travels_para_rutas(
         codes = _vehicle_codes_para_rutas(ciudad, cliente_id)
         if codes:
             route_filter = candidate_route_codes[0] if candidate_route_codes else None
-            for code in codes:
-                if TRAVELS_FALLBACK_MAX_SECONDS and (time.time() - start_time) > TRAVELS_FALLBACK_MAX_SECONDS:
-                    break
-                try:
-                    data = get_travels(
-                        customer_id=str(api_customer_id) if api_customer_id else None,
-                        vehicle_code=code,
-                        route_code=route_filter,
-                        via_code=via_code,
-                        created_from=date_from,
-                        created_to=date_to,
-                        max_pages=TRAVELS_MAX_PAGES,
-                    ) or []
-                    travels.extend(data)
-                except ValueError:
-                    continue
-                except Exception:
-                    continue
+            # Los sondeos por vehiculo y el fallback amplio usan solo cuota sobrante
+            # (clase background) para no demorar otras requests interactivas
+            with en_segundo_plano():
+                for code in codes:
+                    if TRAVELS_FALLBACK_MAX_SECONDS and (time.time() - start_time) > TRAVELS_FALLBACK_MAX_SECONDS:
+                        break
+                    if plazo_vencido():
+                        break
+                    try:
+                        data = get_travels(
+                            customer_id=str(api_customer_id) if api_customer_id else None,
+                            vehicle_code=code,
+                            route_code=route_filter,
+                            via_code=via_code,
+                            created_from=date_from,
+                            created_to=date_to,
+                            max_pages=TRAVELS_MAX_PAGES,
+                        ) or []
+                        travels.extend(data)
+                    except ValueError:
+                        continue
+                    except Exception:
+                        continue
 
     # 2. Broad Fallback: If still no travels (or few), and we have a Client ID, fetch GENERAL client travels
     # This matches "Postman" behavior: find any route used by the client recently, regardless of truck.
@@ -707,21 +1328,23 @@ def _travels_para_rutas(
         try:
             # Si es UUID valido, usamos filtro API
             if is_valid_customer_guid:
-                broad_data = get_travels(
-                    customer_id=str(cliente_id),
-                    created_from=date_from,
-                    created_to=date_to,
-                    max_pages=5
-                ) or []
+                with en_segundo_plano():
+                    broad_data = get_travels(
+                        customer_id=str(cliente_id),
+                        created_from=date_from,
+                        created_to=date_to,
+                        max_pages=5
+                    ) or []
                 travels.extend(broad_data)
             else:
                 # Si es ID corto (CostCenter), traemos recent history y filtramos en memoria
                 logger.info(f"Fallback CostCenter search for ID={cliente_id}...")
-                broad_data = get_travels(
-                    created_from=date_from,
-                    created_to=date_to,
-                    max_pages=10 # Aumentamos paginas para asegurar encontrar datos
-                ) or []
+                with en_segundo_plano():
+                    broad_data = get_travels(
+                        created_from=date_from,
+                        created_to=date_to,
+                        max_pages=10 # Aumentamos paginas para asegurar encontrar datos
+                    ) or []
                 
                 # Filtrar en memoria por customerId o costCenter
                 filtered_data = []
@@ -758,6 +1381,7 @@ def _rutas_desde_travels(
     vehicle_codes: Optional[list[str]] = None,
     via_code: Optional[str] = None,
     route_prefix: Optional[str] = None,
+    view: str = "slim",
 ) -> list[Ruta]:
     """
     Fallback para construir rutas a partir de los viajes (travels) cuando
@@ -773,21 +1397,18 @@ def _rutas_desde_travels(
         via_code=via_code,
         route_codes=route_codes,
     )
+    _registrar_travels_catalogo(travels or [], cliente_id)
 
-    rutas_map: dict[tuple[str, str, str], Ruta] = {}
+    rutas_map = AgregadorRutas()
     for t in travels or []:
-        codigo = (
-            t.get("routeCode")
-            or t.get("code")
-            or t.get("route", {}).get("code")
-            or "SIN-COD"
-        )
+        codigo = _codigo_ruta_travel(t)
         nombre = t.get("route", {}).get("name") or codigo
         origen_val = _parse_location(t.get("origin"))
         destino_val = _parse_location(t.get("destination"))
         travel_city_obj = t.get("city")
         travel_city = travel_city_obj.get("name") if isinstance(travel_city_obj, dict) else travel_city_obj
-        vias_codigos, vias_detalle, via_codigo = _vias_desde_item(t)
+        vias_codigos, vias_detalle, via_codigo = _vias_desde_item(t, "travel")
+        vias_detalle = _vias_detalle_vista(vias_detalle, view)
 
         # No filtramos por prefijo de ruta para no descartar coincidencias vÃ¡lidas
 
@@ -806,28 +1427,11 @@ def _rutas_desde_travels(
 
         # evitar duplicar rutas por numero de viaje
         key = (codigo, origen_val, destino_val)
-        existente = rutas_map.get(key)
-        if existente:
-            if via_codigo and via_codigo not in existente.vias:
-                existente.vias.append(via_codigo)
-            for vc in vias_codigos:
-                if vc and vc not in existente.vias:
-                    existente.vias.append(vc)
-            if via_codigo and not existente.via_codigo:
-                existente.via_codigo = via_codigo
-            for vd in vias_detalle:
-                code = vd.get("code")
-                name = vd.get("name")
-                dup = any(
-                    (code and code == d.get("code"))
-                    or (name and name == d.get("name"))
-                    for d in existente.vias_detalle
-                )
-                if not dup:
-                    existente.vias_detalle.append(vd)
+        if key in rutas_map:
+            rutas_map.fusionar(key, via_codigo, [via_codigo, *vias_codigos], vias_detalle)
             continue
 
-        rutas_map[key] = Ruta(
+        rutas_map.poner(key, Ruta(
             id=str(t.get("number") or "-".join(key)),
             cliente_id=str(cliente_id or t.get("customerId") or ""),
             sede_id=None,
@@ -840,9 +1444,9 @@ def _rutas_desde_travels(
             via_codigo=via_codigo,
             vias=[c for c in vias_codigos if c] or ([via_codigo] if via_codigo else []),
             vias_detalle=vias_detalle,
-            datos_adicionales=t,
-        )
-    return list(rutas_map.values())
+            datos_adicionales=_datos_vista(t, "ruta", view),
+        ))
+    return rutas_map.rutas()
 
 
 # ============= ENDPOINTS DE CLIENTES =============
@@ -860,13 +1464,18 @@ def health():
             "rutas": "/rutas",
             "vehiculos": "/vehiculos",
             "personal": "/personal",
-            "resumen": "/clientes/{cliente_id}/resumen"
+            "resumen": "/clientes/{cliente_id}/resumen",
+            "resumen_todos": "/api/resumen",
+            "contexto_despacho": "/api/dispatch-context",
+            "refresh_cache": "/api/cache/refresh/{job_id}",
+            "ready": "/api/ready",
+            "metricas_upstream": "/api/upstream/metrics",
+            "catalogo_rutas": "/api/rutas/catalogo"
         }
     }
 
 
-@app.get("/clientes", response_model=List[Cliente])
-def listar_clientes():
+def listar_clientes(view: str = "slim"):
     """
     Obtiene el listado completo de clientes desde CloudFleet API
     """
@@ -883,7 +1492,7 @@ def listar_clientes():
                 contacto=item.get("contact", item.get("contacto")),
                 telefono=item.get("phone", item.get("telefono")),
                 email=item.get("email"),
-                datos_adicionales=item
+                datos_adicionales=_datos_vista(item, "cliente", view)
             ))
 
         if clientes:
@@ -899,8 +1508,29 @@ def listar_clientes():
         if clientes_fallback:
             return clientes_fallback
         raise HTTPException(status_code=500, detail=f"Error al obtener clientes: {str(e)}")
+
+
+@app.get("/clientes", response_model=List[Cliente])
+def api_listar_clientes(
+    view: str = Query("slim", description="Vista: slim (por defecto) o full con el registro crudo de CloudFleet"),
+    fields: Optional[str] = Query(None, description="Campos a incluir separados por coma, ej: id,placa"),
+):
+    """
+    Obtiene el listado completo de clientes desde CloudFleet API
+    Serializa con el TypeAdapter precompilado (sin revalidar contra response_model).
+    """
+    return _responder_lista(
+        listar_clientes(view=view),
+        fields,
+        Cliente,
+    )
+
+
 @app.get("/clientes/{cliente_id}", response_model=ClienteCompleto)
-def obtener_cliente_completo(cliente_id: str):
+def obtener_cliente_completo(
+    cliente_id: str,
+    view: str = Query("slim", description="Vista: slim (por defecto) o full con el registro crudo de CloudFleet"),
+):
     """
     Obtiene un cliente especÃ­fico con todas sus sedes
     """
@@ -916,7 +1546,7 @@ def obtener_cliente_completo(cliente_id: str):
             contacto=cliente_data.get("contact", cliente_data.get("contacto")),
             telefono=cliente_data.get("phone", cliente_data.get("telefono")),
             email=cliente_data.get("email"),
-            datos_adicionales=cliente_data
+            datos_adicionales=_datos_vista(cliente_data, "cliente", view)
         )
         
         # Obtener sedes del cliente
@@ -930,7 +1560,7 @@ def obtener_cliente_completo(cliente_id: str):
                 ciudad=item.get("city", item.get("ciudad")),
                 direccion=item.get("address", item.get("direccion")),
                 telefono=item.get("phone", item.get("telefono")),
-                datos_adicionales=item
+                datos_adicionales=_datos_vista(item, "sede", view)
             ))
         
         return ClienteCompleto(
@@ -948,8 +1578,10 @@ def obtener_cliente_completo(cliente_id: str):
         logger.error(f"Error listar sedes: {e}")
         raise HTTPException(status_code=500, detail=f"Error al obtener sedes: {str(e)}")
 
-@app.get("/sedes", response_model=List[Sede])
-def listar_sedes(cliente_id: Optional[str] = Query(None, description="ID del cliente para filtrar")):
+def listar_sedes(
+    cliente_id: Optional[str] = None,
+    view: str = "slim",
+):
     """
     Obtiene el listado de sedes. Opcionalmente filtra por cliente_id
     Si CloudFleet no retorna sedes, genera sedes virtuales a partir de las ciudades de los vehículos.
@@ -969,7 +1601,7 @@ def listar_sedes(cliente_id: Optional[str] = Query(None, description="ID del cli
                 ciudad=item.get("city", item.get("ciudad")),
                 direccion=item.get("address", item.get("direccion")),
                 telefono=item.get("phone", item.get("telefono")),
-                datos_adicionales=item
+                datos_adicionales=_datos_vista(item, "sede", view)
             ))
 
         # 2. Si no hay sedes (y es lo comun en cuentas nuevas), extraer ciudades de los vehiculos
@@ -1035,25 +1667,8 @@ def listar_sedes(cliente_id: Optional[str] = Query(None, description="ID del cli
                 # Opcion B: Si no, intentar consulta rapida
                 if not c_name:
                     # Usar la misma logica del endpoint /clientes (API + Fallback Camiones)
-                    try:
-                        all_clients = listar_clientes() or []
-                        for c in all_clients:
-                            # 'c' es un objeto Cliente Pydantic
-                            c_id = getattr(c, "id", str(c))
-                            if str(c_id) == str(cliente_id):
-                                c_name = getattr(c, "nombre", getattr(c, "name", ""))
-                                break
-                    except Exception:
-                           pass
-
-                    # 2. Si falla aun (redundante si listar_clientes falla), intentar fetch directo
-                    if not c_name and get_cliente:
-                         try:
-                            cd = get_cliente(cliente_id)
-                            c_name = cd.get("name")
-                         except Exception:
-                            pass
-                
+                    c_name, _ = _resolver_cliente(str(cliente_id))
+
                 expected = get_expected_sedes(c_name)
                 
                 if expected:
@@ -1082,96 +1697,155 @@ def listar_sedes(cliente_id: Optional[str] = Query(None, description="ID del cli
         raise HTTPException(status_code=500, detail=f"Error al obtener sedes: {str(e)}")
 
 
+@app.get("/sedes", response_model=List[Sede])
+def api_listar_sedes(
+    cliente_id: Optional[str] = Query(None, description="ID del cliente para filtrar"),
+    view: str = Query("slim", description="Vista: slim (por defecto) o full con el registro crudo de CloudFleet"),
+    fields: Optional[str] = Query(None, description="Campos a incluir separados por coma, ej: id,placa"),
+):
+    """
+    Obtiene el listado de sedes. Opcionalmente filtra por cliente_id
+    Serializa con el TypeAdapter precompilado (sin revalidar contra response_model).
+    """
+    return _responder_lista(
+        listar_sedes(cliente_id=cliente_id, view=view),
+        fields,
+        Sede,
+    )
+
+
+# SedeCompleta ya serializada por (sede_id, vista). Se invalida cuando cambia la
+# version de los snapshots (refresh o archivo nuevo) y con la ventana de 300 s
+# de las caches TTL de get_sede/get_rutas, para no servir una sede mas vieja
+# que sus fuentes.
+SEDE_COMPLETA_TTL = 300
+_SEDE_COMPLETA_MAX = 256
+_SEDES_COMPLETAS: dict[tuple[str, str], tuple[tuple, bytes]] = {}
+_SEDES_COMPLETAS_LOCK = threading.Lock()
+_ADAPTADOR_SEDE_COMPLETA = TypeAdapter(SedeCompleta)
+
+
+def _version_sede_completa() -> tuple:
+    snapshots = ("vehicles_all", "people_all")
+    version = cache_version(*snapshots) if cache_version else tuple(snapshot_version(n) for n in snapshots)
+    return (version, int(time.time() // SEDE_COMPLETA_TTL))
+
+
+def _vehiculo_de_sede(item: dict[str, Any], sede_id: str, view: str) -> Vehiculo:
+    return Vehiculo(
+        id=str(item.get("id", "")),
+        sede_id=sede_id,
+        placa=item.get("code", item.get("placa", "SIN-PLACA")),
+        tipo=item.get("typeName", item.get("type", item.get("tipo"))),
+        capacidad=item.get("capacity", item.get("capacidad")),
+        ubicacion_ciudad=ciudad_de(item),
+        activo=item.get("active", item.get("activo", True)),
+        datos_adicionales=_datos_vista(item, "vehiculo", view)
+    )
+
+
+def _persona_de_sede(item: dict[str, Any], sede_id: str, view: str) -> Persona:
+    position_type = item.get("positionType")
+    rol = position_type.get("name") if isinstance(position_type, dict) else None
+    nombre = f"{item.get('firstName', '')} {item.get('lastName', '')}".strip()
+    return Persona(
+        id=str(item.get("id", item.get("personalId", ""))),
+        sede_id=sede_id,
+        nombre=nombre or item.get("name", item.get("nombre", "Sin nombre")),
+        rol=item.get("position") or rol or item.get("role", item.get("rol", "conductor")),
+        documento=item.get("personalId", item.get("document", item.get("documento"))),
+        telefono=item.get("mobilePhone", item.get("phone", item.get("telefono"))),
+        ubicacion_ciudad=ciudad_de(item),
+        activo=item.get("isActive", item.get("active", True)),
+        datos_adicionales=_datos_vista(item, "persona", view)
+    )
+
+
+def _rutas_de_sede(sede: Sede, sede_id: str, view: str) -> list[Ruta]:
+    rutas_data = get_rutas(sede.cliente_id) if sede.cliente_id else []
+    rutas = []
+    for item in rutas_data:
+        codigo = _codigo_ruta_item(item)
+        origen = _parse_location(item.get("origin", item.get("origen")))
+        destino = _parse_location(item.get("destination", item.get("destino")))
+        # Filtrar por ciudad de la sede si aplica
+        if sede.ciudad:
+            if not (_match_ciudad(sede.ciudad, origen) or _match_ciudad(sede.ciudad, destino)):
+                continue
+        rutas.append(Ruta(
+            id=str(item.get("id", "")),
+            cliente_id=sede.cliente_id,
+            sede_id=sede_id,
+            codigo=codigo,
+            nombre=item.get("name", item.get("nombre", codigo)),
+            origen=origen,
+            destino=destino,
+            distancia_km=item.get("distance", item.get("distancia_km")),
+            activa=item.get("active", item.get("activa", True)),
+            datos_adicionales=_datos_vista(item, "ruta", view)
+        ))
+    if not rutas and sede.ciudad:
+        rutas = _rutas_desde_travels(sede.cliente_id, sede.ciudad, route_code=None, view=_vista(view))
+    return rutas
+
+
 @app.get("/sedes/{sede_id}", response_model=SedeCompleta)
-def obtener_sede_completa(sede_id: str):
+def obtener_sede_completa(
+    sede_id: str,
+    view: str = Query("slim", description="Vista: slim (por defecto) o full con el registro crudo de CloudFleet"),
+):
     """
-    Obtiene una sede especÃ­fica con todos sus vehÃ­culos, personal y rutas
+    Obtiene una sede especÃ­fica con todos sus vehÃ­culos, personal y rutas.
+    La sede y los snapshots se piden en paralelo; las rutas arrancan apenas se
+    conoce el cliente de la sede. Vehiculos y personal se filtran con el indice
+    por ciudad del snapshot y el resultado queda cacheado por version.
     """
     if not get_sede or not get_camiones or not get_personas or not get_rutas:
         raise HTTPException(status_code=503, detail="CloudFleet API no configurada")
-    
+
+    clave = (str(sede_id), _vista(view))
+    version = _version_sede_completa()
+    entrada = _SEDES_COMPLETAS.get(clave)
+    if entrada and entrada[0] == version:
+        return Response(content=entrada[1], media_type="application/json")
+
     try:
-        # Obtener sede
-        sede_data = get_sede(sede_id)
-        sede = Sede(
-            id=str(sede_data.get("id", sede_id)),
-            cliente_id=str(sede_data.get("customerId", sede_data.get("cliente_id", ""))),
-            nombre=sede_data.get("name", sede_data.get("nombre", "Sin nombre")),
-            ciudad=sede_data.get("city", sede_data.get("ciudad")),
-            direccion=sede_data.get("address", sede_data.get("direccion")),
-            telefono=sede_data.get("phone", sede_data.get("telefono")),
-            datos_adicionales=sede_data
-        )
-        
-        # Obtener vehÃ­culos (filtramos por ciudad de la sede si aplica)
-        vehiculos_data = get_camiones()
-        ciudad_sede = sede.ciudad
-        vehiculos = []
-        for item in vehiculos_data:
-            # Filtrar por ubicaciÃ³n si coincide
-            ubicacion = item.get("location", item.get("ubicacion_ciudad", ""))
-            if ciudad_sede and ubicacion and ciudad_sede.lower() in ubicacion.lower():
-                vehiculos.append(Vehiculo(
-                    id=str(item.get("id", "")),
-                    sede_id=sede_id,
-                    placa=item.get("code", item.get("placa", "SIN-PLACA")),
-                    tipo=item.get("type", item.get("tipo")),
-                    capacidad=item.get("capacity", item.get("capacidad")),
-                    ubicacion_ciudad=ubicacion,
-                    activo=item.get("active", item.get("activo", True)),
-                    datos_adicionales=item
-                ))
-        
-        # Obtener personal (filtramos por ciudad de la sede si aplica)
-        personal_data = get_personas()
-        personal = []
-        for item in personal_data:
-            ubicacion = item.get("location", item.get("ubicacion_ciudad", ""))
-            if ciudad_sede and ubicacion and ciudad_sede.lower() in ubicacion.lower():
-                personal.append(Persona(
-                    id=str(item.get("id", item.get("personalId", ""))),
-                    sede_id=sede_id,
-                    nombre=item.get("name", item.get("nombre", "Sin nombre")),
-                    rol=item.get("role", item.get("rol", "conductor")),
-                    documento=item.get("document", item.get("documento")),
-                    telefono=item.get("phone", item.get("telefono")),
-                    ubicacion_ciudad=ubicacion,
-                    activo=item.get("active", item.get("activo", True)),
-                    datos_adicionales=item
-                ))
-        
-        # Obtener rutas del cliente de la sede
-        rutas_data = get_rutas(sede.cliente_id) if sede.cliente_id else []
-        rutas = []
-        for item in rutas_data:
-            codigo = (
-                item.get("code")
-                or item.get("routeCode")
-                or item.get("codigo")
-                or "SIN-COD"
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            # enviar() copia el contexto: los hilos respetan el plazo de la request
+            f_sede = enviar(pool, get_sede, sede_id)
+            f_vehiculos = enviar(pool, get_camiones)
+            f_personal = enviar(pool, get_personas)
+
+            sede_data = f_sede.result()
+            sede = Sede(
+                id=str(sede_data.get("id", sede_id)),
+                cliente_id=str(sede_data.get("customerId", sede_data.get("cliente_id", ""))),
+                nombre=sede_data.get("name", sede_data.get("nombre", "Sin nombre")),
+                ciudad=sede_data.get("city", sede_data.get("ciudad")),
+                direccion=sede_data.get("address", sede_data.get("direccion")),
+                telefono=sede_data.get("phone", sede_data.get("telefono")),
+                datos_adicionales=_datos_vista(sede_data, "sede", view)
             )
-            origen = _parse_location(item.get("origin", item.get("origen")))
-            destino = _parse_location(item.get("destination", item.get("destino")))
-            # Filtrar por ciudad de la sede si aplica
-            if sede.ciudad:
-                if not (_match_ciudad(sede.ciudad, origen) or _match_ciudad(sede.ciudad, destino)):
-                    continue
-            rutas.append(Ruta(
-                id=str(item.get("id", "")),
-                cliente_id=sede.cliente_id,
-                sede_id=sede_id,
-                codigo=codigo,
-                nombre=item.get("name", item.get("nombre", codigo)),
-                origen=origen,
-                destino=destino,
-                distancia_km=item.get("distance", item.get("distancia_km")),
-                activa=item.get("active", item.get("activa", True)),
-                datos_adicionales=item
-            ))
-        if not rutas and sede.ciudad:
-            rutas = _rutas_desde_travels(sede.cliente_id, sede.ciudad, route_code=None)
-
-        return SedeCompleta(
+            f_rutas = enviar(pool, _rutas_de_sede, sede, sede_id, view)
+
+            # Vehiculos y personal de la ciudad de la sede (sin ciudad no se filtra nada)
+            ciudad_norm = normalizar(sede.ciudad)
+            vehiculos: list[Vehiculo] = []
+            personal: list[Persona] = []
+            if ciudad_norm:
+                vehiculos_data = f_vehiculos.result() or []
+                vehiculos = [
+                    _vehiculo_de_sede(vehiculos_data[pos], sede_id, view)
+                    for pos in indice_ciudad(vehiculos_data).posiciones(ciudad_norm)
+                ]
+                personal_data = f_personal.result() or []
+                personal = [
+                    _persona_de_sede(personal_data[pos], sede_id, view)
+                    for pos in indice_ciudad(personal_data).posiciones(ciudad_norm)
+                ]
+            rutas = f_rutas.result()
+
+        resultado = SedeCompleta(
             sede=sede,
             vehiculos=vehiculos,
             personal=personal,
@@ -1183,23 +1857,48 @@ def obtener_sede_completa(sede_id: str):
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error al obtener sede completa: {str(e)}")
 
+    contenido = _ADAPTADOR_SEDE_COMPLETA.dump_json(resultado)
+    plazo = plazo_actual.get()
+    if not (plazo and plazo.parcial):
+        with _SEDES_COMPLETAS_LOCK:
+            if len(_SEDES_COMPLETAS) >= _SEDE_COMPLETA_MAX and clave not in _SEDES_COMPLETAS:
+                _SEDES_COMPLETAS.pop(next(iter(_SEDES_COMPLETAS)))
+            _SEDES_COMPLETAS[clave] = (version, contenido)
+    return Response(content=contenido, media_type="application/json")
+
 
 # ============= ENDPOINTS DE RUTAS =============
 
-@app.get("/rutas", response_model=List[Ruta])
 def listar_rutas(
-    cliente_id: Optional[str] = Query(None, description="ID del cliente para filtrar"),
-    ciudad: Optional[str] = Query(None, description="Ciudad para filtrar por origen/destino"),
-    route_code: Optional[str] = Query(None, description="Codigo de ruta para filtrar"),
-    via_code: Optional[str] = Query(None, description="Codigo de via para filtrar"),
+    cliente_id: Optional[str] = None,
+    ciudad: Optional[str] = None,
+    route_code: Optional[str] = None,
+    via_code: Optional[str] = None,
+    view: str = "slim",
 ):
     """
-    Obtiene rutas usando /routes y complementa con /travels.
-    Filtra opcionalmente por cliente, ciudad y route_code.
+    Rutas desde el catalogo persistente; la API (ver _listar_rutas_api) solo
+    llena huecos. Con route_code no se filtra por ciudad.
     """
-    try:
-        rutas: list[Ruta] = []
-        route_codes = _route_codes_candidates(cliente_id, ciudad, route_code)
+    return _rutas_con_catalogo(
+        _listar_rutas_api, cliente_id, ciudad, route_code, via_code, view, filtrar_ciudad=not route_code
+    )
+
+
+def _listar_rutas_api(
+    cliente_id: Optional[str] = None,
+    ciudad: Optional[str] = None,
+    route_code: Optional[str] = None,
+    via_code: Optional[str] = None,
+    view: str = "slim",
+):
+    """
+    Obtiene rutas usando /routes y complementa con /travels.
+    Filtra opcionalmente por cliente, ciudad y route_code. Alimenta el catalogo.
+    """
+    try:
+        rutas: list[Ruta] = []
+        route_codes = _route_codes_candidates(cliente_id, ciudad, route_code)
         primary_route_code = route_codes[0] if route_codes else None
 
         # Intentar /routes si est? disponible
@@ -1210,13 +1909,9 @@ def listar_rutas(
                 if not cliente_id and not route_code:
                      mp = 10
                 rutas_data = get_rutas(cliente_id, max_pages=mp) or []
+                _registrar_rutas_catalogo(rutas_data, cliente_id)
                 for item in rutas_data:
-                    codigo = (
-                        item.get("code")
-                        or item.get("routeCode")
-                        or item.get("codigo")
-                        or "SIN-COD"
-                    )
+                    codigo = _codigo_ruta_item(item)
                     if primary_route_code and primary_route_code.lower() not in codigo.lower():
                         continue
                     origen = _parse_location(item.get("origin", item.get("origen")))
@@ -1225,6 +1920,7 @@ def listar_rutas(
                     if ciudad and not route_code and not (_match_ciudad(ciudad, origen) or _match_ciudad(ciudad, destino)):
                         continue
                     vias_codigos, vias_detalle, via_codigo = _vias_desde_item(item)
+                    vias_detalle = _vias_detalle_vista(vias_detalle, view)
                     rutas.append(Ruta(
                         id=str(item.get("id", "")),
                         cliente_id=str(item.get("customerId", item.get("cliente_id", ""))),
@@ -1238,7 +1934,7 @@ def listar_rutas(
                         via_codigo=via_codigo,
                         vias=vias_codigos,
                         vias_detalle=vias_detalle,
-                        datos_adicionales=item
+                        datos_adicionales=_datos_vista(item, "ruta", view)
                     ))
             except Exception:
                 pass
@@ -1250,45 +1946,72 @@ def listar_rutas(
             route_code=primary_route_code,
             route_codes=route_codes,
             via_code=via_code,
+            view=_vista(view),
         )
-        rutas_map: dict[tuple[str, str, str], Ruta] = {(r.codigo, r.origen, r.destino): r for r in rutas}
+        rutas_map = AgregadorRutas()
+        for r in rutas:
+            rutas_map.poner((r.codigo, r.origen, r.destino), r)
         for r in rutas_travels:
-            key = (r.codigo, r.origen, r.destino)
-            existente = rutas_map.get(key)
-            if existente:
-                if r.via_codigo and not existente.via_codigo:
-                    existente.via_codigo = r.via_codigo
-                for vc in r.vias:
-                    if vc and vc not in existente.vias:
-                        existente.vias.append(vc)
-                for vd in r.vias_detalle:
-                    code = vd.get("code")
-                    name = vd.get("name")
-                    dup = any(
-                        (code and code == d.get("code"))
-                        or (name and name == d.get("name"))
-                        for d in existente.vias_detalle
-                    )
-                    if not dup:
-                        existente.vias_detalle.append(vd)
-                continue
-            rutas_map[key] = r
+            rutas_map.agregar((r.codigo, r.origen, r.destino), r)
 
-        return list(rutas_map.values())
+        return rutas_map.rutas()
     except Exception as e:
         logger.error("Error al obtener rutas: %s", e)
         # Evitar romper el front: devolver lista vacÃ­a
         return []
 
 
-# ============= ENDPOINTS DE RUTAS (MEJORADO) =============
-
-@app.get("/rutas_v2", response_model=List[Ruta])
-def listar_rutas_v2(
+@app.get("/rutas", response_model=List[Ruta])
+def api_listar_rutas(
     cliente_id: Optional[str] = Query(None, description="ID del cliente para filtrar"),
     ciudad: Optional[str] = Query(None, description="Ciudad para filtrar por origen/destino"),
     route_code: Optional[str] = Query(None, description="Codigo de ruta para filtrar"),
     via_code: Optional[str] = Query(None, description="Codigo de via para filtrar"),
+    view: str = Query("slim", description="Vista: slim (por defecto) o full con el registro crudo de CloudFleet"),
+    fields: Optional[str] = Query(None, description="Campos a incluir separados por coma, ej: id,placa"),
+    formato: str = Query("json", alias="format", pattern=FORMATO_LISTA_PATTERN, description="json (por defecto) o ndjson (una linea por item, en streaming)"),
+    limit: Optional[int] = Query(None, ge=1, le=LIMITE_PAGINA_MAX, description="Tamano de pagina; el siguiente cursor va en el header X-Next-Cursor"),
+    cursor: Optional[str] = Query(None, description="Cursor opaco devuelto en X-Next-Cursor"),
+):
+    """
+    Obtiene rutas usando /routes y complementa con /travels.
+    Serializa con el TypeAdapter precompilado (sin revalidar contra response_model).
+    Soporta format=ndjson y paginacion con limit/cursor.
+    """
+    if formato == "json" and not limit and not cursor:
+        return _responder_lista(
+            listar_rutas(cliente_id=cliente_id, ciudad=ciudad, route_code=route_code, via_code=via_code, view=view),
+            fields,
+            Ruta,
+        )
+    return _paginar_rutas(
+        _listar_rutas_api, cliente_id, ciudad, route_code, via_code, view, not route_code,
+        fields, formato, limit, cursor,
+    )
+
+
+# ============= ENDPOINTS DE RUTAS (MEJORADO) =============
+
+def listar_rutas_v2(
+    cliente_id: Optional[str] = None,
+    ciudad: Optional[str] = None,
+    route_code: Optional[str] = None,
+    via_code: Optional[str] = None,
+    view: str = "slim",
+):
+    """
+    Rutas v2 desde el catalogo persistente; la API (ver _listar_rutas_v2_api)
+    solo llena huecos.
+    """
+    return _rutas_con_catalogo(_listar_rutas_v2_api, cliente_id, ciudad, route_code, via_code, view)
+
+
+def _listar_rutas_v2_api(
+    cliente_id: Optional[str] = None,
+    ciudad: Optional[str] = None,
+    route_code: Optional[str] = None,
+    via_code: Optional[str] = None,
+    view: str = "slim",
 ):
     """
     VersiÃ³n mejorada de /rutas que no filtra por ciudad/cliente cuando se especifica route_code
@@ -1306,13 +2029,9 @@ def listar_rutas_v2(
                 if not cliente_id and not route_code:
                      mp = 10
                 rutas_data = get_rutas(cliente_id, max_pages=mp) or []
+                _registrar_rutas_catalogo(rutas_data, cliente_id)
                 for item in rutas_data:
-                    codigo = (
-                        item.get("code")
-                        or item.get("routeCode")
-                        or item.get("codigo")
-                        or "SIN-COD"
-                    )
+                    codigo = _codigo_ruta_item(item)
                     if primary_route_code and primary_route_code.upper() not in codigo.upper():
                         continue
                     origen = _parse_location(item.get("origin", item.get("origen")))
@@ -1320,6 +2039,7 @@ def listar_rutas_v2(
                     if ciudad and not (_match_ciudad(ciudad, origen) or _match_ciudad(ciudad, destino)):
                         continue
                     vias_codigos, vias_detalle, via_codigo = _vias_desde_item(item)
+                    vias_detalle = _vias_detalle_vista(vias_detalle, view)
                     if via_code and via_codigo and via_code.upper() != via_codigo.upper():
                         if not any(via_code.upper() == vc.upper() for vc in vias_codigos):
                             continue
@@ -1336,7 +2056,7 @@ def listar_rutas_v2(
                         via_codigo=via_codigo,
                         vias=vias_codigos,
                         vias_detalle=vias_detalle,
-                        datos_adicionales=item
+                        datos_adicionales=_datos_vista(item, "ruta", view)
                     ))
             except Exception as e:
                 logger.warning(f"Error obteniendo rutas desde /routes: {e}")
@@ -1347,33 +2067,15 @@ def listar_rutas_v2(
             route_code=primary_route_code,
             route_codes=route_codes,
             via_code=via_code,
+            view=_vista(view),
         )
-        rutas_map: dict[tuple[str, str, str], Ruta] = {}
+        rutas_map = AgregadorRutas()
         for r in rutas:
-            rutas_map[(r.codigo.upper(), r.origen, r.destino)] = r
+            rutas_map.poner((r.codigo.upper(), r.origen, r.destino), r)
         for r in rutas_travels:
-            key = (r.codigo.upper(), r.origen, r.destino)
-            existente = rutas_map.get(key)
-            if existente:
-                if r.via_codigo and not existente.via_codigo:
-                    existente.via_codigo = r.via_codigo
-                for vc in r.vias:
-                    if vc and vc not in existente.vias:
-                        existente.vias.append(vc)
-                for vd in r.vias_detalle:
-                    code = vd.get("code")
-                    name = vd.get("name")
-                    dup = any(
-                        (code and code == d.get("code"))
-                        or (name and name == d.get("name"))
-                        for d in existente.vias_detalle
-                    )
-                    if not dup:
-                        existente.vias_detalle.append(vd)
-            else:
-                rutas_map[key] = r
+            rutas_map.agregar((r.codigo.upper(), r.origen, r.destino), r)
 
-        resultado = list(rutas_map.values())
+        resultado = rutas_map.rutas()
         if route_code:
             logger.info(f"Búsqueda por route_code={route_code}: encontradas {len(resultado)} rutas")
             for r in resultado:
@@ -1383,8 +2085,40 @@ def listar_rutas_v2(
         logger.error(f"Error al obtener rutas (v2): {e}", exc_info=True)
         return []
 
+@app.get("/rutas_v2", response_model=List[Ruta])
+def api_listar_rutas_v2(
+    cliente_id: Optional[str] = Query(None, description="ID del cliente para filtrar"),
+    ciudad: Optional[str] = Query(None, description="Ciudad para filtrar por origen/destino"),
+    route_code: Optional[str] = Query(None, description="Codigo de ruta para filtrar"),
+    via_code: Optional[str] = Query(None, description="Codigo de via para filtrar"),
+    view: str = Query("slim", description="Vista: slim (por defecto) o full con el registro crudo de CloudFleet"),
+    fields: Optional[str] = Query(None, description="Campos a incluir separados por coma, ej: id,placa"),
+    formato: str = Query("json", alias="format", pattern=FORMATO_LISTA_PATTERN, description="json (por defecto) o ndjson (una linea por item, en streaming)"),
+    limit: Optional[int] = Query(None, ge=1, le=LIMITE_PAGINA_MAX, description="Tamano de pagina; el siguiente cursor va en el header X-Next-Cursor"),
+    cursor: Optional[str] = Query(None, description="Cursor opaco devuelto en X-Next-Cursor"),
+):
+    """
+    Version mejorada de /rutas (ver listar_rutas_v2).
+    Serializa con el TypeAdapter precompilado (sin revalidar contra response_model).
+    Soporta format=ndjson y paginacion con limit/cursor.
+    """
+    if formato == "json" and not limit and not cursor:
+        return _responder_lista(
+            listar_rutas_v2(cliente_id=cliente_id, ciudad=ciudad, route_code=route_code, via_code=via_code, view=view),
+            fields,
+            Ruta,
+        )
+    return _paginar_rutas(
+        _listar_rutas_v2_api, cliente_id, ciudad, route_code, via_code, view, True,
+        fields, formato, limit, cursor,
+    )
+
+
 @app.get("/rutas/{ruta_id}", response_model=Ruta)
-def obtener_ruta(ruta_id: str):
+def obtener_ruta(
+    ruta_id: str,
+    view: str = Query("slim", description="Vista: slim (por defecto) o full con el registro crudo de CloudFleet"),
+):
     """
     Obtiene una ruta especifica por ID
     """
@@ -1411,422 +2145,633 @@ def obtener_ruta(ruta_id: str):
             destino=destino,
             distancia_km=item.get("distance", item.get("distancia_km")),
             activa=item.get("active", item.get("activa", True)),
-            datos_adicionales=item
+            datos_adicionales=_datos_vista(item, "ruta", view)
         )
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error al obtener ruta: {str(e)}")
 # ============= ENDPOINTS DE VEHÃCULOS =============
 
-@app.get("/vehiculos", response_model=List[Vehiculo])
-def listar_vehiculos(
-    sede_id: Optional[str] = Query(None, description="ID de la sede para filtrar"),
-    ciudad: Optional[str] = Query(None, description="Ciudad para filtrar"),
-    centro_costo: Optional[str] = Query(None, description="Centro de costo para filtrar"),
-    cliente_id: Optional[str] = Query(None, description="ID del cliente para filtrar por sus sedes")
+# Ciudades equivalentes al filtrar vehiculos por ciudad
+CITY_ALIASES = {
+    "yumbo": ["cali"],
+    "cali": ["yumbo"],
+    "bogota": ["bogota d.c."]
+}
+
+
+def _iter_vehiculos(
+    sede_id: Optional[str] = None,
+    ciudad: Optional[str] = None,
+    centro_costo: Optional[str] = None,
+    cliente_id: Optional[str] = None,
+    view: str = "slim",
+    desde: int = 0,
 ):
-    if not get_camiones:
-        raise HTTPException(status_code=503, detail="CloudFleet API no configurada")
+    """
+    Genera (posicion_en_snapshot, Vehiculo) a medida que los registros pasan
+    los filtros, empezando en la posicion `desde` (cursor). Igual que
+    _iter_personal, con ciudad usa el indice por ciudad del snapshot y no
+    arma listas por request: el cursor vale en cualquier worker.
+    """
+    # Helper para detectar si es grupo Linde/Praxair
+    # Esto podria optimizarse con cache, pero por ahora lo hacemos lineal
+    # Necesitamos saber el NOMBRE del cliente actual para decidir
     
-    try:
-        # Helper para detectar si es grupo Linde/Praxair
-        # Esto podria optimizarse con cache, pero por ahora lo hacemos lineal
-        # Necesitamos saber el NOMBRE del cliente actual para decidir
+    target_ids: set[str] = set()
+    c_name = ""
+    if cliente_id:
+        # Buscar nombre ROBUSTAMENTE (Igual que en listar_sedes) e IDs del grupo Linde/Praxair
+        c_name, ids_grupo = _resolver_cliente(str(cliente_id))
+        target_ids.update(ids_grupo)
+
+    # Todas las listas de vehiculos salen del snapshot vehicles_all: se recorre
+    # por posicion (el cursor) en lugar de armar y deduplicar una lista por pagina
+    vehiculos_data = get_camiones() or []
+    solo_grupo = False
+    if target_ids:
+        # FALLBACK CRITICO: Muchos vehiculos no tienen customerId asignado en la API,
+        # pero tienen el nombre del cliente en el Centro de Costo (ej: CCM PRAXAIR).
+        # Si no traemos vehiculos generales, nunca los encontraremos.
+        # Lo hacemos si el grupo no tiene vehiculos propios O si es un cliente 'complejo' como Linde/Praxair.
+        solo_grupo = not ("LINDE" in c_name or "PRAXAIR" in c_name) and any(
+            str(v.get("customerId", "") or v.get("cliente_id", "") or "") in target_ids for v in vehiculos_data
+        )
+        if not solo_grupo:
+            logger.info(f"DEBUG: Global vehicles for CostCenter fallback (c_name={c_name}, ids={sorted(target_ids)})")
+
+    # Helper de normalizacion (acentos)
+    import unicodedata
+    def normalize_str(s):
+        if not s: return ""
+        return ''.join(c for c in unicodedata.normalize('NFD', str(s)) if unicodedata.category(c) != 'Mn').lower()
         
-        target_ids = set()
-        c_name = ""
-        if cliente_id:
-            target_ids.add(str(cliente_id))
-            
-            # Buscar nombre ROBUSTAMENTE (Igual que en listar_sedes)
-            try:
-                # 1. Usar listar_clientes (que tiene logica fallback y funciona)
-                all_c = listar_clientes() or []
-                for c in all_c:
-                    # c es Cliente (Pydantic)
-                    if str(c.id) == str(cliente_id):
-                        c_name = (c.nombre or "").upper()
-                        break
-                
-                # 2. Si falla, API directa
-                if not c_name and get_cliente:
-                    c_data = get_cliente(cliente_id)
-                    c_name = (c_data.get("name") or "").upper()
-                
-                if "LINDE" in c_name or "PRAXAIR" in c_name:
-                    # Es del grupo. Buscar el ID del otro.
-                    all_customers = listar_clientes() or []
-                    for c in all_customers:
-                        cn = (c.nombre or "").upper()
-                        cid = str(c.id)
-                        if cid == str(cliente_id): continue
-                        
-                        if "LINDE" in c_name:
-                            if "PRAXAIR" in cn: target_ids.add(cid)
-                        elif "PRAXAIR" in c_name:
-                            if "LINDE" in cn: target_ids.add(cid)
-            except Exception as e:
-                logger.warning(f"Error resolviendo counterpart Linde/Praxair: {e}")
+    # Pre-calc client cities if needed
+    ciudades_cliente = []
+    if c_name:
+         ciudades_cliente = [normalize_str(s) for s in get_expected_sedes(c_name)]
+
+    ciudad_norm = normalize_str(ciudad) if ciudad else ""
+    indice = indice_ciudad(vehiculos_data)
+    if ciudad_norm:
+        # Con ciudad se recorren solo las posiciones de la ciudad y sus alias
+        valid_cities = {ciudad_norm, *CITY_ALIASES.get(ciudad_norm, [])}
+        posiciones = sorted({p for c in valid_cities for p in indice.posiciones(c, desde)})
+    else:
+        posiciones = indice.posiciones("", desde)
+
+    for pos in posiciones:
+        # Deduplicar por ID
+        if pos in indice.repetidos:
+            continue
+        item = vehiculos_data[pos]
+        if solo_grupo and str(item.get("customerId", "") or item.get("cliente_id", "") or "") not in target_ids:
+            continue
+        # Obtener ciudad (puede ser objeto o string)
+        city_obj = item.get("city")
+        ubicacion = city_obj.get("name", "") if isinstance(city_obj, dict) else (city_obj or "")
+        ubicacion_norm = normalize_str(ubicacion)
+
+        # Obtener centro de costo
+        cost_center = item.get("costCenter")
+        centro_costo_nombre = cost_center.get("name", "") if isinstance(cost_center, dict) else ""
+        centro_costo_code = cost_center.get("code", "") if isinstance(cost_center, dict) else ""
         
-        # Fetch vehicles for ALL target IDs
-        raw_vehicles = []
-        if not target_ids:
-            # Sin filtro o fallo logica, traer normal (o todo si client_id es None)
-            raw_vehicles = get_camiones(customer_id=cliente_id, max_pages=10)
-        else:
-            # Traer para cada ID y mezclar
-            for tid in target_ids:
-                try:
-                    vf = get_camiones(customer_id=tid, max_pages=10) or []
-                    raw_vehicles.extend(vf)
-                except Exception:
-                    pass
+        # Filtrar por ciudad si se especifica
+        if ciudad:
+            valid_cities = {ciudad_norm}
+            # Add aliases
+            if ciudad_norm in CITY_ALIASES:
+                for alias in CITY_ALIASES[ciudad_norm]:
+                    valid_cities.add(alias)
             
-            # FALLBACK CRITICO: Muchos vehiculos no tienen customerId asignado en la API,
-            # pero tienen el nombre del cliente en el Centro de Costo (ej: CCM PRAXAIR).
-            # Si no traemos vehiculos generales, nunca los encontraremos.
-            # Lo hacemos si la lista esta vacia O si es un cliente 'complejo' como Linde/Praxair.
-            if len(raw_vehicles) == 0 or ("LINDE" in c_name or "PRAXAIR" in c_name):
-                 try:
-                     # Traer globales (paginados) para intentar matching por CostCenter
-                     # 5 paginas ~ 250 vehiculos, suficiente para flotas medianas
-                     logger.info(f"DEBUG: Fetching global vehicles for CostCenter fallback (c_name={c_name})")
-                     vf_global = get_camiones(customer_id=None, max_pages=5) or []
-                     raw_vehicles.extend(vf_global)
-                 except Exception as e:
-                     logger.warning(f"Error fetching global fallback: {e}")
-        
-        # Deduplicate by ID
-        vehiculos_data = []
-        seen_ids = set()
-        for v in raw_vehicles:
-            vid = v.get("id")
-            if vid and vid not in seen_ids:
-                seen_ids.add(vid)
-                vehiculos_data.append(v)
-        
-        
-        # Helper de normalizacion (acentos)
-        import unicodedata
-        def normalize_str(s):
-            if not s: return ""
-            return ''.join(c for c in unicodedata.normalize('NFD', str(s)) if unicodedata.category(c) != 'Mn').lower()
+            # Fuzzy Check
+            match_city = False
+            for target_city in valid_cities:
+                if target_city in ubicacion_norm:
+                    match_city = True
+                    break
             
-        # Pre-calc client cities if needed
-        ciudades_cliente = []
-        if c_name:
-             ciudades_cliente = [normalize_str(s) for s in get_expected_sedes(c_name)]
-        
-        if c_name:
-             ciudades_cliente = [normalize_str(s) for s in get_expected_sedes(c_name)]
+            if not ubicacion or not match_city:
+                continue
 
-        vehiculos: list[Vehiculo] = []
-        ciudad_norm = normalize_str(ciudad) if ciudad else ""
+        # Filtrar por cliente usando las ciudades de sus sedes
+        # OJO: Si hicimos merge, aqui debemos ser permisivos si el vehiculo viene del "otro" ID pero es valido.
         
-        for item in vehiculos_data:
-            # Obtener ciudad (puede ser objeto o string)
-            city_obj = item.get("city")
-            ubicacion = city_obj.get("name", "") if isinstance(city_obj, dict) else (city_obj or "")
-            ubicacion_norm = normalize_str(ubicacion)
-
-            # Obtener centro de costo
-            cost_center = item.get("costCenter")
-            centro_costo_nombre = cost_center.get("name", "") if isinstance(cost_center, dict) else ""
-            centro_costo_code = cost_center.get("code", "") if isinstance(cost_center, dict) else ""
+        if cliente_id:
+            match_cliente = False
             
-            # Filtrar por ciudad si se especifica
-            if ciudad:
-                CITY_ALIASES = {
-                    "yumbo": ["cali"],
-                    "cali": ["yumbo"],
-                    "bogota": ["bogota d.c."]
-                }
+            # Check ID ownership directly against user request OR merged targets
+            v_cust_id = str(item.get("customerId", item.get("cliente_id", "")) or "")
+            if v_cust_id and v_cust_id in target_ids:
+                match_cliente = True
+            
+            if ciudades_cliente and not match_cliente:
+                match_cliente = bool(ubicacion and ubicacion.lower() in ciudades_cliente)
+
+            # Fallback: usar centro de costo como proxy de cliente
+            # STRICT MATCHING: Evitar confusiones entre LINDE/PRAXAIR y CHILCO
+            if cost_center:
+                centro_id = str(cost_center.get("id") or cost_center.get("code") or "").strip()
+                centro_nombre = (cost_center.get("name") or "").lower()
+                cid = str(cliente_id).lower()
                 
-                valid_cities = {ciudad_norm}
-                # Add aliases
-                if ciudad_norm in CITY_ALIASES:
-                    for alias in CITY_ALIASES[ciudad_norm]:
-                        valid_cities.add(alias)
+                # Logica de exclusion mutua explicita
+                is_linde_req = "linde" in cid or (c_name and "LINDE" in c_name.upper()) or (c_name and "PRAXAIR" in c_name.upper())
+                is_chilco_req = "chilco" in cid or (c_name and "CHILCO" in c_name.upper())
                 
-                # Fuzzy Check
-                match_city = False
-                for target_city in valid_cities:
-                    if target_city in ubicacion_norm:
-                        match_city = True
-                        break
+                cc_is_linde = "linde" in centro_nombre or "praxair" in centro_nombre
+                cc_is_chilco = "chilco" in centro_nombre
                 
-                if not ubicacion or not match_city:
-                    continue
+                explicit_mismatch = False
+                if is_linde_req and cc_is_chilco:
+                    explicit_mismatch = True
+                elif is_chilco_req and cc_is_linde:
+                    explicit_mismatch = True
 
-            # Filtrar por cliente usando las ciudades de sus sedes
-            # OJO: Si hicimos merge, aqui debemos ser permisivos si el vehiculo viene del "otro" ID pero es valido.
-            
-            if cliente_id:
-                match_cliente = False
-                
-                # Check ID ownership directly against user request OR merged targets
-                v_cust_id = str(item.get("customerId", item.get("cliente_id", "")) or "")
-                if v_cust_id and v_cust_id in target_ids:
+                explicit_match = False
+                if centro_id and cid in centro_id.lower():
+                    explicit_match = True
+                elif centro_nombre and cid in centro_nombre:
+                    explicit_match = True
+                elif is_linde_req and cc_is_linde:
+                    explicit_match = True
+                elif is_chilco_req and cc_is_chilco:
+                    explicit_match = True
+
+                # Aplicar decisiones
+                if explicit_mismatch:
+                    match_cliente = False # Overrides City Match
+                elif explicit_match:
+                    match_cliente = True  # Overrides City Mismatch
+
+            # Si no hay forma de saber, no descartamos (salvo que sea un cliente explicito)
+            if not match_cliente and not (ciudades_cliente or item.get("customerId") or cost_center):
+                 # Si estamos filtrando por un cliente especifico y el vehiculo es huerfano,
+                 # mejor NO mostrarlo para evitar ruido
+                 if cliente_id:
+                    match_cliente = False
+                 else:
                     match_cliente = True
-                
-                if ciudades_cliente and not match_cliente:
-                    match_cliente = bool(ubicacion and ubicacion.lower() in ciudades_cliente)
-
-                # Fallback: usar centro de costo como proxy de cliente
-                # STRICT MATCHING: Evitar confusiones entre LINDE/PRAXAIR y CHILCO
-                if cost_center:
-                    centro_id = str(cost_center.get("id") or cost_center.get("code") or "").strip()
-                    centro_nombre = (cost_center.get("name") or "").lower()
-                    cid = str(cliente_id).lower()
-                    
-                    # Logica de exclusion mutua explicita
-                    is_linde_req = "linde" in cid or (c_name and "LINDE" in c_name.upper()) or (c_name and "PRAXAIR" in c_name.upper())
-                    is_chilco_req = "chilco" in cid or (c_name and "CHILCO" in c_name.upper())
-                    
-                    cc_is_linde = "linde" in centro_nombre or "praxair" in centro_nombre
-                    cc_is_chilco = "chilco" in centro_nombre
-                    
-                    explicit_mismatch = False
-                    if is_linde_req and cc_is_chilco:
-                        explicit_mismatch = True
-                    elif is_chilco_req and cc_is_linde:
-                        explicit_mismatch = True
-
-                    explicit_match = False
-                    if centro_id and cid in centro_id.lower():
-                        explicit_match = True
-                    elif centro_nombre and cid in centro_nombre:
-                        explicit_match = True
-                    elif is_linde_req and cc_is_linde:
-                        explicit_match = True
-                    elif is_chilco_req and cc_is_chilco:
-                        explicit_match = True
-
-                    # Aplicar decisiones
-                    if explicit_mismatch:
-                        match_cliente = False # Overrides City Match
-                    elif explicit_match:
-                        match_cliente = True  # Overrides City Mismatch
-
-                # Si no hay forma de saber, no descartamos (salvo que sea un cliente explicito)
-                if not match_cliente and not (ciudades_cliente or item.get("customerId") or cost_center):
-                     # Si estamos filtrando por un cliente especifico y el vehiculo es huerfano,
-                     # mejor NO mostrarlo para evitar ruido
-                     if cliente_id:
-                        match_cliente = False
-                     else:
-                        match_cliente = True
 
-                if not match_cliente:
-                    continue
-            
-            # Filtrar por centro de costo si se especifica
-            if centro_costo:
-                if not cost_center:
-                    continue
-                if (centro_costo.lower() not in centro_costo_nombre.lower() and 
-                    centro_costo.lower() not in centro_costo_code.lower()):
-                    continue
-            
-            # FILTRO GLOBAL: Excluir Vehiculos no deseados
-            # Normalizar para detectar "Remolque" vs "REMOLQUE" vs "Semirremolque"
-            import unicodedata
-            def norm_v(s): return ''.join(c for c in unicodedata.normalize('NFD', str(s)) if unicodedata.category(c) != 'Mn').lower()
-            
-            tipo_veh = norm_v(item.get("typeName") or "")
-            # Lista ampliada de exclusiones
-            excluir = [
-                "montacarga", "estacionario", "moto", "camioneta", 
-                "remolque", "semirremolque", "semi-remolque", "trailer", 
-                "caja", "plancha", "dolly", "furgon"
-            ]
-            if any(exc in tipo_veh for exc in excluir):
+            if not match_cliente:
+                continue
+        
+        # Filtrar por centro de costo si se especifica
+        if centro_costo:
+            if not cost_center:
+                continue
+            if (centro_costo.lower() not in centro_costo_nombre.lower() and 
+                centro_costo.lower() not in centro_costo_code.lower()):
                 continue
+        
+        # FILTRO GLOBAL: Excluir Vehiculos no deseados
+        # Normalizar para detectar "Remolque" vs "REMOLQUE" vs "Semirremolque"
+        import unicodedata
+        def norm_v(s): return ''.join(c for c in unicodedata.normalize('NFD', str(s)) if unicodedata.category(c) != 'Mn').lower()
+        
+        tipo_veh = norm_v(item.get("typeName") or "")
+        # Lista ampliada de exclusiones
+        excluir = [
+            "montacarga", "estacionario", "moto", "camioneta", 
+            "remolque", "semirremolque", "semi-remolque", "trailer", 
+            "caja", "plancha", "dolly", "furgon"
+        ]
+        if any(exc in tipo_veh for exc in excluir):
+            continue
 
-            vehiculos.append(Vehiculo(
-                id=str(item.get("id", "")),
-                sede_id=sede_id,
-                placa=item.get("code", "SIN-PLACA"),
-                tipo=item.get("typeName"),
-                capacidad=None,
-                ubicacion_ciudad=ubicacion,
-                activo=True,
-                datos_adicionales=item
-            ))
-        return vehiculos
+        yield pos, Vehiculo(
+            id=str(item.get("id", "")),
+            sede_id=sede_id,
+            placa=item.get("code", "SIN-PLACA"),
+            tipo=item.get("typeName"),
+            capacidad=None,
+            ubicacion_ciudad=ubicacion,
+            activo=True,
+            datos_adicionales=_datos_vista(item, "vehiculo", view)
+        )
+
+def listar_vehiculos(
+    sede_id: Optional[str] = None,
+    ciudad: Optional[str] = None,
+    centro_costo: Optional[str] = None,
+    cliente_id: Optional[str] = None,
+    view: str = "slim",
+) -> list[Vehiculo]:
+    if not get_camiones:
+        raise HTTPException(status_code=503, detail="CloudFleet API no configurada")
+    
+    try:
+        return [v for _, v in _iter_vehiculos(sede_id, ciudad, centro_costo, cliente_id, view)]
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error al obtener vehiculos: {str(e)}")
 
 
-# ============= ENDPOINTS DE PERSONAL =============
-
-@app.get("/personal", response_model=List[Persona])
-def listar_personal(
+@app.get("/vehiculos", response_model=List[Vehiculo])
+def api_listar_vehiculos(
     sede_id: Optional[str] = Query(None, description="ID de la sede para filtrar"),
     ciudad: Optional[str] = Query(None, description="Ciudad para filtrar"),
-    rol: Optional[str] = Query(None, description="Rol: conductor, auxiliar"),
-    cliente_id: Optional[str] = Query(None, description="ID del cliente para filtrar por sus sedes")
+    centro_costo: Optional[str] = Query(None, description="Centro de costo para filtrar"),
+    cliente_id: Optional[str] = Query(None, description="ID del cliente para filtrar por sus sedes"),
+    view: str = Query("slim", description="Vista: slim (por defecto) o full con el registro crudo de CloudFleet"),
+    fields: Optional[str] = Query(None, description="Campos a incluir separados por coma, ej: id,placa"),
+    formato: str = Query("json", alias="format", pattern=FORMATO_LISTA_PATTERN, description="json (por defecto) o ndjson (una linea por item, en streaming)"),
+    limit: Optional[int] = Query(None, ge=1, le=LIMITE_PAGINA_MAX, description="Tamano de pagina; el siguiente cursor va en el header X-Next-Cursor"),
+    cursor: Optional[str] = Query(None, description="Cursor opaco devuelto en X-Next-Cursor"),
 ):
-
-    if not get_personas:
+    """
+    Lista vehiculos filtrando por sede, ciudad, centro de costo y cliente.
+    Serializa con el TypeAdapter precompilado (sin revalidar contra response_model).
+    Soporta format=ndjson y paginacion con limit/cursor.
+    """
+    if formato == "json" and not limit and not cursor:
+        return _responder_lista(
+            listar_vehiculos(sede_id=sede_id, ciudad=ciudad, centro_costo=centro_costo, cliente_id=cliente_id, view=view),
+            fields,
+            Vehiculo,
+        )
+    if not get_camiones:
         raise HTTPException(status_code=503, detail="CloudFleet API no configurada")
-    
-    try:
-        # Aumentamos limite de paginas para traer mas personal (FIX: Missing drivers)
-        # 10 paginas eran ~500 registros, subimos a 100 (~5000 registros) para asegurar cobertura
-        max_pages = int(os.getenv("PERSONAL_MAX_PAGES_FILTER", "100"))
-        
-        # Obtener con el limite ampliado
-        try:
-             personal_data = get_personas(max_pages=max_pages)  # type: ignore[arg-type]
-        except TypeError:
-             personal_data = get_personas()
+    desde = _decodificar_cursor(cursor, snapshot_version("vehicles_all"))
+    return _responder_pagina(
+        _iter_vehiculos(sede_id, ciudad, centro_costo, cliente_id, view, desde=desde),
+        Vehiculo, fields, formato, limit, lambda: snapshot_version("vehicles_all"), "vehiculos",
+    )
 
-        ciudades_cliente = _ciudades_por_cliente(cliente_id)
-        personal = []
-        
-        # Helper de normalizacion (acentos)
-        import unicodedata
-        def normalize_str(s):
-            if not s: return ""
-            return ''.join(c for c in unicodedata.normalize('NFD', str(s)) if unicodedata.category(c) != 'Mn').lower()
 
-        ciudad_norm = normalize_str(ciudad) if ciudad else ""
+# ============= ENDPOINTS DE PERSONAL =============
 
-        for item in personal_data:
-            # Obtener ciudad (puede ser objeto o string)
-            city_obj = item.get("city")
-            ubicacion = city_obj.get("name", "") if isinstance(city_obj, dict) else (city_obj or "")
-            ubicacion_norm = normalize_str(ubicacion)
+def _iter_personal(
+    sede_id: Optional[str] = None,
+    ciudad: Optional[str] = None,
+    rol: Optional[str] = None,
+    cliente_id: Optional[str] = None,
+    view: str = "slim",
+    desde: int = 0,
+):
+    """
+    Genera (posicion_en_snapshot, Persona) a medida que los registros pasan los
+    filtros, empezando en la posicion `desde` (cursor). Con ciudad usa el indice
+    por ciudad del snapshot en lugar de recorrerlo completo.
+    """
+    # Aumentamos limite de paginas para traer mas personal (FIX: Missing drivers)
+    # 10 paginas eran ~500 registros, subimos a 100 (~5000 registros) para asegurar cobertura
+    max_pages = int(os.getenv("PERSONAL_MAX_PAGES_FILTER", "100"))
 
-            # Obtener posicion/rol
-            position_type = item.get("positionType", {})
-            rol_persona = position_type.get("name", "other") if isinstance(position_type, dict) else "other"
-            
-            # Construir nombre completo
-            first_name = item.get("firstName", "")
-            last_name = item.get("lastName", "")
-            nombre_completo = f"{first_name} {last_name}".strip() or "Sin nombre"
-            
-            # Filtrar por ciudad si se especifica (con normalizacion)
-            if ciudad:
-                if not ubicacion or ciudad_norm not in ubicacion_norm:
-                    continue
+    # Obtener con el limite ampliado
+    try:
+         personal_data = get_personas(max_pages=max_pages)  # type: ignore[arg-type]
+    except TypeError:
+         personal_data = get_personas()
 
-            # Filtrar por cliente usando las ciudades de sus sedes
-            if cliente_id:
-                match_cliente = False
-                if ciudades_cliente:
-                    match_cliente = bool(ubicacion and ubicacion.lower() in ciudades_cliente)
-                # No hay customerId en personas; si no hay pistas, evitamos descartar todo
-                if not match_cliente and not ciudades_cliente and not item.get("customerId"):
-                    match_cliente = True
-                if not match_cliente:
-                    continue
-            
-            # Filtrar por rol si se especifica
-            if rol and rol.lower() not in rol_persona.lower():
+    ciudades_cliente = _ciudades_por_cliente(cliente_id)
+    
+    # Helper de normalizacion (acentos)
+    import unicodedata
+    def normalize_str(s):
+        if not s: return ""
+        return ''.join(c for c in unicodedata.normalize('NFD', str(s)) if unicodedata.category(c) != 'Mn').lower()
+
+    ciudad_norm = normalize_str(ciudad) if ciudad else ""
+    indice = indice_ciudad(personal_data)
+
+    for pos in indice.posiciones(ciudad_norm, desde):
+        item = personal_data[pos]
+        # Obtener ciudad (puede ser objeto o string)
+        city_obj = item.get("city")
+        ubicacion = city_obj.get("name", "") if isinstance(city_obj, dict) else (city_obj or "")
+        ubicacion_norm = normalize_str(ubicacion)
+
+        # Obtener posicion/rol
+        position_type = item.get("positionType", {})
+        rol_persona = position_type.get("name", "other") if isinstance(position_type, dict) else "other"
+        
+        # Construir nombre completo
+        first_name = item.get("firstName", "")
+        last_name = item.get("lastName", "")
+        nombre_completo = f"{first_name} {last_name}".strip() or "Sin nombre"
+        
+        # Filtrar por ciudad si se especifica (con normalizacion)
+        if ciudad:
+            if not ubicacion or ciudad_norm not in ubicacion_norm:
                 continue
 
-            # Heuristic to exclude Companies (not people)
-            name_upper = nombre_completo.upper()
-            if (name_upper.startswith("(") or 
-                " S.A" in name_upper or 
-                " LTDA" in name_upper or 
-                " SAS" in name_upper or 
-                " EMPRESA" in name_upper or 
-                " COMPAÃ‘" in name_upper or 
-                " COMPAÑ" in name_upper):
+        # Filtrar por cliente usando las ciudades de sus sedes
+        if cliente_id:
+            match_cliente = False
+            if ciudades_cliente:
+                match_cliente = bool(ubicacion and ubicacion.lower() in ciudades_cliente)
+            # No hay customerId en personas; si no hay pistas, evitamos descartar todo
+            if not match_cliente and not ciudades_cliente and not item.get("customerId"):
+                match_cliente = True
+            if not match_cliente:
                 continue
-            
-            personal.append(Persona(
-                id=str(item.get("id", item.get("personalId", ""))),
-                sede_id=sede_id,
-                nombre=nombre_completo,
-                rol=item.get("position", rol_persona),
-                documento=item.get("personalId", ""),
-                telefono=item.get("mobilePhone", item.get("landlinePhone", "")),
-                ubicacion_ciudad=ubicacion,
-                activo=item.get("isActive", True),
-                datos_adicionales=item
-            ))
-        return personal
+        
+        # Filtrar por rol si se especifica
+        if rol and rol.lower() not in rol_persona.lower():
+            continue
+
+        # Heuristic to exclude Companies (not people)
+        name_upper = nombre_completo.upper()
+        if (name_upper.startswith("(") or 
+            " S.A" in name_upper or 
+            " LTDA" in name_upper or 
+            " SAS" in name_upper or 
+            " EMPRESA" in name_upper or 
+            " COMPAÃ‘" in name_upper or 
+            " COMPAÑ" in name_upper):
+            continue
+        
+        yield pos, Persona(
+            id=str(item.get("id", item.get("personalId", ""))),
+            sede_id=sede_id,
+            nombre=nombre_completo,
+            rol=item.get("position", rol_persona),
+            documento=item.get("personalId", ""),
+            telefono=item.get("mobilePhone", item.get("landlinePhone", "")),
+            ubicacion_ciudad=ubicacion,
+            activo=item.get("isActive", True),
+            datos_adicionales=_datos_vista(item, "persona", view)
+        )
+
+def listar_personal(
+    sede_id: Optional[str] = None,
+    ciudad: Optional[str] = None,
+    rol: Optional[str] = None,
+    cliente_id: Optional[str] = None,
+    view: str = "slim",
+) -> list[Persona]:
+
+    if not get_personas:
+        raise HTTPException(status_code=503, detail="CloudFleet API no configurada")
+    
+    try:
+        return [p for _, p in _iter_personal(sede_id, ciudad, rol, cliente_id, view)]
     except Exception as e:
         import traceback
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=f"Error al obtener personal: {str(e)}")
 
 
-# ============= ENDPOINT DE RESUMEN OPERACIONAL =============
+@app.get("/personal", response_model=List[Persona])
+def api_listar_personal(
+    sede_id: Optional[str] = Query(None, description="ID de la sede para filtrar"),
+    ciudad: Optional[str] = Query(None, description="Ciudad para filtrar"),
+    rol: Optional[str] = Query(None, description="Rol: conductor, auxiliar"),
+    cliente_id: Optional[str] = Query(None, description="ID del cliente para filtrar por sus sedes"),
+    view: str = Query("slim", description="Vista: slim (por defecto) o full con el registro crudo de CloudFleet"),
+    fields: Optional[str] = Query(None, description="Campos a incluir separados por coma, ej: id,placa"),
+    formato: str = Query("json", alias="format", pattern=FORMATO_LISTA_PATTERN, description="json (por defecto) o ndjson (una linea por item, en streaming)"),
+    limit: Optional[int] = Query(None, ge=1, le=LIMITE_PAGINA_MAX, description="Tamano de pagina; el siguiente cursor va en el header X-Next-Cursor"),
+    cursor: Optional[str] = Query(None, description="Cursor opaco devuelto en X-Next-Cursor"),
+):
+    """
+    Lista personal filtrando por sede, ciudad, rol y cliente.
+    Serializa con el TypeAdapter precompilado (sin revalidar contra response_model).
+    Soporta format=ndjson y paginacion con limit/cursor.
+    """
+    return _responder_personal(sede_id, ciudad, rol, cliente_id, view, fields, formato, limit, cursor)
 
-@app.get("/clientes/{cliente_id}/resumen", response_model=ResumenOperacional)
-def obtener_resumen_operacional(cliente_id: str):
 
-    if not get_cliente or not get_sedes or not get_rutas:
-        raise HTTPException(status_code=503, detail="CloudFleet API no configurada")
-    
-    try:
-        # Obtener cliente
-        cliente_data = get_cliente(cliente_id)
-        cliente_nombre = cliente_data.get("name", cliente_data.get("nombre", "Sin nombre"))
-        
-        # Obtener sedes
-        sedes_data = get_sedes(cliente_id)
-        total_sedes = len(sedes_data)
-        
-        # Obtener rutas
-        rutas_data = get_rutas(cliente_id)
-        total_rutas = len(rutas_data)
-        
-        # Obtener vehÃ­culos y personal de todas las sedes
-        vehiculos_data = get_camiones() if get_camiones else []
-        personal_data = get_personas() if get_personas else []
-        
-        # Contar vehÃ­culos activos
-        vehiculos_activos = sum(1 for v in vehiculos_data if v.get("active", v.get("activo", True)))
-        
-        # Separar y contar personal
-        conductores = [p for p in personal_data if p.get("role", p.get("rol")) == "conductor"]
-        auxiliares = [p for p in personal_data if p.get("role", p.get("rol")) == "auxiliar"]
-        personal_activo = sum(1 for p in personal_data if p.get("active", p.get("activo", True)))
-        
-        return ResumenOperacional(
-            cliente_id=cliente_id,
-            cliente_nombre=cliente_nombre,
-            total_sedes=total_sedes,
-            total_vehiculos=len(vehiculos_data),
-            total_conductores=len(conductores),
-            total_auxiliares=len(auxiliares),
-            total_rutas=total_rutas,
-            vehiculos_activos=vehiculos_activos,
-            personal_activo=personal_activo
+def _responder_personal(
+    sede_id: Optional[str] = None,
+    ciudad: Optional[str] = None,
+    rol: Optional[str] = None,
+    cliente_id: Optional[str] = None,
+    view: str = "slim",
+    fields: Any = None,
+    formato: str = "json",
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None,
+) -> Response:
+    """Respuesta de /personal con valores planos (sin Query), tambien para app/bench_personal."""
+    if formato == "json" and not limit and not cursor:
+        return _responder_lista(
+            listar_personal(sede_id=sede_id, ciudad=ciudad, rol=rol, cliente_id=cliente_id, view=view),
+            fields,
+            Persona,
         )
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error al obtener resumen: {str(e)}")
+    if not get_personas:
+        raise HTTPException(status_code=503, detail="CloudFleet API no configurada")
+    desde = _decodificar_cursor(cursor, snapshot_version("people_all"))
+    return _responder_pagina(
+        _iter_personal(sede_id, ciudad, rol, cliente_id, view, desde=desde),
+        Persona, fields, formato, limit, lambda: snapshot_version("people_all"), "personal",
+    )
 
 
-# ============= ENDPOINTS DE PROGRAMACIÃ“N (LEGACY) =============
+# ============= ENDPOINT DE RESUMEN OPERACIONAL =============
 
+# Resumen por cliente ya calculado. Se arma sumando los agregados por ciudad /
+# centro de costo de los snapshots (snapshots.Agregados) y el directorio de
+# clientes (nombre, grupo, sedes y rutas por ciudad), y vence con la version de
+# los snapshots o la ventana de 300 s de get_sedes/get_rutas.
+RESUMEN_TTL = 300
+_RESUMENES: dict[str, tuple[tuple, ResumenOperacional]] = {}
 
 
+def _version_resumen() -> tuple:
+    snapshots = ("vehicles_all", "people_all")
+    version = cache_version(*snapshots) if cache_version else tuple(snapshot_version(n) for n in snapshots)
+    return (version, int(time.time() // RESUMEN_TTL))
 
-def _asignaciones_desde_cloudfleet(req: ScheduleRequest) -> List[Asignacion]:
 
-    if not get_camiones or not get_personas:
-        raise RuntimeError("Cliente Cloudfleet no configurado")
+class _FichaCliente:
+    """Lo que el resumen necesita de un cliente, ya normalizado por ciudad."""
 
-    fecha = _parse_fecha(req.fecha)
-    
-    # Si tenemos placa y documento objetivo, intentamos asignar directo esos recursos
-    if TARGET_PLACA and TARGET_CONDUCTOR_DOC:
-        camiones = get_camiones(TARGET_PLACA)
-        personas = get_personas()
+    __slots__ = ("nombre", "centros", "ciudades", "sedes", "rutas")
 
-        camion = camiones[0] if isinstance(camiones, list) and camiones else None
-        conductor = next(
-            (
-                p
-                for p in personas
-                if str(p.get("personalId") or p.get("documento") or "").strip()
+    def __init__(self, nombre: str, centros: set[str], ciudades: set[str],
+                 sedes: dict[str, int], rutas: dict[str, int]):
+        self.nombre = nombre
+        self.centros = centros
+        self.ciudades = ciudades
+        self.sedes = sedes
+        self.rutas = rutas
+
+
+_DIRECTORIO: Optional[tuple[tuple, dict[str, _FichaCliente]]] = None
+_DIRECTORIO_LOCK = threading.Lock()
+
+
+def _contar_por_cliente(items: list[dict], campo_ciudad: tuple[str, str]) -> dict[str, dict[str, int]]:
+    """cliente -> ciudad normalizada -> registros, para sedes o rutas de CloudFleet."""
+    conteo: dict[str, dict[str, int]] = {}
+    for item in items:
+        cid = str(item.get("customerId", item.get("cliente_id", "")) or "")
+        ciudad = normalizar(_parse_location(item.get(campo_ciudad[0], item.get(campo_ciudad[1]))))
+        por_ciudad = conteo.setdefault(cid, {})
+        por_ciudad[ciudad] = por_ciudad.get(ciudad, 0) + 1
+    return conteo
+
+
+def _armar_directorio() -> dict[str, _FichaCliente]:
+    """
+    Una consulta a /clientes, una a /locations y el conteo agrupado del
+    catalogo de rutas (o una sola a /routes si el catalogo no tiene rutas),
+    repartidas por cliente.
+    """
+    clientes = listar_clientes(view="slim") or []
+    try:
+        sedes = _contar_por_cliente((get_sedes(None) if get_sedes else None) or [], ("city", "ciudad"))
+    except Exception as e:
+        logger.warning("Resumen sin sedes: %s", e)
+        sedes = {}
+    rutas = route_catalog.conteo_por_cliente()
+    if not rutas and get_rutas:
+        try:
+            rutas = _contar_por_cliente(get_rutas() or [], ("origin", "origen"))
+        except Exception as e:
+            logger.warning("Resumen sin rutas: %s", e)
+    rutas = rutas or {}
+
+    nombres = {str(c.id): (c.nombre or "").upper() for c in clientes}
+    directorio: dict[str, _FichaCliente] = {}
+    for c in clientes:
+        cid = str(c.id)
+        c_name = nombres[cid]
+        # Vehiculos: por centro de costo (el del cliente y los de su grupo LINDE/PRAXAIR)
+        centros = {normalizar(nombres.get(i) or "") for i in _grupo_cliente(cid, c_name, clientes)} - {""}
+        sedes_cliente = sedes.get(cid, {})
+        # Personal: las ciudades de sus sedes y las de la matriz de cupos
+        ciudades = set(sedes_cliente) | {normalizar(s) for s in get_expected_sedes(c_name)}
+        directorio[cid] = _FichaCliente(
+            c.nombre or "Sin nombre", centros, ciudades - {""}, sedes_cliente, rutas.get(cid, {}),
+        )
+    return directorio
+
+
+def _directorio_clientes() -> dict[str, _FichaCliente]:
+    """Directorio de la version actual del resumen, armado una vez por version."""
+    global _DIRECTORIO
+    version = _version_resumen()
+    entrada = _DIRECTORIO
+    if entrada and entrada[0] == version:
+        return entrada[1]
+    with _DIRECTORIO_LOCK:
+        entrada = _DIRECTORIO
+        if entrada and entrada[0] == version:
+            return entrada[1]
+        directorio = _armar_directorio()
+        plazo = plazo_actual.get()
+        if not (plazo and plazo.parcial):
+            _DIRECTORIO = (version, directorio)
+        return directorio
+
+
+def _calcular_resumen(cliente_id: str, ficha: Optional[_FichaCliente]) -> ResumenOperacional:
+    ag = agregados(get_camiones() or [], get_personas() or [])
+    ficha = ficha or _FichaCliente("Sin nombre", set(), set(), {}, {})
+
+    por_ciudad: dict[str, dict[str, Any]] = {}
+
+    def _ciudad(nombre: str) -> dict[str, Any]:
+        return por_ciudad.setdefault(nombre, {
+            "vehiculos": 0, "vehiculos_activos": 0, "personal": 0, "personal_activo": 0,
+            "conductores": 0, "auxiliares": 0, "sedes": 0, "rutas": 0,
+        })
+
+    for ciudad, c in ag.vehiculos_de(ficha.centros).items():
+        _ciudad(ciudad)["vehiculos"] += c["vehiculos"]
+        _ciudad(ciudad)["vehiculos_activos"] += c["vehiculos_activos"]
+
+    # Personal: no trae cliente, se asigna por las ciudades de las sedes del cliente
+    for ciudad in ficha.ciudades:
+        c = ag.personal_de(ciudad)
+        if c:
+            destino = _ciudad(ciudad)
+            for campo in ("personal", "personal_activo", "conductores", "auxiliares"):
+                destino[campo] += c[campo]
+
+    for ciudad, n in ficha.sedes.items():
+        _ciudad(ciudad)["sedes"] += n
+    for ciudad, n in ficha.rutas.items():
+        _ciudad(ciudad)["rutas"] += n
+
+    def _total(campo: str) -> int:
+        return sum(c[campo] for c in por_ciudad.values())
+
+    return ResumenOperacional(
+        cliente_id=str(cliente_id),
+        cliente_nombre=ficha.nombre,
+        total_sedes=_total("sedes"),
+        total_vehiculos=_total("vehiculos"),
+        total_conductores=_total("conductores"),
+        total_auxiliares=_total("auxiliares"),
+        total_rutas=_total("rutas"),
+        vehiculos_activos=_total("vehiculos_activos"),
+        personal_activo=_total("personal_activo"),
+        por_ciudad=por_ciudad,
+    )
+
+
+def _resumen_cliente(cliente_id: str) -> ResumenOperacional:
+    """Resumen del cliente desde la cache; se recalcula solo si cambio la version."""
+    version = _version_resumen()
+    entrada = _RESUMENES.get(str(cliente_id))
+    if entrada and entrada[0] == version:
+        return entrada[1]
+    resumen = _calcular_resumen(str(cliente_id), _directorio_clientes().get(str(cliente_id)))
+    plazo = plazo_actual.get()
+    if not (plazo and plazo.parcial):
+        _RESUMENES[str(cliente_id)] = (version, resumen)
+    return resumen
+
+
+def _resumenes_todos() -> list[ResumenOperacional]:
+    return [_resumen_cliente(cid) for cid in _directorio_clientes()]
+
+
+@app.get("/clientes/{cliente_id}/resumen", response_model=ResumenOperacional)
+def obtener_resumen_operacional(cliente_id: str):
+    """
+    Resumen operacional del cliente: vehiculos por centro de costo, personal
+    (por positionType / cargo) de las ciudades de sus sedes, sedes y rutas,
+    con el desglose por ciudad. Sale de agregados precalculados.
+    """
+    if not get_camiones or not get_personas:
+        raise HTTPException(status_code=503, detail="CloudFleet API no configurada")
+
+    try:
+        return _resumen_cliente(cliente_id)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error al obtener resumen: {str(e)}")
+
+
+@app.get("/api/resumen", response_model=List[ResumenOperacional])
+def obtener_resumen_todos():
+    """Resumen operacional de todos los clientes (ver /clientes/{cliente_id}/resumen)."""
+    if not get_camiones or not get_personas:
+        raise HTTPException(status_code=503, detail="CloudFleet API no configurada")
+
+    try:
+        return ORJSONResponse(content=_resumenes_todos())
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error al obtener resumen: {str(e)}")
+
+
+# ============= ENDPOINTS DE PROGRAMACIÃ“N (LEGACY) =============
+
+
+
+
+def _asignaciones_desde_cloudfleet(req: ScheduleRequest) -> List[Asignacion]:
+
+    if not get_camiones or not get_personas:
+        raise RuntimeError("Cliente Cloudfleet no configurado")
+
+    fecha = _parse_fecha(req.fecha)
+    
+    # Si tenemos placa y documento objetivo, intentamos asignar directo esos recursos
+    if TARGET_PLACA and TARGET_CONDUCTOR_DOC:
+        camiones = get_camiones(TARGET_PLACA)
+        personas = get_personas()
+
+        camion = camiones[0] if isinstance(camiones, list) and camiones else None
+        conductor = next(
+            (
+                p
+                for p in personas
+                if str(p.get("personalId") or p.get("documento") or "").strip()
                 == str(TARGET_CONDUCTOR_DOC).strip()
             ),
             None,
@@ -1851,8 +2796,8 @@ def _asignaciones_desde_cloudfleet(req: ScheduleRequest) -> List[Asignacion]:
     conductores = [p for p in personas if p.get("rol") == "conductor"]
     auxiliares = [p for p in personas if p.get("rol") == "auxiliar"]
 
-    conductores = _filtrar_consecutivos(conductores)
-    auxiliares = _filtrar_consecutivos(auxiliares)
+    conductores = _filtrar_consecutivos(_con_carga(conductores, fecha))
+    auxiliares = _filtrar_consecutivos(_con_carga(auxiliares, fecha))
     conductores = _rotar_personas(conductores)
     auxiliares = _rotar_personas(auxiliares)
 
@@ -1894,20 +2839,118 @@ def schedule(req: ScheduleRequest):
         return _asignaciones_dummy()
 
 
-@app.post("/api/cache/refresh")
-def api_refresh_cache(db: Session = Depends(get_db)):
+@app.post("/api/cache/refresh", status_code=202)
+def api_refresh_cache():
     """
     Endpoint administrativo para forzar recarga de cache CloudFleet.
+    Lanza el refresh en segundo plano y retorna el job para consultar su avance
+    en GET /api/cache/refresh/{job_id}. Si ya hay uno corriendo (en cualquier
+    worker) retorna ese mismo job.
     """
+    if not refresh_jobs:
+        raise HTTPException(status_code=503, detail="Funcion no disponible")
     try:
-        if refresh_all_cache:
-            refresh_all_cache()
-            return {"message": "Cache refrescado exitosamente"}
-        else:
-            raise HTTPException(status_code=503, detail="Funcion no disponible")
+        estado, creado = refresh_jobs.iniciar_refresh()
     except Exception as e:
-        logger.error(f"Error refrescando cache: {e}")
+        logger.error(f"Error iniciando refresh de cache: {e}")
         raise HTTPException(status_code=500, detail=str(e))
+    mensaje = "Refresh de cache iniciado" if creado else "Ya hay un refresh de cache en curso"
+    return {"message": mensaje, "creado": creado, **estado}
+
+
+@app.get("/api/upstream/metrics")
+def api_metricas_upstream():
+    """
+    Uso de la cuota de CloudFleet por clase (interactive / background):
+    requests, cola actual y tiempos de espera por el limitador, mas el estado
+    de la cache negativa.
+    """
+    metricas = planificador.metricas()
+    if estado_cache_negativa:
+        metricas["cache_negativa"] = estado_cache_negativa()
+    return metricas
+
+
+@app.get("/api/rutas/catalogo")
+def api_estado_catalogo_rutas():
+    """
+    Tamano del catalogo persistente de rutas y alcances sincronizados, mas la
+    memoria de vias extraidas por viaje / ruta.
+    """
+    return {**route_catalog.estadisticas(), "vias_memo": estado_memo()}
+
+
+@app.get("/api/ready")
+def api_ready():
+    """
+    Readiness: 200 cuando los snapshots de vehiculos y personal estan cargados
+    en memoria, 503 mientras tanto. Incluye el estado de las tareas de warmup.
+    """
+    if not warmup:
+        raise HTTPException(status_code=503, detail="Funcion no disponible")
+    estado = warmup.estado()
+    return JSONResponse(content=estado, status_code=200 if estado["listo"] else 503)
+
+
+@app.get("/api/cache/refresh/{job_id}")
+def api_estado_refresh_cache(job_id: str):
+    """
+    Progreso de un refresh de cache: paginas, registros, ETA y errores.
+    """
+    if not refresh_jobs:
+        raise HTTPException(status_code=503, detail="Funcion no disponible")
+    estado = refresh_jobs.obtener_estado(job_id)
+    if not estado:
+        raise HTTPException(status_code=404, detail="Job de refresh no encontrado")
+    return estado
+
+
+# ============= EVENTOS EN VIVO (SSE) =============
+
+@app.get("/api/events")
+async def api_eventos(
+    request: Request,
+    tipos: Optional[str] = Query(None, description="snapshot,borrador,viajes (por defecto todos)"),
+    cliente_id: Optional[str] = None,
+):
+    """
+    Canal SSE de cambios para los tableros (app/eventos.py): snapshot
+    refrescado, borrador guardado y viajes persistidos o confirmados. Cada
+    evento trae un id; al reconectar, el navegador manda Last-Event-ID y se
+    reenvia lo que se perdio (o "resync" si ya salio del historial).
+    """
+    pedidos = [t.strip() for t in tipos.split(",") if t.strip()] if tipos else None
+    if pedidos and any(t not in eventos.TIPOS for t in pedidos):
+        raise HTTPException(status_code=400, detail=f"Tipos validos: {', '.join(eventos.TIPOS)}")
+    ultimo = request.headers.get("last-event-id") or request.query_params.get("last_event_id")
+    suscripcion = eventos.publicador.suscribir(
+        pedidos, cliente_id, int(ultimo) if ultimo and ultimo.isdigit() else None,
+    )
+
+    async def _flujo():
+        try:
+            yield b"retry: 3000\n\n"
+            while True:
+                try:
+                    yield await asyncio.wait_for(suscripcion.cola.get(), timeout=eventos.EVENTOS_PING_SEG)
+                except asyncio.TimeoutError:
+                    # Mantiene viva la conexion a traves de proxies
+                    yield eventos.PING
+        finally:
+            # StreamingResponse cancela el generador cuando el cliente se desconecta
+            eventos.publicador.cancelar(suscripcion)
+
+    return StreamingResponse(
+        _flujo(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.get("/api/events/estado")
+def api_estado_eventos():
+    """Tableros conectados a /api/events en este proceso y eventos publicados."""
+    return eventos.publicador.estado()
 
 # ============= SERVIR INTERFAZ WEB =============
 
@@ -1935,6 +2978,109 @@ def obtener_cupo(cliente: str, sede: str, fecha: str):
         return {"quota": 0}
 
 
+# ============= CONTEXTO DE DESPACHO (UNA SOLA PETICION) =============
+
+def _agrupar_personal_por_rol(personal: list[Persona]) -> dict[str, list[Persona]]:
+    """
+    Separa el personal en conductores, auxiliares y otros usando el mismo
+    criterio del scheduler (texto del cargo).
+    """
+    grupos: dict[str, list[Persona]] = {"conductores": [], "auxiliares": [], "otros": []}
+    for p in personal:
+        rol_txt = (p.rol or "").lower()
+        if "conductor" in rol_txt:
+            grupos["conductores"].append(p)
+        elif "auxiliar" in rol_txt:
+            grupos["auxiliares"].append(p)
+        else:
+            grupos["otros"].append(p)
+    return grupos
+
+
+@app.get("/api/dispatch-context")
+def obtener_contexto_despacho(
+    cliente_id: Optional[str] = Query(None, description="ID del cliente"),
+    ciudad: Optional[str] = Query(None, description="Ciudad de la sede a despachar"),
+    fecha: Optional[str] = Query(None, description="Fecha YYYY-MM-DD para calcular el cupo"),
+    route_code: Optional[str] = Query(None, description="Codigo de ruta para filtrar"),
+    via_code: Optional[str] = Query(None, description="Codigo de via para filtrar"),
+    view: str = Query("slim", description="Vista: slim (por defecto) o full con el registro crudo de CloudFleet"),
+):
+    """
+    Retorna en una sola respuesta vehiculos, personal agrupado por rol, rutas con vias
+    y el cupo sugerido. Reemplaza las llamadas paralelas del dashboard a
+    /vehiculos, /personal y /rutas_v2 (y sus reintentos por ciudad).
+    """
+    if not get_camiones or not get_personas:
+        raise HTTPException(status_code=503, detail="CloudFleet API no configurada")
+
+    try:
+        # Resolver el cliente una sola vez; los hilos reutilizan la resolucion cacheada
+        c_name = ""
+        if cliente_id:
+            c_name, _ = _resolver_cliente(str(cliente_id))
+
+        with ThreadPoolExecutor(max_workers=3) as pool:
+            # enviar() copia el contexto: los hilos respetan el plazo de la request
+            f_vehiculos = enviar(
+                pool, listar_vehiculos, sede_id=None, ciudad=ciudad, centro_costo=None, cliente_id=cliente_id,
+                view=view,
+            )
+            f_personal = enviar(
+                pool, listar_personal, sede_id=None, ciudad=ciudad, rol=None, cliente_id=cliente_id,
+                view=view,
+            )
+            f_rutas = enviar(
+                pool, listar_rutas_v2, cliente_id=cliente_id, ciudad=ciudad, route_code=route_code, via_code=via_code,
+                view=view,
+            )
+            vehiculos = f_vehiculos.result()
+            personal = f_personal.result()
+            rutas = f_rutas.result()
+
+        # Complementar solo por ciudad cuando el filtro por cliente deja muy pocos recursos
+        if cliente_id and ciudad:
+            if len(vehiculos) < 2:
+                vistos = {v.id for v in vehiculos}
+                for v in listar_vehiculos(
+                    sede_id=None, ciudad=ciudad, centro_costo=None, cliente_id=None, view=view
+                ):
+                    if v.id not in vistos:
+                        vehiculos.append(v)
+            if not personal:
+                personal = listar_personal(
+                    sede_id=None, ciudad=ciudad, rol=None, cliente_id=None, view=view
+                )
+
+        quota = None
+        if c_name and ciudad and fecha:
+            quota = get_quota_for_date(c_name, ciudad, fecha)
+
+        grupos = _agrupar_personal_por_rol(personal)
+        return ORJSONResponse(content={
+            "cliente_id": cliente_id,
+            "cliente_nombre": c_name or None,
+            "ciudad": ciudad,
+            "fecha": fecha,
+            "quota": quota,
+            "vehiculos": vehiculos,
+            "personal": grupos,
+            "rutas": rutas,
+            "totales": {
+                "vehiculos": len(vehiculos),
+                "conductores": len(grupos["conductores"]),
+                "auxiliares": len(grupos["auxiliares"]),
+                "otros": len(grupos["otros"]),
+                "rutas": len(rutas),
+            },
+        })
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error contexto de despacho: {e}")
+        raise HTTPException(status_code=500, detail=f"Error al obtener contexto de despacho: {str(e)}")
+
+
 
 # ============= SCHEDULER (DESPACHO AUTOMATICO) =============
 
@@ -1944,89 +3090,349 @@ class AutoScheduleRequest(BaseModel):
     quota: int  # Numero de viajes a programar (ej: 5)
     cliente_id: Optional[str] = None # Opcional, si se sabe
     ciudad: Optional[str] = None # Filtro de ciudad para mayor precision
+    motor: str = "flujo"  # Motor de asignacion (ver app/assignment.py): flujo, hungarian, greedy
+    permisos_requeridos: List[str] = Field(default_factory=list)  # Permisos exigidos a conductores/auxiliares
+
+
+def _ruta_de_catalogo(fila: dict[str, Any]) -> dict[str, Any]:
+    """Ruta en el formato crudo de /routes a partir de una fila del catalogo."""
+    datos = fila.get("datos") or {}
+    if fila["fuente"] == "routes" and datos:
+        return datos
+    # Deducida de un viaje: el id de la ruta viene en el viaje (si lo trae)
+    ref = datos.get("route") if isinstance(datos.get("route"), dict) else {}
+    return {
+        "id": ref.get("id"),
+        "code": fila["codigo"],
+        "name": fila["nombre"],
+        "origin": {"name": fila["origen"]},
+        "destination": {"name": fila["destino"]},
+        "customerId": fila["cliente_id"],
+    }
+
+
+def _rutas_por_ciudad(cliente_id: Optional[str], ciudades: Iterable[Optional[str]]) -> dict[str, list[tuple[dict, int]]]:
+    """
+    Etapa de emparejamiento de rutas de auto-schedule: para cada ciudad (de la
+    sede o la pedida) las rutas candidatas del cliente con su uso historico,
+    ya ordenadas (route_catalog.candidatas, memorizadas por cliente y ciudad).
+    Si el catalogo no tiene rutas del cliente se consulta /routes una sola vez
+    por request (alimenta el catalogo) y, si el catalogo esta caido, se usa esa
+    lista filtrada por ciudad de origen.
+    """
+    resultado: dict[str, list[tuple[dict, int]]] = {}
+    en_vivo: Optional[list[dict[str, Any]]] = None
+    for ciudad in ciudades:
+        clave = normalizar(ciudad)
+        if clave in resultado:
+            continue
+        alias = CITY_ALIASES.get(clave, [])
+        filas = route_catalog.candidatas(cliente_id, clave, alias)
+        if not filas and en_vivo is None:
+            en_vivo = (get_rutas(cliente_id) if get_rutas else []) or []
+            if en_vivo:
+                _registrar_rutas_catalogo(en_vivo, cliente_id)
+                filas = route_catalog.candidatas(cliente_id, clave, alias)
+        if filas:
+            resultado[clave] = [(_ruta_de_catalogo(f), f["trip_count"]) for f in filas]
+            continue
+        validas = [c for c in [clave] + alias if c]
+        en_ciudad = [
+            r for r in en_vivo or []
+            if any(c in normalizar(_parse_location(r.get("origin", r.get("origen")))) for c in validas)
+        ]
+        resultado[clave] = [(r, 0) for r in en_ciudad or en_vivo or []]
+    return resultado
+
+
+def _rutas_del_dia(candidatas: list[tuple[dict, int]], cupos: int) -> list[dict[str, Any]]:
+    """Una ruta por cupo, repartidas segun el uso historico (route_catalog.repartir)."""
+    return [candidatas[j][0] for j in route_catalog.repartir([uso for _, uso in candidatas], cupos)]
+
+
+def _cargas_asignacion(
+    db: Session,
+    vehiculos: Iterable[Any],
+    personas: Iterable[Any],
+    fecha: date,
+) -> dict[tuple[str, str], carga.Carga]:
+    """
+    Contadores de carga (app/carga.py) de los candidatos, por (clase, id): los
+    ids de vehiculos y personas de CloudFleet pueden coincidir. Si `fecha` no es
+    posterior al ultimo dia confirmado de un recurso, ese recurso se calcula
+    desde sus viajes confirmados anteriores a `fecha`.
+    """
+    claves = [(carga.VEHICULO, str(v.id)) for v in vehiculos] + [(carga.PERSONA, str(p.id)) for p in personas]
+    try:
+        cargas = carga.leer(db, claves)
+        atrasadas = [k for k, c in cargas.items() if c.consecutivos_antes(fecha) is None]
+        if atrasadas:
+            cargas.update(carga.calcular_hasta(db, atrasadas, fecha))
+            for clave in atrasadas:
+                cargas.setdefault(clave, carga.Carga())
+    except Exception as e:
+        logger.warning(f"No se pudo leer la carga de recursos: {e}")
+        return {}
+    return cargas
+
+
+def _recurso_asignable(
+    modelo: Any,
+    cargas: dict[tuple[str, str], carga.Carga],
+    fecha: date,
+    persona: bool,
+    con_dato: bool = True,
+) -> assignment.Recurso:
+    c = cargas.get((carga.PERSONA if persona else carga.VEHICULO, str(modelo.id))) or carga.Carga()
+    permisos = [] if persona else None
+    if persona and isinstance(modelo.datos_adicionales, dict):
+        permisos = modelo.datos_adicionales.get("permisos") or []
+    return assignment.Recurso(
+        id=str(modelo.id),
+        dato=modelo if con_dato else None,
+        ciudad=normalizar(modelo.ubicacion_ciudad),
+        activo=bool(modelo.activo),
+        permisos=permisos,
+        dias_consecutivos=(c.consecutivos_antes(fecha) or 0) if persona else None,
+        ultima_asignacion=c.ultima_fecha,
+        viajes_semana=c.viajes_en_semana(fecha),
+    )
+
+
+def _recursos_sede(
+    db: Session,
+    sede_id: str,
+    cliente_id: Optional[str],
+    ciudad: Optional[str],
+    permisos: list[str],
+    fecha: date,
+) -> dict[str, list[assignment.Recurso]]:
+    """
+    Candidatos de /api/auto-schedule y /simulate por tipo, con su carga
+    confirmada. Pasar la ciudad deja el standby solo con recursos de esa ciudad.
+    """
+    # Los permisos del personal viven en el registro completo
+    vista_personal = "full" if permisos else "slim"
+    vehiculos = listar_vehiculos(sede_id=sede_id, cliente_id=cliente_id, ciudad=ciudad, centro_costo=None, view="slim")
+    personal = listar_personal(sede_id=sede_id, cliente_id=cliente_id, ciudad=ciudad, rol=None, view=vista_personal)
+    conductores = [p for p in personal if "conductor" in (p.rol or "").lower()]
+    auxiliares = [p for p in personal if "auxiliar" in (p.rol or "").lower()]
+    cargas = _cargas_asignacion(db, vehiculos, conductores + auxiliares, fecha)
+    return {
+        assignment.VEHICULOS: [_recurso_asignable(v, cargas, fecha, False) for v in vehiculos],
+        assignment.CONDUCTORES: [_recurso_asignable(c, cargas, fecha, True) for c in conductores],
+        assignment.AUXILIARES: [_recurso_asignable(a, cargas, fecha, True) for a in auxiliares],
+    }
+
+
+def _cupos_del_dia(
+    candidatas: list[tuple[dict, int]],
+    ciudad: str,
+    quota: int,
+    permisos: list[str],
+) -> list[assignment.Cupo]:
+    """Cupos del dia con su ruta; la ciudad del cupo es la pedida o, si no hay, el origen de la ruta."""
+    rutas_cupos = _rutas_del_dia(candidatas, quota)
+    cupos = []
+    for i in range(quota):
+        r = rutas_cupos[i] if rutas_cupos else {}
+        origen = _parse_location(r.get("origin", r.get("origen"))) if r else ""
+        cupos.append(assignment.Cupo(i, ruta=r, ciudad=ciudad or normalizar(origen) or None, permisos=permisos))
+    return cupos
+
+
+# Viaje del plan a persistir: (sede_id, fecha, ruta, vehiculo_id, conductor_id, auxiliar_id)
+ViajePlan = tuple[str, date, dict, Optional[str], Optional[str], Optional[str]]
+_LOTE_IN = 500
+
+
+def _publicar_viajes(
+    cliente_id: Optional[str],
+    accion: str,
+    viajes: Iterable[tuple],
+    omitidas: Iterable[dict] = (),
+) -> None:
+    """Evento "viajes" para los tableros: viajes por (sede, fecha), sin los dias omitidos."""
+    excluir = {(o["sede_id"], o["fecha"]) for o in omitidas}
+    conteo = Counter((str(v[0]), v[1].isoformat()) for v in viajes)
+    dias = [
+        {"sede_id": sede, "fecha": fecha, "viajes": n}
+        for (sede, fecha), n in sorted(conteo.items())
+        if (sede, fecha) not in excluir
+    ]
+    if dias:
+        eventos.publicar(eventos.VIAJES, {"accion": accion, "dias": dias}, cliente_id)
+
+
+def _persistir_plan(db: Session, cliente_id: Optional[str], plan: list[ViajePlan]) -> tuple[list[int], list[dict]]:
+    """
+    Guarda el plan con inserts por lote en la transaccion de `db` (sin commit):
+    un INSERT de cabeceras y uno de detalles en lugar de add + flush por viaje.
+
+    Es idempotente por (cliente, sede, fecha): los borradores previos de esas
+    claves se reemplazan. Las claves que ya tienen viajes confirmados no se
+    tocan y se retornan como omitidas. Retorna (ids en el orden del plan sin
+    las omitidas, omitidas).
+    """
+    cliente = cliente_id or "UNKNOWN"
+    claves = {(sede_id, fecha) for sede_id, fecha, *_ in plan}
+    if not claves:
+        return [], []
+    fechas = [f for _, f in claves]
+    existentes = (
+        db.query(Viaje.id, Viaje.sede_id, Viaje.fecha, Viaje.estado)
+        .filter(
+            Viaje.cliente_id == cliente,
+            Viaje.sede_id.in_({s for s, _ in claves}),
+            Viaje.fecha >= min(fechas),
+            Viaje.fecha <= max(fechas),
+        )
+        .all()
+    )
+    confirmadas = {(s, f) for _, s, f, estado in existentes if estado == "confirmado" and (s, f) in claves}
+    borrar = [
+        vid for vid, s, f, estado in existentes
+        if estado == "borrador" and (s, f) in claves and (s, f) not in confirmadas
+    ]
+    for k in range(0, len(borrar), _LOTE_IN):
+        lote = borrar[k:k + _LOTE_IN]
+        db.execute(
+            delete(ViajeDetalle).where(ViajeDetalle.viaje_id.in_(lote)).execution_options(synchronize_session=False)
+        )
+        db.execute(delete(Viaje).where(Viaje.id.in_(lote)).execution_options(synchronize_session=False))
+
+    filas = [v for v in plan if (v[0], v[1]) not in confirmadas]
+    ids: list[int] = []
+    if filas:
+        cabeceras = [
+            {"cliente_id": cliente, "sede_id": sede_id, "fecha": fecha, "estado": "borrador"}
+            for sede_id, fecha, *_ in filas
+        ]
+        if getattr(db.get_bind().dialect, "insert_executemany_returning_sort_by_parameter_order", False):
+            ids = list(db.scalars(insert(Viaje).returning(Viaje.id, sort_by_parameter_order=True), cabeceras))
+        else:
+            # Sin RETURNING (MySQL): los unicos borradores de esas claves son los recien
+            # insertados, y dentro de cada clave el orden de id es el orden de insercion
+            db.execute(insert(Viaje), cabeceras)
+            por_clave: dict[tuple[str, date], list[int]] = {}
+            for vid, s, f in (
+                db.query(Viaje.id, Viaje.sede_id, Viaje.fecha)
+                .filter(
+                    Viaje.cliente_id == cliente,
+                    Viaje.estado == "borrador",
+                    Viaje.sede_id.in_({s for s, _ in claves}),
+                    Viaje.fecha >= min(fechas),
+                    Viaje.fecha <= max(fechas),
+                )
+                .order_by(Viaje.id)
+            ):
+                por_clave.setdefault((s, f), []).append(vid)
+            siguiente = {clave: iter(lista) for clave, lista in por_clave.items()}
+            ids = [next(siguiente[(sede_id, fecha)]) for sede_id, fecha, *_ in filas]
+        db.execute(insert(ViajeDetalle), [
+            {
+                "viaje_id": vid,
+                "ruta_id": str(ruta["id"]) if ruta.get("id") is not None else None,
+                "vehiculo_id": vehiculo_id,
+                "conductor_id": conductor_id,
+                "auxiliar_id": auxiliar_id,
+                "notas": "Generado automaticamente",
+            }
+            for vid, (_, _, ruta, vehiculo_id, conductor_id, auxiliar_id) in zip(ids, filas)
+        ])
+    omitidas = [{"sede_id": s, "fecha": f.isoformat()} for s, f in sorted(confirmadas)]
+    return ids, omitidas
+
 
 @app.post("/api/auto-schedule")
-def auto_schedule_trips(req: AutoScheduleRequest, persist: bool = Query(True), db: Session = Depends(get_db)):
+def auto_schedule_trips(
+    req: AutoScheduleRequest,
+    persist: bool = Query(True),
+    asincrono: bool = Query(False, alias="async"),
+    db: Session = Depends(get_db),
+):
+    """
+    Programa `quota` viajes para la sede y fecha. Cada cupo toma una ruta del
+    cliente que sale de la ciudad, repartidas por uso historico, y el motor de asignacion (app/assignment.py) elige
+    vehiculo, conductor y auxiliar por costo minimo: ciudad, rotacion, dias
+    consecutivos (MAX_DIAS_CONSECUTIVOS) y permisos. La respuesta incluye el
+    objetivo, los cupos vacios y el tiempo de cada etapa en `asignacion`.
+    Con async=true se encola como job y responde 202 con el job_id.
+    """
+    if req.motor not in assignment.MOTORES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Motor de asignacion desconocido: {req.motor} (opciones: {', '.join(assignment.MOTORES)})",
+        )
+    if asincrono:
+        return _encolar(JOB_AUTO_SCHEDULE, req, persist)
 
     try:
         logger.info(f"AutoSchedule Request: {req.dict()}")
-        # 1. Obtener recursos disponibles desde API CloudFleet (con filtros locales)
-        # IMPORTANTE: Pasar req.ciudad asegura que el standby sean solo de esa ciudad
-        vehiculos = listar_vehiculos(sede_id=req.sede_id, cliente_id=req.cliente_id, ciudad=req.ciudad, centro_costo=None)
-        personal = listar_personal(sede_id=req.sede_id, cliente_id=req.cliente_id, ciudad=req.ciudad, rol=None)
-        
-        conductores = [p for p in personal if "conductor" in (p.rol or "").lower()]
-        auxiliares = [p for p in personal if "auxiliar" in (p.rol or "").lower()]
-        
-        # Logica Greedy: Asignacion directa en orden
-        created_ids = []
         fecha_obj = datetime.strptime(req.fecha, "%Y-%m-%d").date()
-        
-        for i in range(req.quota):
-            # Asignar recursos si hay disponibles (Slot i toma recurso i)
-            v_id = vehiculos[i].id if i < len(vehiculos) else None
-            c_id = conductores[i].id if i < len(conductores) else None
-            a_id = auxiliares[i].id if i < len(auxiliares) else None
-            
-            if persist:
-                # Crear Viaje Cabecera
-                nuevo_viaje = Viaje(
-                    cliente_id=req.cliente_id or "UNKNOWN", 
-                    sede_id=req.sede_id,
-                    fecha=fecha_obj,
-                    estado="borrador"
-                )
-                db.add(nuevo_viaje)
-                db.flush() # Para obtener ID
-                
-                # Crear Detalle
-                detalle = ViajeDetalle(
-                    viaje_id=nuevo_viaje.id,
-                    vehiculo_id=v_id,
-                    conductor_id=c_id,
-                    auxiliar_id=a_id,
-                    notas="Generado automaticamente"
-                )
-                db.add(detalle)
-                created_ids.append(nuevo_viaje.id)
-            else:
-                # Mock ID for frontend references
-                created_ids.append(f"preview_{i}")
-            
-        if persist:
-            db.commit()
-        
-        # Calcular recursos no usados (Stand-by)
-        unused_vehicles = [v for i, v in enumerate(vehiculos) if i >= req.quota]
-        unused_conductores = [c for i, c in enumerate(conductores) if i >= req.quota]
-        unused_auxiliares = [a for i, a in enumerate(auxiliares) if i >= req.quota]
+        # 1. Recursos de la sede/ciudad con su carga
+        recursos = _recursos_sede(db, req.sede_id, req.cliente_id, req.ciudad, req.permisos_requeridos, fecha_obj)
 
-        # Construir respuesta detallada para el Frontend
-        detailed_trips = []
-        for i in range(req.quota): # Based on quota, not just created_ids
-             # Recuperar objetos originales basados en el indice (sabemos que sigo el orden 0..quota)
-             v = vehiculos[i] if i < len(vehiculos) else None
-             c = conductores[i] if i < len(conductores) else None
-             a = auxiliares[i] if i < len(auxiliares) else None
-             rutas_disponibles = get_rutas(req.cliente_id) if get_rutas else []
-             r = rutas_disponibles[i % len(rutas_disponibles)] if rutas_disponibles else {}
-             
-             detailed_trips.append({
-                 "vehiculo": v,
-                 "conductor": c,
-                 "auxiliar": a,
-                 "ruta": r
-             })
+        # 2. Cupos: rutas de la ciudad segun uso historico
+        ciudad_req = normalizar(req.ciudad)
+        cupos = _cupos_del_dia(
+            _rutas_por_ciudad(req.cliente_id, [ciudad_req])[ciudad_req], ciudad_req, req.quota, req.permisos_requeridos,
+        )
+
+        # 3. Asignacion de costo minimo por tipo de recurso
+        resultado = assignment.asignar(cupos, recursos, fecha=fecha_obj, motor=req.motor)
 
+        def _dato(recurso: Optional[assignment.Recurso]) -> Any:
+            return recurso.dato if recurso else None
+
+        plan: list[ViajePlan] = []
+        detailed_trips = []
+        for cupo, elegidos in zip(cupos, resultado["asignaciones"]):
+            v = _dato(elegidos.get(assignment.VEHICULOS))
+            c = _dato(elegidos.get(assignment.CONDUCTORES))
+            a = _dato(elegidos.get(assignment.AUXILIARES))
+            r = cupo.ruta or {}
+
+            plan.append((req.sede_id, fecha_obj, r, v.id if v else None, c.id if c else None, a.id if a else None))
+            detailed_trips.append({
+                "vehiculo": v,
+                "conductor": c,
+                "auxiliar": a,
+                "ruta": r
+            })
+
+        omitidas = []
+        if persist:
+            # Reemplaza el borrador del dia (si ya estaba confirmado no se toca)
+            created_ids, omitidas = _persistir_plan(db, req.cliente_id, plan)
+            db.commit()
+            _publicar_viajes(req.cliente_id, "programados", plan, omitidas)
+        else:
+            # Mock ID for frontend references
+            created_ids = [f"preview_{cupo.indice}" for cupo in cupos]
+        mensaje = f"Se programaron {len(created_ids)} viajes (Persistido: {persist})."
+        if omitidas:
+            mensaje += " El dia ya estaba confirmado, no se modifico."
+
+        # Recursos no usados (Stand-by)
+        libres = resultado["libres"]
         return {
             "created_trips": created_ids, 
             "detailed_trips": detailed_trips,
-            "message": f"Se programaron {len(created_ids)} viajes (Persistido: {persist}).",
+            "message": mensaje,
+            "omitidos": omitidas,
             "standby": {
-                "vehicles": unused_vehicles,
-                "drivers": unused_conductores,
-                "assistants": unused_auxiliares
-            }
+                "vehicles": [x.dato for x in libres.get(assignment.VEHICULOS, [])],
+                "drivers": [x.dato for x in libres.get(assignment.CONDUCTORES, [])],
+                "assistants": [x.dato for x in libres.get(assignment.AUXILIARES, [])],
+            },
+            "asignacion": {
+                "motor": resultado["motor"],
+                "solver": resultado["solver"],
+                "objetivo": resultado["objetivo"],
+                "vacios": resultado["vacios"],
+                "tiempos_ms": resultado["tiempos_ms"],
+            },
         }
 
     except Exception as e:
@@ -2036,7 +3442,609 @@ def auto_schedule_trips(req: AutoScheduleRequest, persist: bool = Query(True), d
         raise HTTPException(status_code=500, detail=tb)
 
 
+# ============= SIMULACION DE ESCENARIOS DE CUPO =============
+
+SIMULACION_MAX_ESCENARIOS = 50
+SIMULACION_MAX_CUPOS = 500
+
+
+class SimulateScheduleRequest(BaseModel):
+    sede_id: str
+    fecha: str  # YYYY-MM-DD
+    escenarios: List[int]  # Cupos a comparar, p. ej. [4, 6, 8]
+    cliente_id: Optional[str] = None
+    ciudad: Optional[str] = None
+    permisos_requeridos: List[str] = Field(default_factory=list)
+
+
+@app.post("/api/auto-schedule/simulate")
+def auto_schedule_simulate(req: SimulateScheduleRequest, db: Session = Depends(get_db)):
+    """
+    Compara varios cupos para la sede y fecha sin persistir: carga recursos,
+    cargas y rutas una sola vez y evalua todos los escenarios juntos
+    (assignment.evaluar_escenarios: costos ordenados una vez y suma de
+    prefijos). Por escenario: recursos cubiertos, faltantes y standby por tipo,
+    viajes completos y objetivo, con el mismo optimo que /api/auto-schedule.
+    """
+    if not req.escenarios or len(req.escenarios) > SIMULACION_MAX_ESCENARIOS:
+        raise HTTPException(status_code=400, detail=f"Envie entre 1 y {SIMULACION_MAX_ESCENARIOS} escenarios")
+    if any(q < 0 or q > SIMULACION_MAX_CUPOS for q in req.escenarios):
+        raise HTTPException(status_code=400, detail=f"Cada escenario debe tener entre 0 y {SIMULACION_MAX_CUPOS} cupos")
+    try:
+        fecha = _parse_fecha(req.fecha)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Fecha invalida, use YYYY-MM-DD")
+
+    try:
+        t0 = time.perf_counter()
+        recursos = _recursos_sede(db, req.sede_id, req.cliente_id, req.ciudad, req.permisos_requeridos, fecha)
+        ciudad = normalizar(req.ciudad)
+        candidatas = _rutas_por_ciudad(req.cliente_id, [ciudad])[ciudad]
+        t1 = time.perf_counter()
+        filas = assignment.evaluar_escenarios(
+            [_cupos_del_dia(candidatas, ciudad, q, req.permisos_requeridos) for q in req.escenarios],
+            recursos,
+            fecha,
+        )
+        t2 = time.perf_counter()
+    except Exception as e:
+        logger.error(f"Error simulando escenarios: {traceback.format_exc()}")
+        raise HTTPException(status_code=500, detail=f"Error al simular: {str(e)}")
+
+    escenarios = []
+    for quota, fila in zip(req.escenarios, filas):
+        cubiertos = sum(fila["cubiertos"].values())
+        escenarios.append({
+            "quota": quota,
+            **fila,
+            "cobertura": round(cubiertos / (quota * len(assignment.TIPOS)), 4) if quota else 1.0,
+            "sin_faltantes": not any(fila["faltantes"].values()),
+        })
+    completos = [e["quota"] for e in escenarios if e["sin_faltantes"]]
+    return {
+        "sede_id": req.sede_id,
+        "fecha": req.fecha,
+        "ciudad": req.ciudad,
+        "recursos": {tipo: len(lista) for tipo, lista in recursos.items()},
+        "escenarios": escenarios,
+        "quota_maxima_sin_faltantes": max(completos) if completos else None,
+        "tiempos_ms": {
+            "carga": round((t1 - t0) * 1000, 2),
+            "simulacion": round((t2 - t1) * 1000, 2),
+        },
+    }
+
+
+# ============= SCHEDULER POR LOTE (VARIAS SEDES Y DIAS) =============
+
+BATCH_MAX_DIAS = int(os.getenv("BATCH_MAX_DIAS", "31"))
+
+
+class BatchScheduleRequest(BaseModel):
+    cliente_id: str
+    fecha_inicio: str  # YYYY-MM-DD
+    fecha_fin: str  # YYYY-MM-DD (inclusive)
+    sede_ids: Optional[List[str]] = None  # Por defecto todas las sedes del cliente
+    motor: str = "flujo"
+    permisos_requeridos: List[str] = Field(default_factory=list)
+
+
+def _en_ciudad(ubicacion: Optional[str], ciudad: str, alias: bool) -> bool:
+    """Mismo criterio de /vehiculos (alias=True) y /personal: la ciudad contenida en la ubicacion."""
+    ubicacion_norm = normalizar(ubicacion)
+    if not ubicacion_norm:
+        return False
+    validas = [ciudad] + (CITY_ALIASES.get(ciudad, []) if alias else [])
+    return any(c in ubicacion_norm for c in validas)
+
+
+def _sedes_del_lote(req: BatchScheduleRequest, c_name: str) -> list[dict[str, Any]]:
+    """
+    Sedes a programar con su ciudad. Si CloudFleet no trae sedes del cliente
+    se usan las ciudades de la matriz de cupos (sede_id UNKNOWN, como el
+    planificador cuando no resuelve la sede).
+    """
+    sedes = [
+        {"sede_id": s.id, "sede": s.nombre, "ciudad": s.ciudad}
+        for s in listar_sedes(cliente_id=req.cliente_id, view="slim")
+        if s.ciudad
+    ]
+    if not sedes and c_name:
+        sedes = [{"sede_id": "UNKNOWN", "sede": ciudad, "ciudad": ciudad} for ciudad in get_expected_sedes(c_name)]
+    if req.sede_ids:
+        pedidas = set(req.sede_ids)
+        sedes = [s for s in sedes if s["sede_id"] in pedidas]
+    return sedes
+
+
+def _componentes_por_recursos(grupos: list[dict[str, set[str]]]) -> list[list[int]]:
+    """
+    Agrupa las sedes que comparten algun candidato (p. ej. Cali y Yumbo por
+    alias de ciudad). Cada componente se resuelve como un solo problema, asi
+    un recurso nunca queda en dos sedes el mismo dia y los componentes pueden
+    resolverse en paralelo.
+    """
+    padre = list(range(len(grupos)))
+
+    def raiz(i: int) -> int:
+        while padre[i] != i:
+            padre[i] = padre[padre[i]]
+            i = padre[i]
+        return i
+
+    dueno: dict[tuple[str, str], int] = {}
+    for i, grupo in enumerate(grupos):
+        for tipo, ids in grupo.items():
+            for rid in ids:
+                otro = dueno.setdefault((tipo, rid), i)
+                if otro != i:
+                    padre[raiz(i)] = raiz(otro)
+    componentes: dict[int, list[int]] = {}
+    for i in range(len(grupos)):
+        componentes.setdefault(raiz(i), []).append(i)
+    return list(componentes.values())
+
+
+@app.post("/api/auto-schedule/batch")
+def auto_schedule_batch(
+    req: BatchScheduleRequest,
+    persist: bool = Query(False),
+    asincrono: bool = Query(False, alias="async"),
+    db: Session = Depends(get_db),
+):
+    """
+    Programa todas las sedes de un cliente para un rango de fechas en una sola
+    llamada. Vehiculos, personal y rutas se cargan una vez; el cupo de cada
+    sede y dia sale de la matriz de cupos. Los dias se resuelven en orden (la
+    asignacion de un dia avanza las cargas en memoria: dias consecutivos y
+    viajes de la semana para el siguiente) y, dentro de un dia, las sedes se resuelven en paralelo en un pool de procesos sin que un
+    vehiculo o persona quede en dos sedes. Por defecto no persiste (preview).
+    Con async=true se encola como job y responde 202 con el job_id.
+    """
+    if req.motor not in assignment.MOTORES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Motor de asignacion desconocido: {req.motor} (opciones: {', '.join(assignment.MOTORES)})",
+        )
+    try:
+        inicio = _parse_fecha(req.fecha_inicio)
+        fin = _parse_fecha(req.fecha_fin)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Fechas invalidas, use YYYY-MM-DD")
+    dias = (fin - inicio).days + 1
+    if dias < 1 or dias > BATCH_MAX_DIAS:
+        raise HTTPException(status_code=400, detail=f"El rango debe tener entre 1 y {BATCH_MAX_DIAS} dias")
+    if asincrono:
+        return _encolar(JOB_BATCH, req, persist)
+
+    try:
+        t0 = time.perf_counter()
+        c_name, _ = _resolver_cliente(str(req.cliente_id))
+        sedes = _sedes_del_lote(req, c_name)
+
+        # 1. Recursos y rutas una sola vez para todo el lote
+        vista_personal = "full" if req.permisos_requeridos else "slim"
+        with ThreadPoolExecutor(max_workers=3) as pool:
+            f_vehiculos = enviar(
+                pool, listar_vehiculos, sede_id=None, ciudad=None, centro_costo=None, cliente_id=req.cliente_id,
+                view="slim",
+            )
+            f_personal = enviar(
+                pool, listar_personal, sede_id=None, ciudad=None, rol=None, cliente_id=req.cliente_id,
+                view=vista_personal,
+            )
+            rutas_ciudad = _rutas_por_ciudad(req.cliente_id, [s["ciudad"] for s in sedes])
+            vehiculos = f_vehiculos.result()
+            personal = f_personal.result()
+        conductores = [p for p in personal if "conductor" in (p.rol or "").lower()]
+        auxiliares = [p for p in personal if "auxiliar" in (p.rol or "").lower()]
+        modelos = {
+            assignment.VEHICULOS: {v.id: v for v in vehiculos},
+            assignment.CONDUCTORES: {c.id: c for c in conductores},
+            assignment.AUXILIARES: {a.id: a for a in auxiliares},
+        }
+
+        # 2. Candidatos por sede (mismo filtro de ciudad que el endpoint por sede)
+        candidatos: list[dict[str, set[str]]] = []
+        for sede in sedes:
+            ciudad = normalizar(sede["ciudad"])
+            candidatos.append({
+                assignment.VEHICULOS: {v.id for v in vehiculos if _en_ciudad(v.ubicacion_ciudad, ciudad, True)},
+                assignment.CONDUCTORES: {c.id for c in conductores if _en_ciudad(c.ubicacion_ciudad, ciudad, False)},
+                assignment.AUXILIARES: {a.id for a in auxiliares if _en_ciudad(a.ubicacion_ciudad, ciudad, False)},
+            })
+        componentes = _componentes_por_recursos(candidatos)
+        t_carga = time.perf_counter() - t0
+
+        # Cargas confirmadas al inicio del rango; el lote las avanza en memoria dia a dia
+        cargas = {
+            clave: c.copia()
+            for clave, c in _cargas_asignacion(db, vehiculos, conductores + auxiliares, inicio).items()
+        }
+        resultado_dias = []
+        plan: list[ViajePlan] = []
+        procesos = 1
+        t_asignacion = 0.0
+        conflictos = 0
+        totales = {"cupos": 0, "viajes": 0, "vacios": {tipo: 0 for tipo in assignment.TIPOS}}
+
+        for d in range(dias):
+            fecha = inicio + timedelta(days=d)
+            fecha_txt = fecha.isoformat()
+
+            # 3. Un problema por componente: cupos de todas sus sedes, candidatos unidos
+            problemas = []
+            cupos_de: list[list[tuple[int, dict]]] = []  # (sede, ruta) por cupo
+            for componente in componentes:
+                cupos: list[assignment.Cupo] = []
+                origen: list[tuple[int, dict]] = []
+                recursos = {tipo: set() for tipo in assignment.TIPOS}
+                for i in componente:
+                    sede = sedes[i]
+                    quota = (get_quota_for_date(c_name, sede["ciudad"], fecha_txt) if c_name else 0) or 0
+                    rutas_cupos = _rutas_del_dia(rutas_ciudad[normalizar(sede["ciudad"])], quota)
+                    for k in range(quota):
+                        cupos.append(assignment.Cupo(
+                            len(cupos), ciudad=normalizar(sede["ciudad"]), permisos=req.permisos_requeridos,
+                        ))
+                        origen.append((i, rutas_cupos[k] if rutas_cupos else {}))
+                    for tipo in assignment.TIPOS:
+                        recursos[tipo] |= candidatos[i][tipo]
+                if not cupos:
+                    continue
+                problemas.append((
+                    cupos,
+                    {
+                        tipo: [
+                            # Sin el modelo: al pool viajan solo los datos del costo
+                            _recurso_asignable(
+                                modelos[tipo][rid], cargas, fecha, tipo != assignment.VEHICULOS, con_dato=False,
+                            )
+                            for rid in sorted(ids)
+                        ]
+                        for tipo, ids in recursos.items()
+                    },
+                    fecha,
+                    req.motor,
+                ))
+                cupos_de.append(origen)
+
+            t1 = time.perf_counter()
+            resultados, usados = assignment.asignar_lote(problemas)
+            t_asignacion += time.perf_counter() - t1
+            procesos = max(procesos, usados)
+
+            # 4. Ledger del dia: ningun recurso en dos cupos
+            ocupados: set[tuple[str, str]] = set()
+            por_sede: dict[int, dict[str, Any]] = {}
+            for origen, resultado in zip(cupos_de, resultados):
+                for (i, ruta), elegidos in zip(origen, resultado["asignaciones"]):
+                    sede = sedes[i]
+                    salida = por_sede.setdefault(i, {
+                        "sede_id": sede["sede_id"],
+                        "sede": sede["sede"],
+                        "ciudad": sede["ciudad"],
+                        "quota": 0,
+                        "viajes": [],
+                        "vacios": {tipo: 0 for tipo in assignment.TIPOS},
+                    })
+                    salida["quota"] += 1
+                    viaje: dict[str, Optional[str]] = {}
+                    for tipo in assignment.TIPOS:
+                        rid = elegidos.get(tipo)
+                        if rid is not None and (tipo, rid) in ocupados:
+                            conflictos += 1
+                            rid = None
+                        if rid is None:
+                            salida["vacios"][tipo] += 1
+                            totales["vacios"][tipo] += 1
+                        else:
+                            ocupados.add((tipo, rid))
+                            clase = carga.VEHICULO if tipo == assignment.VEHICULOS else carga.PERSONA
+                            cargas.setdefault((clase, rid), carga.Carga()).registrar(fecha)
+                        viaje[tipo] = rid
+                    modelo_v = modelos[assignment.VEHICULOS].get(viaje[assignment.VEHICULOS])
+                    modelo_c = modelos[assignment.CONDUCTORES].get(viaje[assignment.CONDUCTORES])
+                    modelo_a = modelos[assignment.AUXILIARES].get(viaje[assignment.AUXILIARES])
+                    salida["viajes"].append({
+                        "ruta_id": str(ruta["id"]) if ruta.get("id") is not None else None,
+                        "ruta_codigo": _codigo_ruta_item(ruta) if ruta else None,
+                        "vehiculo_id": modelo_v.id if modelo_v else None,
+                        "placa": modelo_v.placa if modelo_v else None,
+                        "conductor_id": modelo_c.id if modelo_c else None,
+                        "conductor": modelo_c.nombre if modelo_c else None,
+                        "auxiliar_id": modelo_a.id if modelo_a else None,
+                        "auxiliar": modelo_a.nombre if modelo_a else None,
+                    })
+                    totales["cupos"] += 1
+                    plan.append((
+                        sede["sede_id"], fecha, ruta,
+                        viaje[assignment.VEHICULOS], viaje[assignment.CONDUCTORES], viaje[assignment.AUXILIARES],
+                    ))
+                    totales["viajes"] += 1
+            resultado_dias.append({
+                "fecha": fecha_txt,
+                "sedes": [por_sede[i] for i in sorted(por_sede)],
+                "objetivo": round(sum(r["objetivo"] for r in resultados), 4),
+            })
+
+        created_ids: list[int] = []
+        omitidas: list[dict] = []
+        t_persistencia = 0.0
+        if persist:
+            # Todo el rango en una transaccion, reemplazando los borradores previos
+            t2 = time.perf_counter()
+            created_ids, omitidas = _persistir_plan(db, req.cliente_id, plan)
+            db.commit()
+            t_persistencia = time.perf_counter() - t2
+            _publicar_viajes(req.cliente_id, "programados", plan, omitidas)
+
+        return ORJSONResponse(content={
+            "cliente_id": req.cliente_id,
+            "cliente_nombre": c_name or None,
+            "fecha_inicio": req.fecha_inicio,
+            "fecha_fin": req.fecha_fin,
+            "motor": req.motor,
+            "dias": resultado_dias,
+            "totales": {**totales, "sedes": len(sedes), "dias": dias, "conflictos": conflictos},
+            "created_trips": created_ids,
+            "omitidos": omitidas,
+            "procesos": procesos,
+            "tiempos_ms": {
+                "carga": round(t_carga * 1000, 2),
+                "asignacion": round(t_asignacion * 1000, 2),
+                "persistencia": round(t_persistencia * 1000, 2),
+                "total": round((time.perf_counter() - t0) * 1000, 2),
+            },
+        })
+    except HTTPException:
+        raise
+    except Exception as e:
+        db.rollback()
+        logger.error(f"Error scheduler por lote: {traceback.format_exc()}")
+        raise HTTPException(status_code=500, detail=f"Error al programar el lote: {str(e)}")
+
+
+HORIZONTE_DIAS = 7
+
+
+class HorizonScheduleRequest(BaseModel):
+    cliente_id: str
+    fecha_inicio: str  # YYYY-MM-DD
+    dias: int = HORIZONTE_DIAS
+    sede_ids: Optional[List[str]] = None
+    motor: str = "flujo"
+    permisos_requeridos: List[str] = Field(default_factory=list)
+
+
+@app.post("/api/auto-schedule/horizon")
+def auto_schedule_horizon(
+    req: HorizonScheduleRequest,
+    persist: bool = Query(False),
+    asincrono: bool = Query(False, alias="async"),
+    db: Session = Depends(get_db),
+):
+    """
+    Planificador de horizonte movil (7 dias por defecto desde fecha_inicio).
+    Parte de la carga confirmada y la avanza dia a dia, asi ningun recurso
+    supera MAX_DIAS_CONSECUTIVOS dentro del horizonte y los viajes de la
+    semana se reparten (ASIGNACION_PESO_CARGA_SEMANA). Mismo formato que
+    /api/auto-schedule/batch. Acepta async=true igual que el lote.
+    """
+    try:
+        inicio = _parse_fecha(req.fecha_inicio)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Fecha invalida, use YYYY-MM-DD")
+    if req.dias < 1:
+        raise HTTPException(status_code=400, detail="dias debe ser al menos 1")
+    lote = BatchScheduleRequest(
+        cliente_id=req.cliente_id,
+        fecha_inicio=req.fecha_inicio,
+        fecha_fin=(inicio + timedelta(days=req.dias - 1)).isoformat(),
+        sede_ids=req.sede_ids,
+        motor=req.motor,
+        permisos_requeridos=req.permisos_requeridos,
+    )
+    return auto_schedule_batch(lote, persist=persist, asincrono=asincrono, db=db)
+
+
+# ============= COLA DE JOBS (SCHEDULING LARGO) =============
+
+JOB_AUTO_SCHEDULE = "auto-schedule"
+JOB_BATCH = "auto-schedule-batch"
+
+
+class JobRequest(BaseModel):
+    tipo: str  # auto-schedule | auto-schedule-batch
+    parametros: Dict[str, Any]  # Body del endpoint sincronico
+    persist: bool = False
+
+
+def _encolar(tipo: str, req: BaseModel, persist: bool) -> JSONResponse:
+    try:
+        estado = jobs.enviar(tipo, {"req": req.model_dump(), "persist": persist})
+    except Exception as e:
+        logger.error(f"Error encolando job {tipo}: {e}")
+        raise HTTPException(status_code=503, detail=f"No se pudo encolar el job: {e}")
+    return JSONResponse(status_code=202, content={
+        **estado,
+        "estado_url": f"/api/jobs/{estado['job_id']}",
+        "resultado_url": f"/api/jobs/{estado['job_id']}/resultado",
+    })
+
+
+def _job_auto_schedule(parametros: dict[str, Any]) -> Any:
+    with SessionLocal() as db:
+        return auto_schedule_trips(
+            AutoScheduleRequest(**parametros["req"]), persist=parametros["persist"], asincrono=False, db=db,
+        )
+
+
+def _job_batch(parametros: dict[str, Any]) -> Any:
+    with SessionLocal() as db:
+        return auto_schedule_batch(
+            BatchScheduleRequest(**parametros["req"]), persist=parametros["persist"], asincrono=False, db=db,
+        )
+
+
+# El horizonte se encola como lote (ya trae fecha_fin calculada)
+jobs.registrar_tipo(JOB_AUTO_SCHEDULE, _job_auto_schedule, lambda p: AutoScheduleRequest(**p["req"]))
+jobs.registrar_tipo(JOB_BATCH, _job_batch, lambda p: BatchScheduleRequest(**p["req"]))
+
+
+@app.post("/api/jobs", status_code=202)
+def api_enviar_job(req: JobRequest):
+    """
+    Encola un scheduling largo y responde de inmediato con el job_id. Los
+    parametros son el body del endpoint sincronico del tipo. Equivale a
+    llamar ese endpoint con async=true.
+    """
+    if req.tipo not in jobs.tipos():
+        raise HTTPException(status_code=400, detail=f"Tipo de job desconocido: {req.tipo} (opciones: {', '.join(jobs.tipos())})")
+    try:
+        modelo = {JOB_AUTO_SCHEDULE: AutoScheduleRequest, JOB_BATCH: BatchScheduleRequest}[req.tipo](**req.parametros)
+    except ValidationError as e:
+        raise HTTPException(status_code=422, detail=jsonable_encoder(e.errors()))
+    return _encolar(req.tipo, modelo, req.persist)
+
+
+@app.get("/api/jobs")
+def api_listar_jobs(
+    estado: Optional[str] = Query(None, description="pendiente, en_curso, completado o error"),
+    tipo: Optional[str] = None,
+    limit: int = Query(50, ge=1, le=500),
+):
+    """Jobs recientes (sin resultado), del mas nuevo al mas viejo."""
+    return {"workers": jobs.workers.activos(), "jobs": jobs.listar(estado, tipo, limit)}
+
+
+@app.get("/api/jobs/{job_id}")
+def api_estado_job(job_id: str):
+    """Estado de un job; si esta pendiente incluye su posicion en la cola."""
+    estado = jobs.obtener(job_id)
+    if not estado:
+        raise HTTPException(status_code=404, detail="Job no encontrado")
+    return estado
+
+
+@app.get("/api/jobs/{job_id}/resultado")
+def api_resultado_job(job_id: str):
+    """
+    Resultado del job: el mismo body que habria respondido el endpoint
+    sincronico. 202 con el estado mientras no termina; si fallo, el mismo
+    status y detalle del error.
+    """
+    encontrado = jobs.resultado(job_id)
+    if not encontrado:
+        raise HTTPException(status_code=404, detail="Job no encontrado")
+    estado, resultado = encontrado
+    if estado["estado"] == jobs.COMPLETADO:
+        return Response(content=resultado or "null", media_type="application/json")
+    if estado["estado"] == jobs.ERROR:
+        raise HTTPException(status_code=estado["codigo_http"] or 500, detail=estado["error"])
+    return JSONResponse(status_code=202, content=estado)
+
+
+# ============= CONFIRMACION Y CARGA DE RECURSOS =============
+
+class ConfirmarViajesRequest(BaseModel):
+    cliente_id: str
+    fecha_inicio: str  # YYYY-MM-DD
+    fecha_fin: Optional[str] = None  # Por defecto solo fecha_inicio
+    sede_id: Optional[str] = None
+    viaje_ids: Optional[List[int]] = None  # Por defecto todos los borradores del filtro
+
+
+@app.post("/api/viajes/confirmar")
+def confirmar_viajes(req: ConfirmarViajesRequest, db: Session = Depends(get_db)):
+    """
+    Pasa a 'confirmado' los viajes en borrador del cliente (y sede) en el rango
+    y actualiza en la misma transaccion la carga de sus vehiculos y personas,
+    que el despacho automatico usa para dias consecutivos y rotacion.
+    """
+    try:
+        inicio = _parse_fecha(req.fecha_inicio)
+        fin = _parse_fecha(req.fecha_fin) if req.fecha_fin else inicio
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Fechas invalidas, use YYYY-MM-DD")
+    try:
+        consulta = db.query(Viaje).filter(
+            Viaje.cliente_id == req.cliente_id,
+            Viaje.fecha >= inicio,
+            Viaje.fecha <= fin,
+            Viaje.estado == "borrador",
+        )
+        if req.sede_id:
+            consulta = consulta.filter(Viaje.sede_id == req.sede_id)
+        if req.viaje_ids:
+            consulta = consulta.filter(Viaje.id.in_(req.viaje_ids))
+        viajes = consulta.all()
+        asignaciones = []
+        for viaje in viajes:
+            viaje.estado = "confirmado"
+            for d in viaje.detalle:
+                asignaciones.append((carga.VEHICULO, d.vehiculo_id, viaje.fecha))
+                asignaciones.append((carga.PERSONA, d.conductor_id, viaje.fecha))
+                asignaciones.append((carga.PERSONA, d.auxiliar_id, viaje.fecha))
+        recursos = carga.registrar_confirmados(db, asignaciones)
+        db.commit()
+        _publicar_viajes(req.cliente_id, "confirmados", [(v.sede_id, v.fecha) for v in viajes])
+        return {"confirmados": len(viajes), "recursos_actualizados": recursos}
+    except Exception as e:
+        db.rollback()
+        logger.error(f"Error confirmando viajes: {e}")
+        raise HTTPException(status_code=500, detail=f"Error al confirmar viajes: {str(e)}")
+
+
+@app.get("/api/cargas")
+def listar_cargas(
+    fecha: Optional[str] = Query(None, description="Fecha YYYY-MM-DD para dias consecutivos y viajes de la semana"),
+    clase: Optional[str] = Query(None, description="vehiculo o persona"),
+    db: Session = Depends(get_db),
+):
+    """Carga de trabajo confirmada por recurso (ultimo dia, racha y viajes de la semana)."""
+    try:
+        fecha_obj = _parse_fecha(fecha) if fecha else date.today()
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Fecha invalida, use YYYY-MM-DD")
+    cargas = carga.leer(db)
+    return ORJSONResponse(content=[
+        {
+            "clase": k,
+            "recurso_id": rid,
+            "ultima_fecha": c.ultima_fecha.isoformat() if c.ultima_fecha else None,
+            "racha": c.racha,
+            "dias_consecutivos": c.consecutivos_antes(fecha_obj),
+            "viajes_semana": c.viajes_en_semana(fecha_obj),
+            "viajes_total": c.viajes_total,
+            "bloqueado": (c.consecutivos_antes(fecha_obj) or 0) >= MAX_DIAS_CONSECUTIVOS,
+        }
+        for (k, rid), c in sorted(cargas.items())
+        if not clase or k == clase
+    ])
+
+
+@app.post("/api/cargas/reconstruir")
+def reconstruir_cargas(db: Session = Depends(get_db)):
+    """Rehace los contadores de carga desde todos los viajes confirmados."""
+    try:
+        return {"recursos": carga.reconstruir(db)}
+    except Exception as e:
+        db.rollback()
+        raise HTTPException(status_code=500, detail=f"Error al reconstruir cargas: {str(e)}")
+
+
 # ============= PRE-PROGRAMMING (DRAFTS) =============
+#
+# Cada borrador tiene una version. El autosave manda un JSON Patch (RFC 6902)
+# contra la version que edito (PATCH /api/draft/{id}); si otro planificador
+# guardo en el medio, responde 409 en lugar de pisar su cambio. Los patches
+# quedan en dispatch_draft_deltas y cada BORRADOR_COMPACTAR_CADA versiones se
+# pliegan en `payload`, asi leer el borrador nunca aplica mas que eso.
+
+BORRADOR_COMPACTAR_CADA = int(os.getenv("BORRADOR_COMPACTAR_CADA", "20"))
+BORRADORES_RANGO_MAX_DIAS = 31
+
 
 class DraftRequest(BaseModel):
     cliente_id: str
@@ -2044,11 +4052,59 @@ class DraftRequest(BaseModel):
     fecha: str
     payload: Dict[str, Any] # Full JSON state of simulation
     status: str = "DRAFT"
+    # Version sobre la que se edito; sin ella el guardado reemplaza lo que haya
+    version: Optional[int] = None
+
+
+class DraftPatchRequest(BaseModel):
+    version: int
+    patch: List[Dict[str, Any]]
+
+
+def _conflicto_borrador(draft_id: Optional[str], version: Optional[int]) -> HTTPException:
+    return HTTPException(status_code=409, detail={
+        "mensaje": "El borrador cambio desde la version editada; recargue antes de guardar",
+        "id": draft_id,
+        "version": version,
+    })
+
+
+def _estados_borradores(db: Session, drafts: list[DispatchDraft]) -> dict[str, Any]:
+    """Payload compactado mas los patches posteriores de cada borrador (una consulta de deltas)."""
+    estados = {d.id: json.loads(d.contenido) for d in drafts}
+    pendientes = {d.id: d for d in drafts if d.version > d.payload_version}
+    if pendientes:
+        deltas = db.query(DispatchDraftDelta.draft_id, DispatchDraftDelta.version, DispatchDraftDelta.patch).filter(
+            DispatchDraftDelta.draft_id.in_(pendientes),
+        ).order_by(DispatchDraftDelta.draft_id, DispatchDraftDelta.version)
+        for draft_id, version, patch in deltas:
+            draft = pendientes[draft_id]
+            if draft.payload_version < version <= draft.version:
+                estados[draft_id] = json_patch.aplicar(estados[draft_id], json.loads(patch))
+    return estados
+
+
+def _estado_borrador(db: Session, draft: DispatchDraft) -> Any:
+    return _estados_borradores(db, [draft])[draft.id]
+
+
+def _avanzar_version(db: Session, draft_id: str, version: int, **valores) -> int:
+    """UPDATE condicional: solo avanza si nadie guardo otra version en el medio."""
+    nueva = version + 1
+    avanzo = db.execute(
+        update(DispatchDraft)
+        .where(DispatchDraft.id == draft_id, DispatchDraft.version == version)
+        .values(version=nueva, updated_at=datetime.utcnow(), **valores)
+    ).rowcount
+    if not avanzo:
+        actual = db.query(DispatchDraft.version).filter(DispatchDraft.id == draft_id).scalar()
+        raise _conflicto_borrador(draft_id, actual)
+    return nueva
+
 
 @app.post("/api/draft")
 def save_draft(req: DraftRequest, db: Session = Depends(get_db)):
     import uuid
-    import json
     try:
         fecha_obj = datetime.strptime(req.fecha, "%Y-%m-%d").date()
         
@@ -2061,27 +4117,110 @@ def save_draft(req: DraftRequest, db: Session = Depends(get_db)):
         ).first()
 
         if existing:
-            existing.payload = json.dumps(req.payload)
-            existing.updated_at = datetime.utcnow()
+            if req.version is not None and req.version != existing.version:
+                raise _conflicto_borrador(existing.id, existing.version)
+            # El payload completo reemplaza la base y vuelve obsoletos los patches
+            version = _avanzar_version(
+                db, existing.id, existing.version,
+                payload_version=existing.version + 1, **DispatchDraft.columnas_payload(json.dumps(req.payload)),
+            )
+            db.execute(delete(DispatchDraftDelta).where(DispatchDraftDelta.draft_id == existing.id))
             db.commit()
-            return {"message": "Borrador actualizado", "id": existing.id}
-        
+            eventos.publicar(
+                eventos.BORRADOR,
+                {"sede_id": req.sede_id, "fecha": req.fecha, "id": existing.id, "accion": "actualizado", "version": version},
+                req.cliente_id,
+            )
+            return {"message": "Borrador actualizado", "id": existing.id, "version": version}
+
+        if req.version is not None:
+            # Se edito un borrador que ya no esta (ejecutado o borrado)
+            raise _conflicto_borrador(None, None)
+
         new_draft = DispatchDraft(
             id=str(uuid.uuid4()),
             cliente_id=req.cliente_id,
             sede_id=req.sede_id,
             fecha=fecha_obj,
-            payload=json.dumps(req.payload),
-            status=req.status
+            status=req.status,
+            version=1,
+            payload_version=1,
         )
+        new_draft.contenido = json.dumps(req.payload)
         db.add(new_draft)
         db.commit()
-        return {"message": "Borrador guardado", "id": new_draft.id}
+        eventos.publicar(
+            eventos.BORRADOR,
+            {"sede_id": req.sede_id, "fecha": req.fecha, "id": new_draft.id, "accion": "creado", "version": 1},
+            req.cliente_id,
+        )
+        return {"message": "Borrador guardado", "id": new_draft.id, "version": 1}
         
+    except HTTPException:
+        db.rollback()
+        raise
     except Exception as e:
         db.rollback()
         raise HTTPException(status_code=500, detail=str(e))
 
+
+@app.patch("/api/draft/{draft_id}")
+def patch_draft(draft_id: str, req: DraftPatchRequest, db: Session = Depends(get_db)):
+    """
+    Aplica un JSON Patch (RFC 6902) sobre la version `version` del borrador.
+    409 si el borrador ya esta en otra version; 422 si el patch no aplica
+    (ruta inexistente, test que falla). Solo se guarda el patch, no el payload.
+    """
+    try:
+        draft = db.get(DispatchDraft, draft_id)
+        if draft is None or draft.status != "DRAFT":
+            raise HTTPException(status_code=404, detail="Borrador no encontrado")
+        if draft.version != req.version:
+            raise _conflicto_borrador(draft.id, draft.version)
+        if not req.patch:
+            return {"message": "Sin cambios", "id": draft.id, "version": draft.version, "compactado": False}
+
+        try:
+            estado = json_patch.aplicar(_estado_borrador(db, draft), req.patch)
+        except json_patch.JsonPatchError as e:
+            raise HTTPException(status_code=422, detail=f"Patch invalido: {e}")
+
+        cliente_id, sede_id, fecha = draft.cliente_id, draft.sede_id, draft.fecha.isoformat()
+        payload_version = draft.payload_version
+        version = _avanzar_version(db, draft.id, req.version)
+        db.add(DispatchDraftDelta(draft_id=draft.id, version=version, patch=json.dumps(req.patch)))
+        db.flush()
+
+        compactado = version - payload_version >= BORRADOR_COMPACTAR_CADA
+        if compactado:
+            db.execute(
+                update(DispatchDraft)
+                .where(DispatchDraft.id == draft.id)
+                .values(payload_version=version, **DispatchDraft.columnas_payload(json.dumps(estado)))
+            )
+            db.execute(delete(DispatchDraftDelta).where(
+                DispatchDraftDelta.draft_id == draft.id, DispatchDraftDelta.version <= version,
+            ))
+        db.commit()
+    except IntegrityError:
+        # Otro patch contra la misma version gano la carrera
+        db.rollback()
+        raise _conflicto_borrador(draft_id, None)
+    except HTTPException:
+        db.rollback()
+        raise
+    except Exception as e:
+        db.rollback()
+        raise HTTPException(status_code=500, detail=str(e))
+
+    eventos.publicar(
+        eventos.BORRADOR,
+        {"sede_id": sede_id, "fecha": fecha, "id": draft_id, "accion": "editado", "version": version},
+        cliente_id,
+    )
+    return {"message": "Borrador actualizado", "id": draft_id, "version": version, "compactado": compactado}
+
+
 @app.get("/api/draft")
 def get_draft(cliente_id: str, sede_id: str, fecha: str, db: Session = Depends(get_db)):
     try:
@@ -2096,16 +4235,77 @@ def get_draft(cliente_id: str, sede_id: str, fecha: str, db: Session = Depends(g
         if not draft:
             return {"found": False}
         
-        import json
         return {
             "found": True, 
             "id": draft.id, 
-            "payload": json.loads(draft.payload),
+            "version": draft.version,
+            "payload": _estado_borrador(db, draft),
             "updated_at": draft.updated_at
         }
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+
+@app.get("/api/drafts")
+def get_drafts(
+    cliente_id: str,
+    desde: str,
+    hasta: Optional[str] = Query(None, description="Inclusive; por defecto desde + 6 (una semana)"),
+    status: Optional[str] = Query("DRAFT", description="Vacio para todos los estados"),
+    incluir_payload: bool = False,
+    db: Session = Depends(get_db),
+):
+    """
+    Borradores de un cliente en un rango de fechas (todas las sedes) para la
+    vista semanal, en una consulta sobre ix_dispatch_drafts_cliente_fecha_sede.
+    Sin incluir_payload no lee ni descomprime los payloads.
+    """
+    try:
+        desde_obj = datetime.strptime(desde, "%Y-%m-%d").date()
+        hasta_obj = datetime.strptime(hasta, "%Y-%m-%d").date() if hasta else desde_obj + timedelta(days=6)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Fechas con formato YYYY-MM-DD")
+    if hasta_obj < desde_obj or (hasta_obj - desde_obj).days >= BORRADORES_RANGO_MAX_DIAS:
+        raise HTTPException(status_code=400, detail=f"Rango invalido (maximo {BORRADORES_RANGO_MAX_DIAS} dias)")
+    try:
+        q = db.query(DispatchDraft).filter(
+            DispatchDraft.cliente_id == cliente_id,
+            DispatchDraft.fecha >= desde_obj,
+            DispatchDraft.fecha <= hasta_obj,
+        )
+        if status:
+            q = q.filter(DispatchDraft.status == status)
+        if not incluir_payload:
+            q = q.options(defer(DispatchDraft.payload), defer(DispatchDraft.payload_z))
+        drafts = q.order_by(DispatchDraft.fecha, DispatchDraft.sede_id).all()
+        estados = _estados_borradores(db, drafts) if incluir_payload else {}
+
+        borradores = []
+        por_dia: Counter = Counter()
+        for d in drafts:
+            fila = {
+                "id": d.id,
+                "sede_id": d.sede_id,
+                "fecha": d.fecha.isoformat(),
+                "status": d.status,
+                "version": d.version,
+                "updated_at": d.updated_at,
+            }
+            if incluir_payload:
+                fila["payload"] = estados[d.id]
+            borradores.append(fila)
+            por_dia[fila["fecha"]] += 1
+        return {
+            "cliente_id": cliente_id,
+            "desde": desde_obj.isoformat(),
+            "hasta": hasta_obj.isoformat(),
+            "total": len(borradores),
+            "por_dia": dict(por_dia),
+            "borradores": borradores,
+        }
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
@@ -1,10 +1,21 @@
-from sqlalchemy import Column, Integer, String, Date, Text, Enum, TIMESTAMP
+import zlib
+from sqlalchemy import Column, Integer, String, Date, Text, Enum, TIMESTAMP, Float, Boolean, ForeignKey, Index, UniqueConstraint, LargeBinary
+from sqlalchemy.dialects.mysql import LONGBLOB, LONGTEXT
 from sqlalchemy.orm import relationship
 from datetime import datetime
 from .database import Base
 
+try:
+    import zstandard
+except ImportError:  # zlib basta; zstd comprime algo mas y mas rapido
+    zstandard = None
+
 class Viaje(Base):
     __tablename__ = "viajes"
+    __table_args__ = (
+        # Reemplazo idempotente del plan por (cliente, sede, fecha)
+        Index("ix_viajes_cliente_sede_fecha", "cliente_id", "sede_id", "fecha"),
+    )
 
     id = Column(Integer, primary_key=True, index=True, autoincrement=True)
     cliente_id = Column(String(50), nullable=False) # String ID from CloudFleet
@@ -41,17 +52,204 @@ class ViajeDetalle(Base):
     viaje = relationship("Viaje", back_populates="detalle")
 
 
+# Los payloads comprimidos se reconocen por su cabecera, asi una base con
+# borradores zstd y zlib se lee igual (zstd solo requiere `zstandard` instalado)
+_ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+
+
+def comprimir_payload(texto: str) -> bytes:
+    datos = texto.encode("utf-8")
+    if zstandard is not None:
+        return zstandard.ZstdCompressor(level=3).compress(datos)
+    return zlib.compress(datos, 6)
+
+
+def descomprimir_payload(datos: bytes) -> str:
+    if datos[:4] == _ZSTD_MAGIC:
+        if zstandard is None:
+            raise RuntimeError("Borrador comprimido con zstd: instale el paquete zstandard")
+        return zstandard.ZstdDecompressor().decompress(datos).decode("utf-8")
+    return zlib.decompress(datos).decode("utf-8")
+
+
 class DispatchDraft(Base):
     __tablename__ = "dispatch_drafts"
+    __table_args__ = (
+        # get/save buscan por (cliente, sede, fecha, status) y la vista semanal por
+        # cliente y rango de fechas: fecha va antes que sede para servir a los dos
+        Index("ix_dispatch_drafts_cliente_fecha_sede", "cliente_id", "fecha", "sede_id", "status"),
+    )
 
     id = Column(String(50), primary_key=True) # UUID
     cliente_id = Column(String(50), nullable=False)
     sede_id = Column(String(50), nullable=False)
     fecha = Column(Date, nullable=False)
     
-    # JSON payload stringified
+    # JSON payload stringified. Los borradores nuevos lo guardan comprimido en
+    # payload_z y dejan payload vacio; usar `contenido` para leer o escribir
     payload = Column(Text, nullable=False)
+    payload_z = Column(LargeBinary().with_variant(LONGBLOB(), "mysql"), nullable=True)
     
     status = Column(String(20), default="DRAFT") # DRAFT, EXECUTED
     created_at = Column(TIMESTAMP, default=datetime.utcnow)
     updated_at = Column(TIMESTAMP, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    # Version actual (sube con cada guardado o patch) y version que tiene `payload`;
+    # las intermedias estan en dispatch_draft_deltas hasta la proxima compactacion
+    version = Column(Integer, nullable=False, default=1, server_default="1")
+    payload_version = Column(Integer, nullable=False, default=1, server_default="1")
+
+    @staticmethod
+    def columnas_payload(texto: str) -> dict:
+        """Valores de payload/payload_z para INSERT o UPDATE del JSON `texto`."""
+        return {"payload": "", "payload_z": comprimir_payload(texto)}
+
+    @property
+    def contenido(self) -> str:
+        """JSON del payload, comprimido o no (filas anteriores a payload_z)."""
+        if self.payload_z is not None:
+            return descomprimir_payload(self.payload_z)
+        return self.payload
+
+    @contenido.setter
+    def contenido(self, texto: str) -> None:
+        for columna, valor in self.columnas_payload(texto).items():
+            setattr(self, columna, valor)
+
+
+class DispatchDraftDelta(Base):
+    """JSON Patch (RFC 6902) que lleva un borrador de `version - 1` a `version`."""
+    __tablename__ = "dispatch_draft_deltas"
+    __table_args__ = (
+        # Dos patches contra la misma version no pueden quedar guardados
+        UniqueConstraint("draft_id", "version", name="uq_dispatch_draft_deltas_version"),
+    )
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    draft_id = Column(String(50), nullable=False)
+    version = Column(Integer, nullable=False)
+    patch = Column(Text, nullable=False)
+    created_at = Column(TIMESTAMP, default=datetime.utcnow)
+
+
+# ---- Catalogo de rutas derivado de /routes y /travels ----
+
+class RutaCatalogo(Base):
+    __tablename__ = "ruta_catalogo"
+    __table_args__ = (
+        UniqueConstraint("cliente_id", "codigo", "origen", "destino", name="uq_ruta_catalogo_clave"),
+        Index("ix_ruta_catalogo_cliente_codigo", "cliente_id", "codigo"),
+        # Filtro por route_code: igualdad o prefijo sobre el codigo en mayusculas
+        Index("ix_ruta_catalogo_cliente_codigo_norm", "cliente_id", "codigo_norm"),
+    )
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    cliente_id = Column(String(64), nullable=False, default="")
+    codigo = Column(String(80), nullable=False)
+    codigo_norm = Column(String(80), nullable=True)  # codigo.strip().upper()
+    nombre = Column(String(200), nullable=True)
+    origen = Column(String(150), nullable=False, default="")
+    destino = Column(String(150), nullable=False, default="")
+    # Ciudades normalizadas (minusculas, sin acentos) para filtrar sin recorrer en Python
+    origen_norm = Column(String(150), index=True)
+    destino_norm = Column(String(150), index=True)
+    ciudad_norm = Column(String(150), index=True)  # city del travel, si vino de /travels
+
+    ref_id = Column(String(64), nullable=True)  # id de /routes o numero del primer viaje
+    sede_id = Column(String(64), nullable=True)
+    distancia_km = Column(Float, nullable=True)
+    activa = Column(Boolean, default=True)
+    via_codigo = Column(String(80), nullable=True)
+    fuente = Column(String(20), default="routes")  # routes | travels
+    datos = Column(Text, nullable=True)  # JSON del registro crudo de CloudFleet
+
+    trip_count = Column(Integer, default=0)
+    last_seen = Column(TIMESTAMP, default=datetime.utcnow)
+    created_at = Column(TIMESTAMP, default=datetime.utcnow)
+    updated_at = Column(TIMESTAMP, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    vias = relationship("RutaCatalogoVia", back_populates="ruta", cascade="all, delete-orphan",
+                        order_by="RutaCatalogoVia.id")
+
+
+class RutaCatalogoVia(Base):
+    __tablename__ = "ruta_catalogo_via"
+    __table_args__ = (
+        UniqueConstraint("ruta_id", "codigo", "nombre", name="uq_ruta_catalogo_via"),
+    )
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    ruta_id = Column(Integer, ForeignKey("ruta_catalogo.id"), nullable=False, index=True)
+    codigo = Column(String(80), nullable=False, default="")
+    nombre = Column(String(150), nullable=False, default="")
+    datos = Column(Text, nullable=True)
+    trip_count = Column(Integer, default=0)
+    last_seen = Column(TIMESTAMP, default=datetime.utcnow)
+
+    ruta = relationship("RutaCatalogo", back_populates="vias")
+
+
+class RutaCatalogoViaje(Base):
+    """Viajes ya contados en el catalogo (para que un re-sync no duplique trip_count)."""
+    __tablename__ = "ruta_catalogo_viaje"
+
+    numero = Column(String(64), primary_key=True)
+    ruta_id = Column(Integer, ForeignKey("ruta_catalogo.id"), nullable=False, index=True)
+    visto_en = Column(TIMESTAMP, default=datetime.utcnow)
+    # La ruta puede ser nueva en el mismo lote: el flush ordena los inserts
+    ruta = relationship("RutaCatalogo")
+
+
+class RutaCatalogoSync(Base):
+    """Ultima sincronizacion con la API por alcance de consulta (cliente|ciudad|ruta|via)."""
+    __tablename__ = "ruta_catalogo_sync"
+
+    alcance = Column(String(255), primary_key=True)
+    sincronizado_en = Column(TIMESTAMP, default=datetime.utcnow)
+    rutas = Column(Integer, default=0)
+
+
+# ---- Carga de trabajo por recurso (para dias consecutivos y rotacion) ----
+
+class CargaRecurso(Base):
+    """
+    Contadores por vehiculo o persona, actualizados al confirmar viajes: ultimo
+    dia trabajado, racha de dias consecutivos hasta ese dia y viajes en la
+    semana (lunes) de ese dia.
+    """
+    __tablename__ = "carga_recurso"
+
+    clase = Column(String(10), primary_key=True)  # vehiculo | persona
+    recurso_id = Column(String(50), primary_key=True)
+    ultima_fecha = Column(Date, nullable=True)
+    racha = Column(Integer, default=0)
+    semana = Column(Date, nullable=True)
+    viajes_semana = Column(Integer, default=0)
+    viajes_total = Column(Integer, default=0)
+    updated_at = Column(TIMESTAMP, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
+# ---- Cola local de jobs (app/jobs.py) ----
+
+class Trabajo(Base):
+    """Job de scheduling/persistencia: parametros y resultado como JSON."""
+    __tablename__ = "trabajos"
+    __table_args__ = (
+        # Los workers toman el pendiente mas viejo; la limpieza busca por estado y fecha
+        Index("ix_trabajos_estado_creado", "estado", "creado_en"),
+    )
+
+    id = Column(String(32), primary_key=True)  # uuid hex
+    tipo = Column(String(40), nullable=False)
+    estado = Column(String(20), nullable=False, default="pendiente")  # pendiente, en_curso, completado, error
+    parametros = Column(Text, nullable=False)
+    # Un lote de un mes pasa de los 64 KB de TEXT en MySQL
+    resultado = Column(Text().with_variant(LONGTEXT(), "mysql"), nullable=True)
+    codigo_http = Column(Integer, nullable=True)  # status que habria respondido el endpoint
+    error = Column(Text, nullable=True)
+    intentos = Column(Integer, default=0)
+    worker = Column(String(64), nullable=True)
+    creado_en = Column(TIMESTAMP, default=datetime.utcnow)
+    iniciado_en = Column(TIMESTAMP, nullable=True)
+    latido_en = Column(TIMESTAMP, nullable=True)  # el worker lo renueva mientras el job corre
+    terminado_en = Column(TIMESTAMP, nullable=True)
@@ -0,0 +1,214 @@
+"""
+Refresco de cache CloudFleet como job en segundo plano.
+
+- Un solo refresh a la vez entre workers: lock de archivo (fcntl) en .cache.
+- El estado de cada job se guarda como JSON en .cache/refresh_jobs/<job_id>.json
+  para que cualquier worker pueda responder GET /api/cache/refresh/{job_id}.
+- El progreso (paginas, registros, ETA, errores) llega desde el callback
+  on_page de cloudfleet._get_paginated.
+"""
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from datetime import datetime
+from typing import Any, Optional
+
+from app import cloudfleet, eventos
+from app.upstream import en_segundo_plano
+
+try:
+    import fcntl
+except ImportError:
+    # Windows: sin lock entre procesos, solo dentro del proceso
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# Cuantos estados de jobs terminados se conservan en disco
+MAX_JOBS_GUARDADOS = int(os.getenv("REFRESH_JOBS_RETENCION", "20"))
+
+_LOCK_LOCAL = threading.Lock()
+
+
+def _dir_jobs() -> str:
+    path = os.path.join(cloudfleet.CACHE_DIR, "refresh_jobs")
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def _ruta_estado(job_id: str) -> str:
+    return os.path.join(_dir_jobs(), f"{job_id}.json")
+
+
+def _guardar_estado(estado: dict[str, Any]) -> None:
+    path = _ruta_estado(estado["job_id"])
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(estado, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+def obtener_estado(job_id: str) -> Optional[dict[str, Any]]:
+    """Estado del job o None si no existe (ids con caracteres raros incluidos)."""
+    if not job_id or not all(c.isalnum() or c == "-" for c in job_id):
+        return None
+    try:
+        with open(_ruta_estado(job_id), encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _limpiar_jobs_antiguos() -> None:
+    try:
+        archivos = [
+            os.path.join(_dir_jobs(), n) for n in os.listdir(_dir_jobs()) if n.endswith(".json")
+        ]
+        archivos.sort(key=os.path.getmtime, reverse=True)
+        for path in archivos[MAX_JOBS_GUARDADOS:]:
+            os.remove(path)
+    except OSError as e:
+        logger.warning(f"No se pudieron limpiar jobs antiguos: {e}")
+
+
+def _paginas_estimadas() -> dict[str, Optional[int]]:
+    """Paginas esperadas por snapshot segun el tamano del snapshot vigente."""
+    estimadas: dict[str, Optional[int]] = {}
+    for name in cloudfleet.SNAPSHOTS:
+        try:
+            with open(cloudfleet._get_cache_path(name), encoding="utf-8") as f:
+                total = len(json.load(f))
+            estimadas[name] = total // cloudfleet.PAGE_SIZE + 1
+        except (OSError, ValueError):
+            estimadas[name] = None
+    return estimadas
+
+
+class _ProgresoRefresh:
+    """Acumula el progreso de un job y lo persiste tras cada pagina."""
+
+    def __init__(self, estado: dict[str, Any]):
+        self.estado = estado
+        self.inicio = time.time()
+
+    def __call__(self, snapshot: str, pagina: int, registros: int, error: Optional[str]) -> None:
+        snap = self.estado["snapshots"][snapshot]
+        snap["paginas"] = max(snap["paginas"], pagina)
+        snap["registros"] = registros
+        if error:
+            self.estado["errores"].append(error)
+        self.estado["paginas"] = sum(s["paginas"] for s in self.estado["snapshots"].values())
+        self.estado["registros"] = sum(s["registros"] for s in self.estado["snapshots"].values())
+        self.estado["eta_segundos"] = self._eta()
+        _guardar_estado(self.estado)
+
+    def _eta(self) -> Optional[float]:
+        snapshots = self.estado["snapshots"].values()
+        if any(s["paginas_estimadas"] is None for s in snapshots) or not self.estado["paginas"]:
+            return None
+        total = sum(s["paginas_estimadas"] for s in snapshots)
+        restantes = max(total - self.estado["paginas"], 0)
+        por_pagina = (time.time() - self.inicio) / self.estado["paginas"]
+        return round(restantes * por_pagina, 1)
+
+
+def _ejecutar(estado: dict[str, Any], lock_fd) -> None:
+    progreso = _ProgresoRefresh(estado)
+    try:
+        # El hilo no hereda el contexto de la request: la clase se fija aqui
+        with en_segundo_plano():
+            totales = cloudfleet.refresh_all_cache(on_page=progreso)
+        estado["estado"] = "completado"
+        estado["registros_por_snapshot"] = totales
+        eventos.publicar(eventos.SNAPSHOT, {"job_id": estado["job_id"], "registros": totales})
+    except Exception as e:
+        logger.error(f"Refresh {estado['job_id']} fallo: {e}")
+        estado["estado"] = "error"
+        estado["errores"].append(str(e))
+    finally:
+        estado["fin"] = datetime.now().isoformat()
+        estado["eta_segundos"] = 0 if estado["estado"] == "completado" else None
+        _guardar_estado(estado)
+        _liberar_lock(lock_fd)
+        _limpiar_jobs_antiguos()
+
+
+def _tomar_lock():
+    """Intenta tomar el lock de refresh sin bloquear. Retorna el fd o None."""
+    if not _LOCK_LOCAL.acquire(blocking=False):
+        return None
+    if fcntl is None:
+        return -1
+    path = os.path.join(cloudfleet.CACHE_DIR, "refresh.lock")
+    os.makedirs(cloudfleet.CACHE_DIR, exist_ok=True)
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        os.close(fd)
+        _LOCK_LOCAL.release()
+        return None
+    return fd
+
+
+def _liberar_lock(fd) -> None:
+    if fd is not None and fd >= 0:
+        fcntl.flock(fd, fcntl.LOCK_UN)
+        os.close(fd)
+    _LOCK_LOCAL.release()
+
+
+def _job_en_curso() -> Optional[dict[str, Any]]:
+    try:
+        with open(os.path.join(cloudfleet.CACHE_DIR, "refresh.lock"), encoding="utf-8") as f:
+            return obtener_estado(f.read().strip())
+    except OSError:
+        return None
+
+
+def iniciar_refresh() -> tuple[dict[str, Any], bool]:
+    """
+    Lanza un refresh en segundo plano.
+    Retorna (estado, creado); si ya hay uno corriendo retorna su estado y False.
+    """
+    lock_fd = _tomar_lock()
+    if lock_fd is None:
+        en_curso = _job_en_curso()
+        return en_curso or {"job_id": None, "estado": "en_curso"}, False
+
+    # Un job anterior que quedo "en_curso" murio con su worker (el lock estaba libre)
+    anterior = _job_en_curso()
+    if anterior and anterior.get("estado") == "en_curso":
+        anterior["estado"] = "interrumpido"
+        anterior["fin"] = anterior.get("fin") or datetime.now().isoformat()
+        _guardar_estado(anterior)
+
+    estimadas = _paginas_estimadas()
+    estado: dict[str, Any] = {
+        "job_id": uuid.uuid4().hex,
+        "estado": "en_curso",
+        "inicio": datetime.now().isoformat(),
+        "fin": None,
+        "paginas": 0,
+        "registros": 0,
+        "eta_segundos": None,
+        "errores": [],
+        "snapshots": {
+            name: {"paginas": 0, "registros": 0, "paginas_estimadas": estimadas[name]}
+            for name in cloudfleet.SNAPSHOTS
+        },
+    }
+    try:
+        _guardar_estado(estado)
+        with open(os.path.join(cloudfleet.CACHE_DIR, "refresh.lock"), "w", encoding="utf-8") as f:
+            f.write(estado["job_id"])
+        threading.Thread(
+            target=_ejecutar, args=(estado, lock_fd), name=f"refresh-{estado['job_id'][:8]}", daemon=True
+        ).start()
+    except Exception:
+        _liberar_lock(lock_fd)
+        raise
+    return estado, True
@@ -0,0 +1,537 @@
+"""
+Catalogo persistente de rutas (con sus vias) derivado de /routes y /travels.
+
+Antes /rutas y /rutas_v2 reconstruian las rutas en cada request a partir de la
+API y las descartaban. Ahora cada consulta en vivo alimenta el catalogo de forma
+incremental (upsert por cliente/codigo/origen/destino) y las siguientes
+consultas se responden desde la base:
+
+- registrar(): upsert de entradas ya parseadas por main (rutas o viajes). Los
+  viajes se cuentan una sola vez por numero (trip_count y last_seen por ruta y
+  por via), aunque el mismo viaje llegue en varias sincronizaciones.
+- consultar(): rutas del catalogo filtradas por cliente, ciudad y codigo
+  (por contencion, como el filtro de /routes).
+- Alcances: cada combinacion de filtros (cliente|ciudad|ruta|via) guarda cuando
+  se sincronizo con la API. Si vencio (RUTAS_CATALOGO_TTL_SEG) el catalogo
+  responde igual y se re-sincroniza en segundo plano; la API en vivo solo se
+  consulta de forma sincronica para alcances que nunca se sincronizaron.
+- candidatas(): rutas para programar una sede, por ciudad de origen y uso
+  historico (trip_count), memorizadas por (cliente, ciudad) hasta el proximo
+  registrar() o RUTAS_CANDIDATAS_TTL_SEG. repartir() distribuye los cupos de un
+  dia entre ellas en proporcion al uso.
+
+Si la base no responde el catalogo se desactiva un rato y main vuelve al
+camino en vivo de siempre.
+"""
+import heapq
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Any, Callable, Iterable, Optional
+
+from sqlalchemy import func, or_
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
+from sqlalchemy.orm import selectinload
+
+from app.database import SessionLocal
+from app.models import RutaCatalogo, RutaCatalogoSync, RutaCatalogoVia, RutaCatalogoViaje
+from app.snapshots import normalizar
+from app.upstream import en_segundo_plano
+
+logger = logging.getLogger(__name__)
+
+RUTAS_CATALOGO_TTL_SEG = int(os.getenv("RUTAS_CATALOGO_TTL_SEG", "900"))
+RUTAS_CANDIDATAS_TTL_SEG = int(os.getenv("RUTAS_CANDIDATAS_TTL_SEG", "300"))
+# Segundos sin usar el catalogo tras un error de base de datos
+_PAUSA_ERROR_SEG = 60
+
+_deshabilitado_hasta = 0.0
+_SYNC_EN_CURSO: set[str] = set()
+_SYNC_LOCK = threading.Lock()
+# Serializa los upserts del proceso (sqlite no admite escrituras concurrentes)
+_ESCRITURA_LOCK = threading.Lock()
+
+# Candidatas por (cliente, ciudad): (version del catalogo, vence, filas)
+_CANDIDATAS: dict[tuple[str, str], tuple[int, float, list[dict[str, Any]]]] = {}
+_CANDIDATAS_LOCK = threading.Lock()
+# Sube con cada registrar() confirmado: invalida las candidatas memorizadas
+_version = 0
+
+
+def disponible() -> bool:
+    return time.monotonic() >= _deshabilitado_hasta
+
+
+def _fallo(e: Exception) -> None:
+    global _deshabilitado_hasta
+    _deshabilitado_hasta = time.monotonic() + _PAUSA_ERROR_SEG
+    logger.warning(f"Catalogo de rutas no disponible por {_PAUSA_ERROR_SEG}s: {e}")
+
+
+def alcance(cliente_id: Optional[str], ciudad: Optional[str], route_code: Optional[str],
+            via_code: Optional[str]) -> str:
+    return "|".join((
+        str(cliente_id or ""), normalizar(ciudad), (route_code or "").upper(), (via_code or "").upper(),
+    ))[:255]
+
+
+def _fecha(valor: Any) -> datetime:
+    if isinstance(valor, str) and valor:
+        try:
+            return datetime.fromisoformat(valor.replace("Z", "+00:00")).replace(tzinfo=None)
+        except ValueError:
+            pass
+    return datetime.utcnow()
+
+
+def _clave(entrada: dict[str, Any]) -> tuple[str, str, str, str]:
+    return (
+        str(entrada.get("cliente_id") or ""),
+        str(entrada["codigo"])[:80],
+        str(entrada.get("origen") or "")[:150],
+        str(entrada.get("destino") or "")[:150],
+    )
+
+
+def _dump(valor: Any) -> Optional[str]:
+    if not valor:
+        return None
+    return json.dumps(valor, ensure_ascii=False, default=str)
+
+
+def _actualizar_vias(ruta: RutaCatalogo, vias: list[dict[str, Any]], visto: datetime, cuenta: int) -> None:
+    existentes = {(v.codigo, v.nombre): v for v in ruta.vias}
+    for via in vias:
+        clave = (str(via.get("code") or "")[:80], str(via.get("name") or "")[:150])
+        if clave == ("", ""):
+            continue
+        fila = existentes.get(clave)
+        if fila is None:
+            fila = RutaCatalogoVia(codigo=clave[0], nombre=clave[1], datos=_dump(via.get("raw")),
+                                   trip_count=0, last_seen=visto)
+            ruta.vias.append(fila)
+            existentes[clave] = fila
+        fila.trip_count = (fila.trip_count or 0) + cuenta
+        if not fila.last_seen or visto > fila.last_seen:
+            fila.last_seen = visto
+
+
+def _aplicar(db, e: dict[str, Any], filas: dict[tuple, RutaCatalogo], contados: set[str]) -> int:
+    """Upsert de una entrada en la sesion; retorna 1 si creo la ruta."""
+    clave = _clave(e)
+    numero = str(e["numero_viaje"]) if e.get("numero_viaje") else None
+    cuenta = 1 if numero and numero not in contados else 0
+    visto = _fecha(e.get("visto"))
+    fuente = e.get("fuente") or "routes"
+    nueva = 0
+    ruta = filas.get(clave)
+    if ruta is None:
+        ruta = RutaCatalogo(
+            cliente_id=clave[0], codigo=clave[1], codigo_norm=codigo_norm(clave[1]), origen=clave[2],
+            destino=clave[3], origen_norm=normalizar(clave[2]), destino_norm=normalizar(clave[3]),
+            ciudad_norm=normalizar(e.get("ciudad")), fuente=fuente, trip_count=0,
+            last_seen=visto, ref_id=str(e.get("ref_id") or "")[:64] or None,
+        )
+        db.add(ruta)
+        filas[clave] = ruta
+        nueva = 1
+    # Los datos de /routes mandan sobre los que se deducen de un viaje
+    if fuente == "routes" or ruta.fuente != "routes":
+        ruta.fuente = fuente
+        ruta.nombre = str(e.get("nombre") or clave[1])[:200]
+        ruta.sede_id = str(e.get("sede_id") or "")[:64] or ruta.sede_id
+        ruta.distancia_km = e.get("distancia_km") if e.get("distancia_km") is not None else ruta.distancia_km
+        ruta.activa = bool(e.get("activa", True))
+        ruta.datos = _dump(e.get("datos")) or ruta.datos
+        if fuente == "routes" and e.get("ref_id"):
+            ruta.ref_id = str(e["ref_id"])[:64]
+    if e.get("ciudad") and not ruta.ciudad_norm:
+        ruta.ciudad_norm = normalizar(e.get("ciudad"))
+    if e.get("via_codigo") and (fuente == "routes" or not ruta.via_codigo):
+        ruta.via_codigo = str(e["via_codigo"])[:80]
+    ruta.trip_count = (ruta.trip_count or 0) + cuenta
+    if not ruta.last_seen or visto > ruta.last_seen:
+        ruta.last_seen = visto
+    _actualizar_vias(ruta, e.get("vias") or [], visto, cuenta)
+    if cuenta:
+        db.add(RutaCatalogoViaje(numero=numero[:64], ruta=ruta, visto_en=visto))
+        contados.add(numero)
+    return nueva
+
+
+def _upsert(entradas: list[dict[str, Any]], por_fila: bool) -> int:
+    """
+    Upsert del lote en una transaccion. Con por_fila cada entrada va en su
+    propio savepoint: si otro worker ya inserto esa ruta o ese viaje, se relee
+    su fila y se reintenta solo esa entrada, sin perder el resto del lote.
+    """
+    nuevas = 0
+    with _ESCRITURA_LOCK, SessionLocal() as db:
+        numeros = {str(e["numero_viaje"]) for e in entradas if e.get("numero_viaje")}
+        contados: set[str] = set()
+        if numeros:
+            contados = {
+                n for (n,) in db.query(RutaCatalogoViaje.numero).filter(RutaCatalogoViaje.numero.in_(numeros))
+            }
+        claves = [_clave(e) for e in entradas]
+        filas = {
+            (r.cliente_id, r.codigo, r.origen, r.destino): r
+            for r in db.query(RutaCatalogo).options(selectinload(RutaCatalogo.vias))
+            .filter(RutaCatalogo.cliente_id.in_({c[0] for c in claves}),
+                    RutaCatalogo.codigo.in_({c[1] for c in claves}))
+        }
+        for e, clave in zip(entradas, claves):
+            if not por_fila:
+                nuevas += _aplicar(db, e, filas, contados)
+                continue
+            for intento in range(2):
+                try:
+                    with db.begin_nested():
+                        creada = _aplicar(db, e, filas, contados)
+                    nuevas += creada
+                    break
+                except IntegrityError as error:
+                    # El savepoint descarta la fila pendiente: se usa la que ya esta en la base
+                    filas.pop(clave, None)
+                    if e.get("numero_viaje"):
+                        contados.discard(str(e["numero_viaje"]))
+                        if db.get(RutaCatalogoViaje, str(e["numero_viaje"])[:64]) is not None:
+                            contados.add(str(e["numero_viaje"]))
+                    existente = db.query(RutaCatalogo).filter_by(
+                        cliente_id=clave[0], codigo=clave[1], origen=clave[2], destino=clave[3],
+                    ).first()
+                    if existente is not None:
+                        filas[clave] = existente
+                    if intento:
+                        logger.info(f"Ruta {clave[1]!r} en conflicto, se omite: {error.orig}")
+        db.commit()
+    return nuevas
+
+
+def registrar(entradas: Iterable[dict[str, Any]]) -> int:
+    """
+    Upsert de entradas en el catalogo. Cada entrada es un dict con codigo,
+    nombre, cliente_id, origen, destino, ciudad, ref_id, sede_id, distancia_km,
+    activa, via_codigo, vias ([{code, name, raw}]), datos (registro crudo),
+    fuente ("routes" o "travels") y, si viene de un viaje, numero_viaje y visto.
+    Retorna cuantas rutas nuevas se crearon.
+    """
+    entradas = [e for e in entradas if e.get("codigo")]
+    if not entradas or not disponible():
+        return 0
+    try:
+        try:
+            nuevas = _upsert(entradas, por_fila=False)
+        except IntegrityError as e:
+            # Otro worker inserto alguna de las mismas rutas/viajes en el medio
+            logger.info(f"Upsert de catalogo de rutas en conflicto, se reintenta por fila: {e.orig}")
+            nuevas = _upsert(entradas, por_fila=True)
+        _invalidar_candidatas()
+    except SQLAlchemyError as e:
+        _fallo(e)
+        return 0
+    return nuevas
+
+
+def codigo_norm(codigo: Any) -> str:
+    return str(codigo or "").strip().upper()[:80]
+
+
+def migrar() -> None:
+    """Completa codigo_norm en filas creadas antes de que existiera la columna."""
+    with _ESCRITURA_LOCK, SessionLocal() as db:
+        pendientes = db.query(RutaCatalogo.id, RutaCatalogo.codigo).filter(RutaCatalogo.codigo_norm.is_(None)).all()
+        for ruta_id, codigo in pendientes:
+            db.query(RutaCatalogo).filter(RutaCatalogo.id == ruta_id).update(
+                {RutaCatalogo.codigo_norm: codigo_norm(codigo)}, synchronize_session=False,
+            )
+        db.commit()
+
+
+def _a_dict(ruta: RutaCatalogo) -> dict[str, Any]:
+    return {
+        "id": ruta.id,
+        "ref_id": ruta.ref_id,
+        "cliente_id": ruta.cliente_id,
+        "sede_id": ruta.sede_id,
+        "codigo": ruta.codigo,
+        "nombre": ruta.nombre,
+        "origen": ruta.origen,
+        "destino": ruta.destino,
+        "distancia_km": ruta.distancia_km,
+        "activa": ruta.activa,
+        "via_codigo": ruta.via_codigo,
+        "fuente": ruta.fuente,
+        "trip_count": ruta.trip_count or 0,
+        "last_seen": ruta.last_seen.isoformat() if ruta.last_seen else None,
+        "datos": json.loads(ruta.datos) if ruta.datos else None,
+        "vias": [
+            {
+                "code": v.codigo or None,
+                "name": v.nombre or None,
+                "raw": json.loads(v.datos) if v.datos else {},
+                "trip_count": v.trip_count or 0,
+            }
+            for v in ruta.vias
+        ],
+    }
+
+
+def _filtrar(q, cliente_id: Optional[str], ciudad: Optional[str], route_code: Optional[str],
+             filtrar_ciudad: bool):
+    """
+    Contencion sin importar mayusculas ni acentos, como el filtro de /routes:
+    codigo dentro de codigo_norm y ciudad dentro de origen/destino/ciudad
+    normalizados ("cali" tambien trae "Cali (Valle)"). El indice por cliente
+    acota las filas que se recorren.
+    """
+    if cliente_id:
+        q = q.filter(RutaCatalogo.cliente_id == str(cliente_id))
+    codigo = codigo_norm(route_code)
+    if codigo:
+        q = q.filter(RutaCatalogo.codigo_norm.contains(codigo, autoescape=True))
+    ciudad_norm = normalizar(ciudad)
+    if ciudad_norm and filtrar_ciudad:
+        columnas = (RutaCatalogo.origen_norm, RutaCatalogo.destino_norm, RutaCatalogo.ciudad_norm)
+        q = q.filter(or_(*(c.contains(ciudad_norm, autoescape=True) for c in columnas)))
+    return q
+
+
+def iterar(
+    cliente_id: Optional[str] = None,
+    ciudad: Optional[str] = None,
+    route_code: Optional[str] = None,
+    filtrar_ciudad: bool = True,
+    desde_id: int = 0,
+    lote: int = 200,
+):
+    """
+    Las mismas filas que consultar(), desde el id `desde_id` y por lotes
+    (keyset sobre el id), sin materializar el listado ni dejar una sesion
+    abierta entre lotes. Lanza SQLAlchemyError si la base falla a la mitad.
+    """
+    ultimo = desde_id - 1
+    while True:
+        try:
+            with SessionLocal() as db:
+                q = _filtrar(
+                    db.query(RutaCatalogo).options(selectinload(RutaCatalogo.vias)),
+                    cliente_id, ciudad, route_code, filtrar_ciudad,
+                )
+                filas = [_a_dict(r) for r in q.filter(RutaCatalogo.id > ultimo).order_by(RutaCatalogo.id).limit(lote)]
+        except SQLAlchemyError as e:
+            _fallo(e)
+            raise
+        yield from filas
+        if len(filas) < lote:
+            return
+        ultimo = filas[-1]["id"]
+
+
+def version_consulta(
+    cliente_id: Optional[str] = None,
+    ciudad: Optional[str] = None,
+    route_code: Optional[str] = None,
+    filtrar_ciudad: bool = True,
+) -> Optional[tuple[int, str]]:
+    """
+    (rutas, version) de lo que devolveria consultar(). La version cambia con
+    cualquier alta o actualizacion de esas filas, aunque el total sea el mismo.
+    Retorna None si el catalogo no esta disponible.
+    """
+    if not disponible():
+        return None
+    try:
+        with SessionLocal() as db:
+            total, ultimo_id, actualizado = _filtrar(
+                db.query(func.count(RutaCatalogo.id), func.max(RutaCatalogo.id), func.max(RutaCatalogo.updated_at)),
+                cliente_id, ciudad, route_code, filtrar_ciudad,
+            ).one()
+            return total, f"{total}-{ultimo_id or 0}-{actualizado.isoformat() if actualizado else ''}"
+    except SQLAlchemyError as e:
+        _fallo(e)
+        return None
+
+
+def consultar(
+    cliente_id: Optional[str] = None,
+    ciudad: Optional[str] = None,
+    route_code: Optional[str] = None,
+    filtrar_ciudad: bool = True,
+) -> Optional[list[dict[str, Any]]]:
+    """
+    Rutas del catalogo (con vias) que cumplen los filtros (ver _filtrar), en
+    orden de alta. Retorna None si el catalogo no esta disponible.
+    """
+    if not disponible():
+        return None
+    try:
+        with SessionLocal() as db:
+            q = db.query(RutaCatalogo).options(selectinload(RutaCatalogo.vias)).order_by(RutaCatalogo.id)
+            filas = _filtrar(q, cliente_id, ciudad, route_code, filtrar_ciudad).all()
+            return [_a_dict(r) for r in filas]
+    except SQLAlchemyError as e:
+        _fallo(e)
+        return None
+
+
+def _invalidar_candidatas() -> None:
+    global _version
+    with _CANDIDATAS_LOCK:
+        _version += 1
+        _CANDIDATAS.clear()
+
+
+def candidatas(
+    cliente_id: Optional[str],
+    ciudad: Optional[str],
+    alias: Iterable[str] = (),
+) -> Optional[list[dict[str, Any]]]:
+    """
+    Rutas del cliente para programar viajes desde `ciudad` (o sus alias): las
+    que salen de esa ciudad o, si ninguna, todas las del cliente. Ordenadas
+    por uso historico (trip_count, luego orden de alta). Las rutas de /routes
+    marcadas inactivas se descartan; las deducidas de viajes se conservan
+    aunque el viaje haya terminado. Memorizadas por (cliente, ciudad).
+    Retorna None si el catalogo no esta disponible.
+    """
+    if not disponible():
+        return None
+    clave = (str(cliente_id or ""), normalizar(ciudad))
+    with _CANDIDATAS_LOCK:
+        entrada = _CANDIDATAS.get(clave)
+        if entrada is not None and entrada[0] == _version and time.monotonic() < entrada[1]:
+            return entrada[2]
+        version = _version
+    filas = consultar(cliente_id=cliente_id, filtrar_ciudad=False)
+    if filas is None:
+        return None
+    filas = [f for f in filas if f["activa"] or f["fuente"] != "routes"]
+    ciudades = [c for c in (clave[1], *(normalizar(a) for a in alias)) if c]
+    if ciudades:
+        en_ciudad = [f for f in filas if any(c in normalizar(f["origen"]) for c in ciudades)]
+        filas = en_ciudad or filas
+    # consultar() ya viene por id: el orden estable desempata (last_seen de
+    # /routes es solo la fecha de alta en el catalogo, no indica uso)
+    filas.sort(key=lambda f: -f["trip_count"])
+    with _CANDIDATAS_LOCK:
+        if version == _version:
+            _CANDIDATAS[clave] = (version, time.monotonic() + RUTAS_CANDIDATAS_TTL_SEG, filas)
+    return filas
+
+
+def repartir(usos: list[int], cupos: int) -> list[int]:
+    """
+    Indice de candidata para cada cupo, en proporcion al uso historico
+    (usos[j] + 1, asi las rutas sin viajes tambien entran). Cada cupo va a la
+    candidata con mayor uso / (asignados + 1), metodo D'Hondt: la mas usada
+    recibe el primero y ninguna acapara el dia. Los cupos salen agrupados por
+    candidata, en el orden de `usos`.
+    """
+    if not usos or cupos <= 0:
+        return []
+    asignados = [0] * len(usos)
+    cola = [(-(u + 1), j) for j, u in enumerate(usos)]
+    heapq.heapify(cola)
+    for _ in range(cupos):
+        _, j = heapq.heappop(cola)
+        asignados[j] += 1
+        heapq.heappush(cola, (-(usos[j] + 1) / (asignados[j] + 1), j))
+    return [j for j, n in enumerate(asignados) for _ in range(n)]
+
+
+def conteo_por_cliente() -> Optional[dict[str, dict[str, int]]]:
+    """Rutas del catalogo por cliente y ciudad de origen normalizada (una sola consulta agrupada)."""
+    if not disponible():
+        return None
+    try:
+        with SessionLocal() as db:
+            conteo: dict[str, dict[str, int]] = {}
+            filas = (
+                db.query(RutaCatalogo.cliente_id, RutaCatalogo.origen_norm, func.count(RutaCatalogo.id))
+                .group_by(RutaCatalogo.cliente_id, RutaCatalogo.origen_norm)
+            )
+            for cliente_id, origen_norm, n in filas:
+                conteo.setdefault(cliente_id or "", {})[origen_norm or ""] = n
+            return conteo
+    except SQLAlchemyError as e:
+        _fallo(e)
+        return None
+
+
+def ultima_sincronizacion(clave_alcance: str) -> Optional[datetime]:
+    if not disponible():
+        return None
+    try:
+        with SessionLocal() as db:
+            fila = db.get(RutaCatalogoSync, clave_alcance)
+            return fila.sincronizado_en if fila else None
+    except SQLAlchemyError as e:
+        _fallo(e)
+        return None
+
+
+def vigente(sincronizado_en: Optional[datetime]) -> bool:
+    return bool(sincronizado_en) and datetime.utcnow() - sincronizado_en < timedelta(seconds=RUTAS_CATALOGO_TTL_SEG)
+
+
+def marcar_sincronizado(clave_alcance: str, rutas: int) -> None:
+    if not disponible():
+        return
+    try:
+        with _ESCRITURA_LOCK, SessionLocal() as db:
+            fila = db.get(RutaCatalogoSync, clave_alcance)
+            if fila is None:
+                fila = RutaCatalogoSync(alcance=clave_alcance)
+                db.add(fila)
+            fila.sincronizado_en = datetime.utcnow()
+            fila.rutas = rutas
+            db.commit()
+    except SQLAlchemyError as e:
+        _fallo(e)
+
+
+def sincronizar_en_segundo_plano(clave_alcance: str, sincronizar: Callable[[], Any]) -> bool:
+    """
+    Corre `sincronizar` (la consulta en vivo, que alimenta el catalogo) en un
+    hilo con clase background. Un solo sync por alcance a la vez.
+    """
+    with _SYNC_LOCK:
+        if clave_alcance in _SYNC_EN_CURSO:
+            return False
+        _SYNC_EN_CURSO.add(clave_alcance)
+
+    def _correr():
+        try:
+            with en_segundo_plano():
+                sincronizar()
+        except Exception as e:
+            logger.warning(f"Sync de rutas {clave_alcance!r} fallo: {e}")
+        finally:
+            with _SYNC_LOCK:
+                _SYNC_EN_CURSO.discard(clave_alcance)
+
+    threading.Thread(target=_correr, name="rutas-catalogo-sync", daemon=True).start()
+    return True
+
+
+def estadisticas() -> dict[str, Any]:
+    if not disponible():
+        return {"disponible": False}
+    try:
+        with SessionLocal() as db:
+            return {
+                "disponible": True,
+                "rutas": db.query(RutaCatalogo).count(),
+                "vias": db.query(RutaCatalogoVia).count(),
+                "viajes_contados": db.query(RutaCatalogoViaje).count(),
+                "alcances": db.query(RutaCatalogoSync).count(),
+                "sync_en_curso": len(_SYNC_EN_CURSO),
+                "candidatas_memorizadas": len(_CANDIDATAS),
+            }
+    except SQLAlchemyError as e:
+        _fallo(e)
+        return {"disponible": False}
@@ -0,0 +1,179 @@
+"""
+Indices en memoria sobre los snapshots de CloudFleet (people_all / vehicles_all).
+
+Los snapshots son listas de dicts que cloudfleet._load_cache mantiene en memoria
+mientras el archivo no cambie, asi que se pueden indexar una sola vez por version
+en lugar de recorrerlos completos en cada request. Lo mismo con los conteos
+por cliente/ciudad del resumen operacional (Agregados).
+"""
+import threading
+import unicodedata
+from bisect import bisect_left
+from typing import Any, Optional
+
+
+def normalizar(texto: Any) -> str:
+    """Quita acentos y pasa a minusculas (igual que normalize_str de main)."""
+    if not texto:
+        return ""
+    return ''.join(c for c in unicodedata.normalize('NFD', str(texto)) if unicodedata.category(c) != 'Mn').lower()
+
+
+def ciudad_de(item: dict) -> str:
+    """Nombre de ciudad del registro (city puede venir como objeto o string)."""
+    city_obj = item.get("city")
+    return city_obj.get("name", "") if isinstance(city_obj, dict) else (city_obj or "")
+
+
+class IndiceCiudad:
+    """
+    Posiciones de cada registro agrupadas por ciudad normalizada.
+    Las posiciones se guardan ordenadas para poder retomar desde un cursor.
+    `repetidos` son las posiciones sin id o con un id que ya aparecio antes.
+    """
+
+    def __init__(self, registros: list[dict]):
+        self.total = len(registros)
+        self.por_ciudad: dict[str, list[int]] = {}
+        self.repetidos: set[int] = set()
+        vistos: set[Any] = set()
+        for pos, item in enumerate(registros):
+            self.por_ciudad.setdefault(normalizar(ciudad_de(item)), []).append(pos)
+            rid = item.get("id")
+            if not rid or rid in vistos:
+                self.repetidos.add(pos)
+            vistos.add(rid)
+
+    def posiciones(self, ciudad_norm: str = "", desde: int = 0) -> list[int] | range:
+        """
+        Posiciones (en orden) cuyo nombre de ciudad contiene `ciudad_norm`,
+        empezando en `desde`. Sin ciudad devuelve todo el rango.
+        """
+        if not ciudad_norm:
+            return range(desde, self.total)
+        claves = [k for k in self.por_ciudad if k and ciudad_norm in k]
+        if len(claves) == 1:
+            lista = self.por_ciudad[claves[0]]
+            return lista[bisect_left(lista, desde):]
+        return sorted(p for k in claves for p in self.por_ciudad[k] if p >= desde)
+
+
+# id(snapshot) -> (snapshot, indice). Guardamos la referencia para que el id no
+# se reutilice mientras la entrada exista.
+_INDICES: dict[int, tuple[list, IndiceCiudad]] = {}
+_INDICES_LOCK = threading.Lock()
+_MAX_INDICES = 8
+
+
+def indice_ciudad(registros: list[dict]) -> IndiceCiudad:
+    """Indice por ciudad del snapshot, construido una vez por lista."""
+    clave = id(registros)
+    entrada = _INDICES.get(clave)
+    if entrada and entrada[0] is registros and entrada[1].total == len(registros):
+        return entrada[1]
+    with _INDICES_LOCK:
+        entrada = _INDICES.get(clave)
+        if entrada and entrada[0] is registros and entrada[1].total == len(registros):
+            return entrada[1]
+        indice = IndiceCiudad(registros)
+        if len(_INDICES) >= _MAX_INDICES:
+            _INDICES.pop(next(iter(_INDICES)))
+        _INDICES[clave] = (registros, indice)
+        return indice
+
+
+# ---- Agregados por cliente/ciudad para el resumen operacional ----
+
+# positionType de CloudFleet que habilitan para conducir
+POSITION_TYPES_CONDUCTOR = {"driver", "mechanicanddriver"}
+
+
+def position_type_de(item: dict) -> str:
+    pt = item.get("positionType")
+    return (pt.get("name") if isinstance(pt, dict) else pt) or ""
+
+
+def rol_de(item: dict) -> str:
+    """
+    conductores / auxiliares / otros. CloudFleet no tiene positionType de
+    auxiliar (suelen venir como driver u other), asi que el cargo manda para
+    auxiliares y positionType para conductores.
+    """
+    cargo = normalizar(item.get("position"))
+    if "auxiliar" in cargo:
+        return "auxiliares"
+    if position_type_de(item).lower() in POSITION_TYPES_CONDUCTOR or "conductor" in cargo:
+        return "conductores"
+    return "otros"
+
+
+def centro_costo_de(item: dict) -> str:
+    """Nombre normalizado del centro de costo (los vehiculos no traen customerId)."""
+    cc = item.get("costCenter")
+    return normalizar(cc.get("name") if isinstance(cc, dict) else cc)
+
+
+class Agregados:
+    """
+    Conteos precalculados al cargar los snapshots:
+    - vehiculos por centro de costo y ciudad: total y activos.
+    - personal por ciudad: total, activos, conductores/auxiliares/otros y por positionType.
+    Las claves son textos normalizados (ver normalizar).
+    """
+
+    def __init__(self, vehiculos: list[dict], personas: list[dict]):
+        # centro de costo -> ciudad -> conteos
+        self.vehiculos: dict[str, dict[str, dict[str, int]]] = {}
+        for item in vehiculos:
+            c = self.vehiculos.setdefault(centro_costo_de(item), {}).setdefault(
+                normalizar(ciudad_de(item)), {"vehiculos": 0, "vehiculos_activos": 0}
+            )
+            c["vehiculos"] += 1
+            # Los vehiculos del snapshot no traen estado: activo salvo que diga lo contrario
+            if item.get("active", item.get("isActive", True)) is not False:
+                c["vehiculos_activos"] += 1
+
+        self.personal: dict[str, dict[str, Any]] = {}
+        for item in personas:
+            c = self.personal.setdefault(normalizar(ciudad_de(item)), {
+                "personal": 0, "personal_activo": 0, "conductores": 0, "auxiliares": 0, "otros": 0,
+                "por_position_type": {},
+            })
+            c["personal"] += 1
+            if item.get("isActive", item.get("active", True)) is not False:
+                c["personal_activo"] += 1
+            c[rol_de(item)] += 1
+            pt = position_type_de(item) or "sin_tipo"
+            c["por_position_type"][pt] = c["por_position_type"].get(pt, 0) + 1
+
+    def vehiculos_de(self, centros: set[str]) -> dict[str, dict[str, int]]:
+        """Conteos de vehiculos por ciudad para los centros de costo dados."""
+        por_ciudad: dict[str, dict[str, int]] = {}
+        for centro in centros:
+            for ciudad, c in self.vehiculos.get(centro, {}).items():
+                destino = por_ciudad.setdefault(ciudad, {"vehiculos": 0, "vehiculos_activos": 0})
+                destino["vehiculos"] += c["vehiculos"]
+                destino["vehiculos_activos"] += c["vehiculos_activos"]
+        return por_ciudad
+
+    def personal_de(self, ciudad_norm: str) -> Optional[dict[str, Any]]:
+        return self.personal.get(ciudad_norm)
+
+
+_AGREGADOS: Optional[tuple[list, list, Agregados]] = None
+_AGREGADOS_LOCK = threading.Lock()
+
+
+def agregados(vehiculos: list[dict], personas: list[dict]) -> Agregados:
+    """Agregados de la version actual de ambos snapshots, calculados una vez por par de listas."""
+    global _AGREGADOS
+    entrada = _AGREGADOS
+    if entrada and entrada[0] is vehiculos and entrada[1] is personas:
+        return entrada[2]
+    with _AGREGADOS_LOCK:
+        entrada = _AGREGADOS
+        if entrada and entrada[0] is vehiculos and entrada[1] is personas:
+            return entrada[2]
+        resultado = Agregados(vehiculos, personas)
+        _AGREGADOS = (vehiculos, personas, resultado)
+        return resultado
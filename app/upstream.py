@@ -0,0 +1,230 @@
+"""
+Planificador de requests hacia CloudFleet con prioridades.
+
+CloudFleet permite ~30 req/min para todo el token. Antes cada llamada dormia
+RATE_LIMIT_DELAY por su cuenta, asi que un click del planificador podia quedar
+detras de 40 paginas de un refresh. Ahora todas las requests pasan por un token
+bucket compartido con dos clases:
+
+- "interactive" (por defecto): requests de usuarios. Toman token en cuanto hay.
+- "background": refresh de snapshots, warmup y fallbacks amplios de /travels.
+  Solo usan cuota sobrante: esperan mientras haya requests interactivas en cola
+  y dejan siempre UPSTREAM_RESERVA_INTERACTIVA tokens para el trafico interactivo.
+
+La clase se toma de un contextvar (ver en_segundo_plano). Los hilos nuevos no
+heredan el contexto, por eso los jobs en background lo fijan dentro del hilo.
+El limite es por proceso: con varios workers, repartir CLOUDFLEET_RPM entre ellos.
+
+Ademas cada request puede traer un plazo (Plazo, en el contextvar plazo_actual):
+el planificador no espera mas alla del plazo y el paginador corta devolviendo
+lo recopilado, marcando el plazo como parcial. Para que los hilos de un
+ThreadPoolExecutor vean el plazo hay que enviar las tareas con enviar().
+"""
+import contextlib
+import contextvars
+import os
+import threading
+import time
+from typing import Any, Optional
+
+INTERACTIVA = "interactive"
+BACKGROUND = "background"
+CLASES = (INTERACTIVA, BACKGROUND)
+
+CLOUDFLEET_RPM = float(os.getenv("CLOUDFLEET_RPM", "30"))
+# Rafaga maxima (tokens acumulables) y cuantos de ellos quedan reservados a interactivas
+UPSTREAM_RAFAGA = float(os.getenv("UPSTREAM_RAFAGA", "5"))
+UPSTREAM_RESERVA_INTERACTIVA = float(os.getenv("UPSTREAM_RESERVA_INTERACTIVA", "2"))
+
+clase_actual: contextvars.ContextVar[str] = contextvars.ContextVar("upstream_clase", default=INTERACTIVA)
+
+
+class PlazoVencido(TimeoutError):
+    """El plazo de la request vencio (o el cliente se desconecto)."""
+
+
+class Plazo:
+    """
+    Plazo de una request. Es un objeto mutable: las copias del contexto que
+    llegan a otros hilos comparten la misma instancia, asi que la marca de
+    resultado parcial se ve desde el middleware que creo el plazo.
+    Sin segundos no vence por tiempo: solo lo corta cancelar() (cliente
+    desconectado).
+    """
+
+    def __init__(self, segundos: Optional[float]):
+        self.vence = time.monotonic() + segundos if segundos is not None else float("inf")
+        self.cancelado = threading.Event()
+        self.motivo: Optional[str] = None
+        self.parciales = 0
+
+    def restante(self) -> float:
+        if self.cancelado.is_set():
+            return 0.0
+        return max(self.vence - time.monotonic(), 0.0)
+
+    def vencido(self) -> bool:
+        return self.restante() <= 0
+
+    def cancelar(self, motivo: str) -> None:
+        self.motivo = self.motivo or motivo
+        self.cancelado.set()
+
+    def marcar_parcial(self) -> None:
+        self.motivo = self.motivo or ("client-disconnected" if self.cancelado.is_set() else "deadline")
+        self.parciales += 1
+
+    @property
+    def parcial(self) -> bool:
+        return self.parciales > 0
+
+
+plazo_actual: contextvars.ContextVar[Optional[Plazo]] = contextvars.ContextVar("upstream_plazo", default=None)
+
+
+def plazo_vencido() -> bool:
+    plazo = plazo_actual.get()
+    return bool(plazo and plazo.vencido())
+
+
+def marcar_parcial() -> None:
+    plazo = plazo_actual.get()
+    if plazo:
+        plazo.marcar_parcial()
+
+
+def marca_parcial() -> int:
+    """Contador de cortes del plazo actual; si cambia durante una llamada, su resultado es parcial."""
+    plazo = plazo_actual.get()
+    return plazo.parciales if plazo else 0
+
+
+def timeout_request(maximo: float) -> float:
+    """Timeout de requests.get acotado por el plazo restante."""
+    plazo = plazo_actual.get()
+    if not plazo:
+        return maximo
+    return max(min(maximo, plazo.restante()), 0.5)
+
+
+def enviar(executor, fn, *args, **kwargs):
+    """executor.submit propagando el contexto (plazo y clase) al hilo del pool."""
+    return executor.submit(contextvars.copy_context().run, fn, *args, **kwargs)
+
+
+@contextlib.contextmanager
+def en_segundo_plano():
+    """Marca las requests hechas dentro del bloque como background."""
+    token = clase_actual.set(BACKGROUND)
+    try:
+        yield
+    finally:
+        clase_actual.reset(token)
+
+
+class Planificador:
+    """Token bucket con prioridad interactiva sobre background."""
+
+    def __init__(self, rpm: float = CLOUDFLEET_RPM, rafaga: float = UPSTREAM_RAFAGA,
+                 reserva: float = UPSTREAM_RESERVA_INTERACTIVA):
+        self._cond = threading.Condition()
+        self.configurar(rpm, rafaga, reserva)
+        self._tokens = self.rafaga
+        self._ultimo = time.monotonic()
+        self._pausa_hasta = 0.0
+        self._esperando = {c: 0 for c in CLASES}
+        self._metricas = {
+            c: {"requests": 0, "espera_total_seg": 0.0, "espera_max_seg": 0.0}
+            for c in CLASES
+        }
+        self._penalizaciones = 0
+
+    def configurar(self, rpm: float, rafaga: Optional[float] = None, reserva: Optional[float] = None) -> None:
+        with self._cond:
+            self.tasa = max(rpm, 0.001) / 60.0
+            if rafaga is not None:
+                self.rafaga = max(rafaga, 1.0)
+            if reserva is not None:
+                # La reserva nunca puede dejar a background sin ningun token
+                self.reserva = min(max(reserva, 0.0), self.rafaga - 1)
+            self._cond.notify_all()
+
+    def _recargar(self, ahora: float) -> None:
+        self._tokens = min(self.rafaga, self._tokens + (ahora - self._ultimo) * self.tasa)
+        self._ultimo = ahora
+
+    def _umbral(self, clase: str) -> float:
+        return 1.0 if clase == INTERACTIVA else 1.0 + self.reserva
+
+    def adquirir(self, clase: Optional[str] = None) -> float:
+        """
+        Bloquea hasta obtener permiso para una request. Retorna los segundos de espera.
+        Lanza PlazoVencido si el token no llega antes del plazo de la request.
+        """
+        clase = clase or clase_actual.get()
+        plazo = plazo_actual.get()
+        inicio = time.monotonic()
+        with self._cond:
+            self._esperando[clase] += 1
+            try:
+                while True:
+                    ahora = time.monotonic()
+                    self._recargar(ahora)
+                    bloqueada = clase == BACKGROUND and self._esperando[INTERACTIVA] > 0
+                    if ahora >= self._pausa_hasta and not bloqueada and self._tokens >= self._umbral(clase):
+                        self._tokens -= 1
+                        break
+                    if ahora < self._pausa_hasta:
+                        espera = self._pausa_hasta - ahora
+                    elif bloqueada:
+                        espera = 1.0  # se despierta con notify_all al salir la interactiva
+                    else:
+                        espera = (self._umbral(clase) - self._tokens) / self.tasa
+                    if plazo:
+                        if plazo.vencido() or (not bloqueada and espera > plazo.restante()):
+                            raise PlazoVencido("Plazo de la request agotado esperando cuota de CloudFleet")
+                        espera = min(espera, plazo.restante())
+                    self._cond.wait(timeout=max(espera, 0.005))
+            finally:
+                self._esperando[clase] -= 1
+                self._cond.notify_all()
+            esperado = time.monotonic() - inicio
+            m = self._metricas[clase]
+            m["requests"] += 1
+            m["espera_total_seg"] += esperado
+            m["espera_max_seg"] = max(m["espera_max_seg"], esperado)
+        return esperado
+
+    def penalizar(self, segundos: float) -> None:
+        """Tras un 429 nadie vuelve a llamar a CloudFleet hasta pasado `segundos`."""
+        with self._cond:
+            self._pausa_hasta = max(self._pausa_hasta, time.monotonic() + segundos)
+            self._tokens = min(self._tokens, 0.0)
+            self._penalizaciones += 1
+            self._cond.notify_all()
+
+    def metricas(self) -> dict[str, Any]:
+        with self._cond:
+            self._recargar(time.monotonic())
+            clases = {}
+            for c in CLASES:
+                m = self._metricas[c]
+                clases[c] = {
+                    "requests": m["requests"],
+                    "en_cola": self._esperando[c],
+                    "espera_total_seg": round(m["espera_total_seg"], 2),
+                    "espera_promedio_seg": round(m["espera_total_seg"] / m["requests"], 3) if m["requests"] else 0.0,
+                    "espera_max_seg": round(m["espera_max_seg"], 2),
+                }
+            return {
+                "rpm": round(self.tasa * 60, 2),
+                "rafaga": self.rafaga,
+                "reserva_interactiva": self.reserva,
+                "tokens_disponibles": round(self._tokens, 2),
+                "pausa_429_restante_seg": round(max(self._pausa_hasta - time.monotonic(), 0.0), 2),
+                "penalizaciones_429": self._penalizaciones,
+                "clases": clases,
+            }
+
+
+planificador = Planificador()
@@ -0,0 +1,252 @@
+"""
+Fusion de vias al agregar rutas (desde /routes, /travels o el catalogo).
+
+Antes cada via entrante se comparaba contra la lista de vias de la ruta
+(`vc not in existente.vias`) y contra todo `vias_detalle` con un any(...):
+cuadratico por ruta, y en rutas con meses de viajes dominaba el tiempo de CPU.
+ViasRuta guarda los codigos en un dict (orden de llegada, busqueda O(1)) y los
+codigos/nombres del detalle en sets, manteniendo la misma regla de duplicado:
+un detalle se descarta si su code o su name ya aparecieron.
+
+La extraccion de vias de un registro crudo (viaCode, objeto via, listas
+ways/vias/routesWays) se hace una vez por registro: vias_de_registro() la
+memoriza por numero de viaje o id de ruta como tuplas compartidas, asi /rutas,
+/rutas_v2, /sedes/{id} y el catalogo no vuelven a parsear el mismo viaje. La
+entrada se descarta si cambian los codigos/nombres de sus vias o si tiene mas
+de VIAS_MEMO_TTL_SEG.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Hashable, Iterable, NamedTuple, Optional
+
+# Registros (viajes + rutas) con vias memorizadas
+VIAS_MEMO_MAX = int(os.getenv("VIAS_MEMO_MAX", "50000"))
+VIAS_MEMO_TTL_SEG = int(os.getenv("VIAS_MEMO_TTL_SEG", "3600"))
+
+
+class Vias(NamedTuple):
+    """Vias extraidas de un registro. Compartida entre requests: no mutar."""
+    codigos: tuple[str, ...]
+    detalle: tuple[dict[str, Any], ...]
+    principal: Optional[str]
+
+
+def _agregar_via(
+    codigos: dict[str, None],
+    detalle: list[dict[str, Any]],
+    code: Optional[str],
+    name: Optional[str],
+    raw: Optional[dict[str, Any]] = None,
+) -> None:
+    if not code and not name:
+        return
+    code_clean = str(code).strip() if code else ""
+    name_clean = str(name).strip() if name else ""
+    if code_clean:
+        codigos.setdefault(code_clean)
+    detalle.append(
+        {
+            "code": code_clean or None,
+            "name": name_clean or None,
+            "raw": raw or {},
+        }
+    )
+
+
+def extraer_vias(item: dict[str, Any]) -> Vias:
+    """
+    Extrae codigos y detalle de vias desde un item (route o travel), sin memoria.
+    """
+    codigos: dict[str, None] = {}  # dict y no set: conserva el orden de aparicion
+    detalle: list[dict[str, Any]] = []
+    principal: Optional[str] = None
+
+    # Campos directos de via
+    via_code = item.get("viaCode") or item.get("via_codigo") or item.get("via_code")
+    via_name = item.get("viaName") or item.get("via_nombre") or item.get("via_name")
+    via_obj = item.get("via") or item.get("way") or item.get("viaObj")
+
+    # Si via es un objeto, extraer sus datos
+    if isinstance(via_obj, dict):
+        via_code = via_code or via_obj.get("code")
+        via_name = via_name or via_obj.get("name")
+        if via_obj.get("code") or via_obj.get("name"):
+            _agregar_via(codigos, detalle, via_obj.get("code"), via_obj.get("name"), raw=via_obj)
+
+    # Listado de ways/vias (puede venir como 'ways', 'vias', 'routesWays')
+    ways = item.get("ways") or item.get("vias") or item.get("routesWays") or []
+    if isinstance(ways, list):
+        for w in ways:
+            if isinstance(w, dict):
+                _agregar_via(codigos, detalle, w.get("code"), w.get("name"), raw=w)
+            elif isinstance(w, str):
+                # Algunos casos retornan lista de codigos directamente
+                _agregar_via(codigos, detalle, w, None, raw={"code": w})
+
+    # Campos sueltos de via principal
+    if via_code or via_name:
+        _agregar_via(codigos, detalle, via_code, via_name, raw=via_obj if isinstance(via_obj, dict) else None)
+
+    # Determinar via principal
+    if via_code:
+        principal = str(via_code)
+    elif codigos:
+        principal = next(iter(codigos))
+
+    return Vias(tuple(codigos), tuple(detalle), principal)
+
+
+def _clave_registro(item: dict[str, Any], tipo: str) -> Optional[tuple[str, str]]:
+    """
+    Clave del memo separada por tipo: un viaje sin numero usa ("travel_id", id)
+    para no chocar con una ruta real del mismo id.
+    """
+    if tipo == "travel":
+        if item.get("number"):
+            return ("travel", str(item["number"]))
+        if item.get("id"):
+            return ("travel_id", str(item["id"]))
+        return None
+    if item.get("id"):
+        return ("route", str(item["id"]))
+    return None
+
+
+def _code_name(obj: Any) -> tuple:
+    if isinstance(obj, dict):
+        return (obj.get("code"), obj.get("name"))
+    return (obj, None)
+
+
+def _huella(item: dict[str, Any]) -> tuple:
+    """Codigos y nombres de todas las vias del registro, tal como los lee extraer_vias()."""
+    via_obj = item.get("via") or item.get("way") or item.get("viaObj")
+    ways = item.get("ways") or item.get("vias") or item.get("routesWays")
+    return (
+        item.get("viaCode") or item.get("via_codigo") or item.get("via_code"),
+        item.get("viaName") or item.get("via_nombre") or item.get("via_name"),
+        _code_name(via_obj),
+        tuple(_code_name(w) for w in ways) if isinstance(ways, list) else (),
+    )
+
+
+_MEMO: "OrderedDict[tuple[str, str], tuple[tuple, float, Vias]]" = OrderedDict()
+_MEMO_LOCK = threading.Lock()
+_MEMO_STATS = {"aciertos": 0, "fallos": 0}
+
+
+def vias_de_registro(item: dict[str, Any], tipo: str = "route") -> Vias:
+    """
+    Vias del registro, memorizadas por numero de viaje o id de ruta (LRU de
+    VIAS_MEMO_MAX entradas, cada una valida VIAS_MEMO_TTL_SEG). tipo es
+    "travel" o "route". Los registros sin numero ni id se parsean siempre.
+    """
+    clave = _clave_registro(item, tipo)
+    if clave is None or VIAS_MEMO_MAX <= 0:
+        return extraer_vias(item)
+    huella = _huella(item)
+    ahora = time.monotonic()
+    with _MEMO_LOCK:
+        entrada = _MEMO.get(clave)
+        if entrada is not None and entrada[0] == huella and entrada[1] > ahora:
+            _MEMO.move_to_end(clave)
+            _MEMO_STATS["aciertos"] += 1
+            return entrada[2]
+    vias = extraer_vias(item)
+    with _MEMO_LOCK:
+        _MEMO_STATS["fallos"] += 1
+        _MEMO[clave] = (huella, ahora + VIAS_MEMO_TTL_SEG, vias)
+        _MEMO.move_to_end(clave)
+        while len(_MEMO) > VIAS_MEMO_MAX:
+            _MEMO.popitem(last=False)
+    return vias
+
+
+def estado_memo() -> dict[str, int]:
+    with _MEMO_LOCK:
+        return {"registros": len(_MEMO), **_MEMO_STATS}
+
+
+class ViasRuta:
+    """Codigos y detalle de vias de una ruta, sin duplicados y en orden de llegada."""
+
+    __slots__ = ("codigos", "detalle", "_codes_detalle", "_names_detalle")
+
+    def __init__(self, codigos: Iterable[Optional[str]] = (), detalle: Iterable[dict[str, Any]] = ()):
+        self.codigos: dict[str, None] = {}
+        self.detalle: list[dict[str, Any]] = []
+        self._codes_detalle: set[str] = set()
+        self._names_detalle: set[str] = set()
+        self.agregar_codigos(codigos)
+        self.agregar_detalle(detalle)
+
+    def agregar_codigos(self, codigos: Iterable[Optional[str]]) -> None:
+        for codigo in codigos:
+            if codigo:
+                self.codigos.setdefault(codigo)
+
+    def agregar_detalle(self, detalle: Iterable[dict[str, Any]]) -> None:
+        for vd in detalle:
+            code = vd.get("code")
+            name = vd.get("name")
+            if (code and code in self._codes_detalle) or (name and name in self._names_detalle):
+                continue
+            self.detalle.append(vd)
+            if code:
+                self._codes_detalle.add(code)
+            if name:
+                self._names_detalle.add(name)
+
+    def lista_codigos(self) -> list[str]:
+        return list(self.codigos)
+
+
+class AgregadorRutas:
+    """
+    Agrupa rutas (modelos con via_codigo, vias y vias_detalle) por clave y
+    fusiona sus vias en tiempo lineal. Conserva el orden de primera aparicion
+    de cada clave; rutas() vuelca las vias acumuladas en cada modelo.
+    """
+
+    def __init__(self):
+        self._rutas: dict[Hashable, tuple[Any, ViasRuta]] = {}
+
+    def __contains__(self, clave: Hashable) -> bool:
+        return clave in self._rutas
+
+    def __len__(self) -> int:
+        return len(self._rutas)
+
+    def poner(self, clave: Hashable, ruta: Any) -> None:
+        """Registra la ruta para la clave (si ya habia una, la reemplaza en su misma posicion)."""
+        self._rutas[clave] = (ruta, ViasRuta(ruta.vias, ruta.vias_detalle))
+
+    def fusionar(
+        self,
+        clave: Hashable,
+        via_codigo: Optional[str],
+        codigos: Iterable[Optional[str]],
+        detalle: Iterable[dict[str, Any]],
+    ) -> None:
+        ruta, vias = self._rutas[clave]
+        if via_codigo and not ruta.via_codigo:
+            ruta.via_codigo = via_codigo
+        vias.agregar_codigos(codigos)
+        vias.agregar_detalle(detalle)
+
+    def agregar(self, clave: Hashable, ruta: Any) -> None:
+        """Fusiona la ruta con la existente para la clave, o la registra si es nueva."""
+        if clave in self._rutas:
+            self.fusionar(clave, ruta.via_codigo, ruta.vias, ruta.vias_detalle)
+        else:
+            self.poner(clave, ruta)
+
+    def rutas(self) -> list[Any]:
+        resultado = []
+        for ruta, vias in self._rutas.values():
+            ruta.vias = vias.lista_codigos()
+            ruta.vias_detalle = vias.detalle
+            resultado.append(ruta)
+        return resultado
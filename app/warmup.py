@@ -0,0 +1,226 @@
+"""
+Precarga al arranque y refresco proactivo de caches CloudFleet.
+
+- precargar(): en segundo plano carga a memoria los snapshots de disco (y arma
+  el indice por ciudad del personal y los agregados del resumen operacional);
+  si faltan o vencieron lanza un refresh
+  en background (refresh_jobs) en lugar de esperar a la primera request.
+- Programador: un hilo que corre tareas periodicas (snapshots, clientes, sedes,
+  rutas). Cada tarea declara cada cuanto corre; si la suma de requests por
+  minuto de todas supera WARMUP_RPM_MAX se estiran los intervalos para dejar
+  el resto del limite de CloudFleet (30 req/min) al trafico interactivo.
+- estado(): lo que reporta /api/ready.
+"""
+import logging
+import math
+import os
+import threading
+import time
+from datetime import datetime
+from typing import Any, Callable, Optional
+
+from app import cloudfleet, refresh_jobs
+from app.snapshots import agregados, indice_ciudad
+from app.upstream import en_segundo_plano
+
+logger = logging.getLogger(__name__)
+
+WARMUP_HABILITADO = os.getenv("WARMUP_HABILITADO", "true").lower() == "true"
+# Requests por minuto que pueden gastar las tareas programadas (de 30 disponibles)
+WARMUP_RPM_MAX = float(os.getenv("WARMUP_RPM_MAX", "6"))
+
+
+class Tarea:
+    """Tarea periodica con costo estimado en requests a CloudFleet."""
+
+    def __init__(
+        self,
+        nombre: str,
+        funcion: Callable[[], Any],
+        cada_seg: int,
+        requests_estimadas: Callable[[], int] | int = 1,
+        alinear_a: Optional[int] = None,
+    ):
+        self.nombre = nombre
+        self.funcion = funcion
+        self.cada_seg = cada_seg
+        # Las caches TTL expiran por ventanas de reloj: alinear la tarea al
+        # inicio de cada ventana deja la cache caliente durante toda la ventana
+        self.alinear_a = alinear_a
+        self._estimadas = requests_estimadas
+        self.requests_medidas: Optional[int] = None
+        self.intervalo_efectivo = cada_seg
+        self.proxima: float = 0.0
+        self.ultima_ejecucion: Optional[str] = None
+        self.ultima_duracion: Optional[float] = None
+        self.ultimo_error: Optional[str] = None
+
+    def requests_por_ejecucion(self) -> int:
+        if self.requests_medidas is not None:
+            return max(self.requests_medidas, 1)
+        estimadas = self._estimadas() if callable(self._estimadas) else self._estimadas
+        return max(int(estimadas), 1)
+
+    def programar(self, ahora: float) -> None:
+        intervalo = self.intervalo_efectivo
+        if self.alinear_a:
+            self.proxima = (ahora // intervalo + 1) * intervalo + 1
+        else:
+            self.proxima = ahora + intervalo
+
+    def resumen(self) -> dict[str, Any]:
+        return {
+            "cada_seg": self.cada_seg,
+            "intervalo_efectivo_seg": self.intervalo_efectivo,
+            "requests_por_ejecucion": self.requests_por_ejecucion(),
+            "proxima": datetime.fromtimestamp(self.proxima).isoformat() if self.proxima else None,
+            "ultima_ejecucion": self.ultima_ejecucion,
+            "ultima_duracion_seg": self.ultima_duracion,
+            "ultimo_error": self.ultimo_error,
+        }
+
+
+def ajustar_intervalos(tareas: list[Tarea], rpm_max: float = WARMUP_RPM_MAX) -> None:
+    """
+    Estira todos los intervalos por el mismo factor si la suma de requests
+    por minuto de las tareas supera rpm_max.
+    """
+    if not tareas:
+        return
+    rpm = sum(t.requests_por_ejecucion() * 60 / t.cada_seg for t in tareas)
+    factor = max(1.0, rpm / rpm_max) if rpm_max > 0 else 1.0
+    for t in tareas:
+        intervalo = t.cada_seg * factor
+        if t.alinear_a:
+            intervalo = math.ceil(intervalo / t.alinear_a) * t.alinear_a
+        t.intervalo_efectivo = int(math.ceil(intervalo))
+    if factor > 1:
+        logger.warning(f"Warmup: {rpm:.1f} req/min supera el presupuesto de {rpm_max}, intervalos x{factor:.1f}")
+
+
+class Programador:
+    def __init__(self):
+        self.tareas: list[Tarea] = []
+        self._stop = threading.Event()
+        self._hilo: Optional[threading.Thread] = None
+
+    def registrar(self, tarea: Tarea) -> None:
+        self.tareas.append(tarea)
+
+    def iniciar(self) -> None:
+        if self._hilo or not self.tareas:
+            return
+        ajustar_intervalos(self.tareas)
+        ahora = time.time()
+        for t in self.tareas:
+            t.programar(ahora)
+        self._stop.clear()
+        self._hilo = threading.Thread(target=self._loop, name="warmup-programador", daemon=True)
+        self._hilo.start()
+
+    def detener(self) -> None:
+        self._stop.set()
+        self._hilo = None
+
+    def _loop(self) -> None:
+        while not self._stop.is_set():
+            espera = max(min(t.proxima for t in self.tareas) - time.time(), 0)
+            if self._stop.wait(timeout=espera):
+                break
+            for t in self.tareas:
+                if t.proxima <= time.time() and not self._stop.is_set():
+                    self._ejecutar(t)
+
+    def _ejecutar(self, tarea: Tarea) -> None:
+        inicio = time.time()
+        antes = cloudfleet.requests_realizadas()
+        try:
+            with en_segundo_plano():
+                tarea.funcion()
+            tarea.ultimo_error = None
+        except Exception as e:
+            logger.warning(f"Warmup: tarea {tarea.nombre} fallo: {e}")
+            tarea.ultimo_error = str(e)
+        # Incluye el trafico concurrente del proceso: sobreestima, lo cual es conservador
+        tarea.requests_medidas = cloudfleet.requests_realizadas() - antes
+        tarea.ultima_duracion = round(time.time() - inicio, 2)
+        tarea.ultima_ejecucion = datetime.fromtimestamp(inicio).isoformat()
+        ajustar_intervalos(self.tareas)
+        tarea.programar(time.time())
+
+
+programador = Programador()
+
+_precarga: dict[str, Any] = {"iniciada": None, "terminada": None, "refresh_job_id": None, "error": None}
+
+
+def paginas_snapshots() -> int:
+    """Paginas que cuesta descargar los snapshots completos (segun su tamano actual)."""
+    total = 0
+    for name in cloudfleet.SNAPSHOTS:
+        registros = cloudfleet.snapshot_en_memoria(name) or 0
+        total += registros // cloudfleet.PAGE_SIZE + 1
+    return total
+
+
+def refrescar_snapshots(espera_max: float = 1800) -> None:
+    """
+    Tarea programada de snapshots: lanza (o se une a) el refresh en background
+    y espera a que termine, para medir su costo real en requests.
+    """
+    job, _ = refresh_jobs.iniciar_refresh()
+    limite = time.time() + espera_max
+    while job.get("job_id") and job.get("estado") == "en_curso" and time.time() < limite:
+        time.sleep(2)
+        job = refresh_jobs.obtener_estado(job["job_id"]) or {}
+    if job.get("estado") == "error":
+        raise RuntimeError("; ".join(job.get("errores") or ["refresh fallido"]))
+    _indexar_snapshots()
+
+
+def _indexar_snapshots() -> list[str]:
+    """Arma indices y agregados de los snapshots cargados. Retorna los que faltan."""
+    cargados = {}
+    for name in cloudfleet.SNAPSHOTS:
+        data = cloudfleet._load_cache(name)
+        if data is not None:
+            cargados[name] = data
+    if "people_all" in cargados:
+        indice_ciudad(cargados["people_all"])
+    if "vehicles_all" in cargados and "people_all" in cargados:
+        agregados(cargados["vehicles_all"], cargados["people_all"])
+    return [name for name in cloudfleet.SNAPSHOTS if name not in cargados]
+
+
+def _precargar() -> None:
+    try:
+        faltantes = _indexar_snapshots()
+        if faltantes:
+            logger.info(f"Warmup: snapshots ausentes o vencidos {faltantes}, lanzando refresh")
+            job, _ = refresh_jobs.iniciar_refresh()
+            _precarga["refresh_job_id"] = job.get("job_id")
+    except Exception as e:
+        logger.warning(f"Warmup: fallo la precarga: {e}")
+        _precarga["error"] = str(e)
+    finally:
+        _precarga["terminada"] = datetime.now().isoformat()
+
+
+def precargar() -> None:
+    """Lanza la precarga de snapshots en segundo plano (no bloquea el arranque)."""
+    _precarga["iniciada"] = datetime.now().isoformat()
+    threading.Thread(target=_precargar, name="warmup-precarga", daemon=True).start()
+
+
+def estado() -> dict[str, Any]:
+    snapshots = {}
+    for name in cloudfleet.SNAPSHOTS:
+        registros = cloudfleet.snapshot_en_memoria(name)
+        snapshots[name] = {"cargado": registros is not None, "registros": registros or 0}
+    return {
+        "listo": all(s["cargado"] for s in snapshots.values()),
+        "snapshots": snapshots,
+        "precarga": dict(_precarga),
+        "presupuesto_rpm": WARMUP_RPM_MAX,
+        "tareas": {t.nombre: t.resumen() for t in programador.tareas},
+    }
@@ -75,7 +75,9 @@ CREATE TABLE viajes (
   estado ENUM('borrador','confirmado','cancelado') DEFAULT 'borrador',
   creado_en TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
   CONSTRAINT fk_viajes_cliente FOREIGN KEY (cliente_id) REFERENCES clientes(id),
-  CONSTRAINT fk_viajes_sede FOREIGN KEY (sede_id) REFERENCES sedes(id)
+  CONSTRAINT fk_viajes_sede FOREIGN KEY (sede_id) REFERENCES sedes(id),
+  -- Reemplazo idempotente del plan y busqueda por rango (_persistir_plan)
+  INDEX ix_viajes_cliente_sede_fecha (cliente_id, sede_id, fecha)
 ) ENGINE=InnoDB;
 
 CREATE TABLE viaje_detalle (
@@ -173,3 +175,120 @@ CREATE TABLE programacion_historial (
   creado_en TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
   CONSTRAINT fk_hist_viaje FOREIGN KEY (viaje_id) REFERENCES viajes(id)
 ) ENGINE=InnoDB;
+
+-- Catalogo persistente de rutas derivado de /routes y /travels (app/route_catalog.py)
+CREATE TABLE ruta_catalogo (
+  id INT AUTO_INCREMENT PRIMARY KEY,
+  cliente_id VARCHAR(64) NOT NULL DEFAULT '',
+  codigo VARCHAR(80) NOT NULL,
+  codigo_norm VARCHAR(80),
+  nombre VARCHAR(200),
+  origen VARCHAR(150) NOT NULL DEFAULT '',
+  destino VARCHAR(150) NOT NULL DEFAULT '',
+  origen_norm VARCHAR(150),
+  destino_norm VARCHAR(150),
+  ciudad_norm VARCHAR(150),
+  ref_id VARCHAR(64),
+  sede_id VARCHAR(64),
+  distancia_km FLOAT,
+  activa TINYINT(1) DEFAULT 1,
+  via_codigo VARCHAR(80),
+  fuente VARCHAR(20) DEFAULT 'routes',
+  datos TEXT,
+  trip_count INT DEFAULT 0,
+  last_seen TIMESTAMP NULL,
+  created_at TIMESTAMP NULL,
+  updated_at TIMESTAMP NULL,
+  CONSTRAINT uq_ruta_catalogo_clave UNIQUE (cliente_id, codigo, origen, destino),
+  INDEX ix_ruta_catalogo_cliente_codigo (cliente_id, codigo),
+  INDEX ix_ruta_catalogo_cliente_codigo_norm (cliente_id, codigo_norm),
+  INDEX ix_ruta_catalogo_origen_norm (origen_norm),
+  INDEX ix_ruta_catalogo_destino_norm (destino_norm),
+  INDEX ix_ruta_catalogo_ciudad_norm (ciudad_norm)
+) ENGINE=InnoDB;
+
+CREATE TABLE ruta_catalogo_via (
+  id INT AUTO_INCREMENT PRIMARY KEY,
+  ruta_id INT NOT NULL,
+  codigo VARCHAR(80) NOT NULL DEFAULT '',
+  nombre VARCHAR(150) NOT NULL DEFAULT '',
+  datos TEXT,
+  trip_count INT DEFAULT 0,
+  last_seen TIMESTAMP NULL,
+  CONSTRAINT fk_ruta_catalogo_via_ruta FOREIGN KEY (ruta_id) REFERENCES ruta_catalogo(id),
+  CONSTRAINT uq_ruta_catalogo_via UNIQUE (ruta_id, codigo, nombre),
+  INDEX ix_ruta_catalogo_via_ruta_id (ruta_id)
+) ENGINE=InnoDB;
+
+-- Viajes ya contados en trip_count (un re-sync no los vuelve a sumar)
+CREATE TABLE ruta_catalogo_viaje (
+  numero VARCHAR(64) PRIMARY KEY,
+  ruta_id INT NOT NULL,
+  visto_en TIMESTAMP NULL,
+  CONSTRAINT fk_ruta_catalogo_viaje_ruta FOREIGN KEY (ruta_id) REFERENCES ruta_catalogo(id),
+  INDEX ix_ruta_catalogo_viaje_ruta_id (ruta_id)
+) ENGINE=InnoDB;
+
+-- Ultima sincronizacion con la API por alcance (cliente|ciudad|ruta|via)
+CREATE TABLE ruta_catalogo_sync (
+  alcance VARCHAR(255) PRIMARY KEY,
+  sincronizado_en TIMESTAMP NULL,
+  rutas INT DEFAULT 0
+) ENGINE=InnoDB;
+
+-- Contadores de carga por vehiculo o persona al confirmar viajes (app/carga.py)
+CREATE TABLE carga_recurso (
+  clase VARCHAR(10) NOT NULL,
+  recurso_id VARCHAR(50) NOT NULL,
+  ultima_fecha DATE NULL,
+  racha INT DEFAULT 0,
+  semana DATE NULL,
+  viajes_semana INT DEFAULT 0,
+  viajes_total INT DEFAULT 0,
+  updated_at TIMESTAMP NULL,
+  PRIMARY KEY (clase, recurso_id)
+) ENGINE=InnoDB;
+
+-- Cola local de jobs de scheduling (app/jobs.py)
+CREATE TABLE trabajos (
+  id VARCHAR(32) PRIMARY KEY,
+  tipo VARCHAR(40) NOT NULL,
+  estado VARCHAR(20) NOT NULL DEFAULT 'pendiente',
+  parametros TEXT NOT NULL,
+  resultado LONGTEXT,
+  codigo_http INT,
+  error TEXT,
+  intentos INT DEFAULT 0,
+  worker VARCHAR(64),
+  creado_en TIMESTAMP NULL,
+  iniciado_en TIMESTAMP NULL,
+  latido_en TIMESTAMP NULL,
+  terminado_en TIMESTAMP NULL,
+  INDEX ix_trabajos_estado_creado (estado, creado_en)
+) ENGINE=InnoDB;
+
+-- Borradores de pre-programacion (payload_z comprimido; version sube con cada guardado)
+CREATE TABLE dispatch_drafts (
+  id VARCHAR(50) PRIMARY KEY,
+  cliente_id VARCHAR(50) NOT NULL,
+  sede_id VARCHAR(50) NOT NULL,
+  fecha DATE NOT NULL,
+  payload TEXT NOT NULL,
+  payload_z LONGBLOB,
+  status VARCHAR(20) DEFAULT 'DRAFT',
+  created_at TIMESTAMP NULL,
+  updated_at TIMESTAMP NULL,
+  version INT NOT NULL DEFAULT 1,
+  payload_version INT NOT NULL DEFAULT 1,
+  INDEX ix_dispatch_drafts_cliente_fecha_sede (cliente_id, fecha, sede_id, status)
+) ENGINE=InnoDB;
+
+-- JSON Patch que lleva un borrador de version - 1 a version, hasta la proxima compactacion
+CREATE TABLE dispatch_draft_deltas (
+  id INT AUTO_INCREMENT PRIMARY KEY,
+  draft_id VARCHAR(50) NOT NULL,
+  version INT NOT NULL,
+  patch TEXT NOT NULL,
+  created_at TIMESTAMP NULL,
+  CONSTRAINT uq_dispatch_draft_deltas_version UNIQUE (draft_id, version)
+) ENGINE=InnoDB;